@@ -1,59 +1,96 @@
 import os
-import logging
 from dotenv import load_dotenv
 
 from flask import Flask
 from werkzeug.middleware.proxy_fix import ProxyFix
 
+from config.logging_config import setup_logging, init_app as init_logging
+from services.storage import get_storage_backend_name, get_storage_service
+
 # Cargar variables de entorno desde .env
 load_dotenv()
 
-# Configure logging for debugging
-logging.basicConfig(level=logging.INFO)
+# Logging con niveles (LOG_LEVEL), escrito desde un hilo aparte
+setup_logging()
 
 # Create the app
 app = Flask(__name__)
 app.secret_key = os.environ.get("SESSION_SECRET", "dev-secret-key-change-in-production")
 app.wsgi_app = ProxyFix(app.wsgi_app, x_proto=1, x_host=1)
+# gzip/brotli para HTML y JSON (no toca streaming, SSE ni lo ya comprimido)
+from services.compression import wrap as compress_responses
+app.wsgi_app = compress_responses(app.wsgi_app)
+
+# Sesiones en el servidor: la cookie solo lleva un id opaco
+from services.sessions import init_app as init_sessions
+init_sessions(app)
+
+# Id de petición (X-Request-ID) en cada registro de log
+init_logging(app)
+
+# Latencia por ruta para /metrics y trazas con Server-Timing
+from services.metrics import init_app as init_metrics
+from services.tracing import init_app as init_tracing
+init_metrics(app)
+init_tracing(app)
+
+# Archivos estáticos con hash (python -m services.assets): immutable y precomprimidos
+from services.assets import init_app as init_assets
+init_assets(app)
+
+# Perfiles bajo demanda (cProfile con token firmado) y muestreo de pilas
+from services.profiling import init_app as init_profiling
+init_profiling(app)
 
 # Verificar si Supabase está configurado
 SUPABASE_URL = os.environ.get("SUPABASE_URL")
 SUPABASE_KEY = os.environ.get("SUPABASE_KEY")
 SUPABASE_ANON_KEY = os.environ.get("SUPABASE_ANON_KEY")
+SUPABASE_FAKE = os.environ.get("SUPABASE_FAKE", "false").lower() == "true"
 
-if SUPABASE_URL and SUPABASE_KEY:
-    # Usar Supabase
-    print("🔗 Configurando Supabase...")
-    try:
-        from config.supabase_config import test_supabase_connection
-        if test_supabase_connection():
-            print("✅ Supabase configurado correctamente")
-            USE_SUPABASE = True
-        else:
-            print("❌ Error en Supabase. Verifica tu configuración.")
+# Backend de almacenamiento: 'supabase' o 'sqlite' (embebido, sin red)
+STORAGE_BACKEND = get_storage_backend_name()
+USE_SUPABASE = STORAGE_BACKEND == "supabase"
+
+if USE_SUPABASE:
+    if (SUPABASE_URL and SUPABASE_KEY) or SUPABASE_FAKE:
+        # Usar Supabase (o su sustituto en memoria con SUPABASE_FAKE=true)
+        print("🔗 Configurando Supabase...")
+        try:
+            from config.supabase_config import test_supabase_connection
+            if test_supabase_connection():
+                print("✅ Supabase configurado correctamente")
+            else:
+                print("❌ Error en Supabase. Verifica tu configuración.")
+                USE_SUPABASE = False
+        except Exception as e:
+            print(f"❌ Error configurando Supabase: {e}")
             USE_SUPABASE = False
-    except Exception as e:
-        print(f"❌ Error configurando Supabase: {e}")
+    else:
+        # No hay configuración de Supabase
+        print("❌ No se encontró configuración de Supabase")
+        print("📝 Asegúrate de tener las variables SUPABASE_URL y SUPABASE_KEY en tu archivo .env")
         USE_SUPABASE = False
-else:
-    # No hay configuración de Supabase
-    print("❌ No se encontró configuración de Supabase")
-    print("📝 Asegúrate de tener las variables SUPABASE_URL y SUPABASE_KEY en tu archivo .env")
-    USE_SUPABASE = False
 
-# Configurar variables de Supabase para el frontend
-app.config['SUPABASE_URL'] = SUPABASE_URL
-app.config['SUPABASE_ANON_KEY'] = SUPABASE_ANON_KEY
+    if not USE_SUPABASE:
+        print("❌ No se puede iniciar la aplicación sin Supabase configurado")
+        print("📝 Configura Supabase en tu archivo .env o usa STORAGE_BACKEND=sqlite")
+        exit(1)
+
+# Administradores (endpoints de diagnóstico): emails separados por comas o token Bearer
+ADMIN_EMAILS = {e.strip().lower() for e in os.environ.get("ADMIN_EMAILS", "").split(",") if e.strip()}
+ADMIN_TOKEN = os.environ.get("ADMIN_TOKEN")
+
+# Segundos que navegadores y proxies pueden reutilizar la landing de los visitantes anónimos
+LANDING_MAX_AGE = int(os.environ.get("LANDING_MAX_AGE", "300"))
+
+# Configurar variables de Supabase para el frontend (vacías si no se usa Supabase)
+app.config['SUPABASE_URL'] = SUPABASE_URL if USE_SUPABASE and not SUPABASE_FAKE else ''
+app.config['SUPABASE_ANON_KEY'] = SUPABASE_ANON_KEY if USE_SUPABASE and not SUPABASE_FAKE else ''
 
 # Configurar base de datos
-if USE_SUPABASE:
-    # Importar servicio de Supabase
-    from services.supabase_service import supabase_service
-    print("✅ Aplicación configurada con Supabase")
-else:
-    print("❌ No se puede iniciar la aplicación sin Supabase configurado")
-    print("📝 Por favor, configura Supabase en tu archivo .env")
-    exit(1)
+storage_service = get_storage_service()
+print(f"✅ Aplicación configurada con {storage_service.name}")
 
 # Import routes
 from routes import *
@@ -0,0 +1,130 @@
+#!/usr/bin/env python3
+"""
+Configuración de logging: niveles, formato estructurado (JSON o texto), id de
+petición en cada registro, muestreo de DEBUG y escritura en un hilo aparte
+"""
+
+import atexit
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import random
+import sys
+import uuid
+from contextvars import ContextVar
+from datetime import datetime, timezone
+from dotenv import load_dotenv
+
+# Cargar variables de entorno desde .env
+load_dotenv()
+
+LOG_LEVEL = os.environ.get("LOG_LEVEL", "INFO").upper()
+LOG_FORMAT = os.environ.get("LOG_FORMAT", "text").lower()   # text | json
+# Fracción de registros DEBUG que se emiten (los eventos ruidosos se muestrean)
+LOG_DEBUG_SAMPLE_RATE = float(os.environ.get("LOG_DEBUG_SAMPLE_RATE", "1.0"))
+
+request_id_var = ContextVar('request_id', default='-')
+
+# Atributos estándar de LogRecord; el resto viene de extra={...}
+_RECORD_ATTRS = set(vars(logging.LogRecord('', 0, '', 0, '', (), None))) | {'message', 'asctime', 'request_id'}
+
+
+class RequestIdFilter(logging.Filter):
+    """Añade el id de la petición actual (se ejecuta en el hilo de la petición)"""
+
+    def filter(self, record):
+        record.request_id = request_id_var.get()
+        return True
+
+
+class DebugSamplingFilter(logging.Filter):
+    """Deja pasar solo una fracción de los registros DEBUG"""
+
+    def __init__(self, rate):
+        super().__init__()
+        self.rate = rate
+
+    def filter(self, record):
+        return record.levelno > logging.DEBUG or self.rate >= 1 or random.random() < self.rate
+
+
+class JSONFormatter(logging.Formatter):
+    """Un objeto JSON por línea con los campos de extra={...}"""
+
+    def format(self, record):
+        data = {
+            'ts': datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'logger': record.name,
+            'request_id': getattr(record, 'request_id', '-'),
+            'msg': record.getMessage(),
+        }
+        for key, value in vars(record).items():
+            if key not in _RECORD_ATTRS and not key.startswith('_'):
+                data[key] = value
+        if record.exc_info:
+            data['exc'] = self.formatException(record.exc_info)
+        return json.dumps(data, ensure_ascii=False, default=str)
+
+
+class DeferredQueueHandler(logging.handlers.QueueHandler):
+    """
+    QueueHandler que no formatea en el hilo que registra: el mensaje (con sus
+    argumentos perezosos) se formatea y escribe en el hilo del QueueListener
+    """
+
+    def prepare(self, record):
+        return record
+
+
+_listener = None
+
+
+def setup_logging():
+    """Instala el handler en cola sobre el logger raíz (una sola vez)"""
+    global _listener
+    if _listener is not None:
+        return
+
+    stream = logging.StreamHandler(sys.stderr)
+    if LOG_FORMAT == 'json':
+        stream.setFormatter(JSONFormatter())
+    else:
+        stream.setFormatter(logging.Formatter(
+            "%(asctime)s %(levelname)s [%(request_id)s] %(name)s: %(message)s"))
+
+    handler = DeferredQueueHandler(queue.SimpleQueue())
+    handler.addFilter(RequestIdFilter())
+    if LOG_DEBUG_SAMPLE_RATE < 1:
+        handler.addFilter(DebugSamplingFilter(LOG_DEBUG_SAMPLE_RATE))
+
+    root = logging.getLogger()
+    for existing in list(root.handlers):
+        root.removeHandler(existing)
+    root.addHandler(handler)
+    root.setLevel(LOG_LEVEL)
+
+    _listener = logging.handlers.QueueListener(handler.queue, stream, respect_handler_level=True)
+    _listener.start()
+    atexit.register(_listener.stop)
+
+
+def init_app(app):
+    """Asigna un id a cada petición (o reutiliza X-Request-ID) y lo devuelve en la respuesta"""
+    from flask import g, request
+
+    @app.before_request
+    def _assign_request_id():
+        incoming = request.headers.get('X-Request-ID', '')
+        request_id = incoming if 0 < len(incoming) <= 64 else uuid.uuid4().hex[:16]
+        g._request_id_token = request_id_var.set(request_id)
+
+    @app.after_request
+    def _return_request_id(response):
+        response.headers['X-Request-ID'] = request_id_var.get()
+        token = g.pop('_request_id_token', None)
+        if token is not None:
+            request_id_var.reset(token)
+        return response
@@ -0,0 +1,32 @@
+#!/usr/bin/env python3
+"""
+Configuración opcional de Redis para compartir estado entre workers
+"""
+
+import logging
+import os
+from dotenv import load_dotenv
+
+# Cargar variables de entorno desde .env
+load_dotenv()
+
+REDIS_URL = os.environ.get("REDIS_URL")
+
+logger = logging.getLogger(__name__)
+
+redis_client = None
+
+def get_redis_client():
+    """Retorna el cliente de Redis, o None si no está configurado o disponible"""
+    global redis_client
+    if not REDIS_URL:
+        return None
+
+    if redis_client is None:
+        try:
+            import redis
+        except ImportError:
+            logger.warning("REDIS_URL está configurado pero el paquete 'redis' no está instalado")
+            return None
+        redis_client = redis.Redis.from_url(REDIS_URL)
+    return redis_client
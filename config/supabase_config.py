@@ -3,32 +3,51 @@
 Configuración para Supabase
 """
 
+import logging
 import os
 from dotenv import load_dotenv
-from supabase import create_client, Client
+from supabase import create_client, Client, ClientOptions
 
 # Cargar variables de entorno desde .env
 load_dotenv()
 
+logger = logging.getLogger(__name__)
+
 # Configuración de Supabase
 SUPABASE_URL = os.environ.get("SUPABASE_URL")
 SUPABASE_KEY = os.environ.get("SUPABASE_KEY")
 
+# Usar el sustituto en memoria (services/fakes/supabase.py) en lugar de Supabase
+SUPABASE_FAKE = os.environ.get("SUPABASE_FAKE", "false").lower() == "true"
+
 supabase = None
 
 def get_supabase_client() -> Client:
     """Crea y retorna el cliente de Supabase"""
     global supabase
+    if SUPABASE_FAKE:
+        if supabase is None:
+            from services.fakes.supabase import FakeSupabaseClient
+            supabase = FakeSupabaseClient()
+            logger.info("Usando Supabase simulado en memoria")
+        return supabase
     if not SUPABASE_URL or not SUPABASE_KEY:
         raise ValueError("SUPABASE_URL y SUPABASE_KEY deben estar configurados")
     
     try:
         # Intentar crear cliente con configuración estándar
         if supabase is None:
-            supabase = create_client(SUPABASE_URL, SUPABASE_KEY)
+            # Con CASSETTE_MODE=record|replay el tráfico pasa por un cassette
+            from services.fakes.cassette import cassette_http_client
+            http_client = cassette_http_client('supabase')
+            if http_client is not None:
+                supabase = create_client(SUPABASE_URL, SUPABASE_KEY,
+                                         options=ClientOptions(httpx_client=http_client))
+            else:
+                supabase = create_client(SUPABASE_URL, SUPABASE_KEY)
         return supabase
     except Exception as e:
-        print(f"Error con configuración estándar: {e}")
+        logger.warning("Error con configuración estándar: %s", e)
         # Si falla, intentar con configuración SSL deshabilitada
         try:
             import httpx
@@ -39,7 +58,7 @@ def get_supabase_client() -> Client:
                 options={'httpx_client': http_client}
             )
         except Exception as e2:
-            print(f"Error con SSL deshabilitado: {e2}")
+            logger.error("Error con SSL deshabilitado: %s", e2)
             raise e2
 
 def test_supabase_connection():
@@ -50,21 +69,15 @@ def test_supabase_connection():
         # Intentar hacer una consulta simple a la tabla users
         response = supabase.table('users').select('*').limit(1).execute()
         
-        print("✅ Conexión a Supabase exitosa")
-        print(f"📊 Tabla 'users' encontrada")
-        
         # Verificar también la tabla phrases
         response = supabase.table('phrases').select('*').limit(1).execute()
-        print(f"📊 Tabla 'phrases' encontrada")
+        logger.debug("Conexión a Supabase exitosa; tablas 'users' y 'phrases' encontradas")
         
         return True
         
-    except Exception as e:
-        print(f"❌ Error conectando a Supabase: {e}")
-        print(f"Tipo de error: {type(e)}")
-        import traceback
-        traceback.print_exc()
-        print("💡 Asegúrate de que las tablas 'users' y 'phrases' existan en tu base de datos")
+    except Exception:
+        logger.exception("Error conectando a Supabase. Asegúrate de que las tablas 'users' y "
+                         "'phrases' existan en tu base de datos")
         return False
 
 def create_tables_supabase():
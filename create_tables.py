@@ -53,6 +53,8 @@ def create_tables():
         create_indexes = """
         CREATE INDEX IF NOT EXISTS idx_phrases_user_id ON public.phrases(user_id);
         CREATE INDEX IF NOT EXISTS idx_phrases_created_at ON public.phrases(created_at);
+        -- Paginación de la colección por (created_at, id)
+        CREATE INDEX IF NOT EXISTS idx_phrases_user_created ON public.phrases(user_id, created_at DESC, id DESC);
         """
         
         # Habilitar RLS
@@ -2,52 +2,171 @@
 """
 Modelos de datos para la aplicación
 Definiciones de estructuras de datos compatibles con Supabase
+
+Los modelos usan __slots__ y son inmutables: ocupan bastante menos memoria que
+los dict de PostgREST y se pueden compartir entre hilos y cachés. Las fechas se
+guardan tal como vienen de la DB (texto ISO) y solo se convierten a datetime
+cuando se leen created/updated, así que construirlos y serializarlos es barato.
 """
 
 from datetime import datetime
 from typing import Optional, Dict, Any
-from dataclasses import dataclass, asdict
 
-@dataclass
-class User:
+
+def parse_datetime(value):
+    """Texto ISO 8601 de la DB (con 'Z' o desplazamiento) a datetime; None y datetime tal cual"""
+    if value is None or isinstance(value, datetime):
+        return value
+    if value.endswith('Z'):
+        value = value[:-1] + '+00:00'
+    return datetime.fromisoformat(value)
+
+
+class lazy_datetime:
+    """Atributo datetime calculado desde una columna ISO la primera vez que se lee"""
+
+    def __init__(self, source):
+        self.source = source
+
+    def __set_name__(self, owner, name):
+        self.slot = '_' + name
+
+    def __get__(self, obj, owner=None):
+        if obj is None:
+            return self
+        try:
+            return getattr(obj, self.slot)
+        except AttributeError:
+            value = parse_datetime(getattr(obj, self.source))
+            object.__setattr__(obj, self.slot, value)
+            return value
+
+
+class Model:
+    """
+    Base de los modelos: campos en slots, inmutables y construcción tolerante desde
+    filas de la DB. Cada subclase declara `_fields` como (campo, valor por defecto)
+    y `_aliases` con las columnas de la DB que se leen con otro nombre.
+    """
+
+    __slots__ = ()
+    _fields = ()
+    _aliases = {}
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        cls._field_names = tuple(name for name, _ in cls._fields)
+        # Columnas de las que se lee cada campo, en orden de preferencia: su nombre y sus alias
+        cls._columns = tuple(
+            (name, (name,) + tuple(column for column, field in cls._aliases.items() if field == name), default)
+            for name, default in cls._fields)
+
+    def __init__(self, **values):
+        for name, default in self._fields:
+            object.__setattr__(self, name, values.pop(name, default))
+        if values:
+            raise TypeError(f"{type(self).__name__}: campos desconocidos {sorted(values)}")
+
+    @classmethod
+    def from_row(cls, row):
+        """Crea el modelo desde una fila (dict o sqlite3.Row); ignora las columnas desconocidas"""
+        if isinstance(row, cls):
+            return row
+        if not isinstance(row, dict):
+            row = dict(row)
+        obj = object.__new__(cls)
+        for name, columns, default in cls._columns:
+            value = default
+            for column in columns:
+                if column in row:
+                    value = row[column]
+                    break
+            object.__setattr__(obj, name, value)
+        return obj
+
+    @classmethod
+    def from_rows(cls, rows):
+        return [cls.from_row(row) for row in rows]
+
+    # Compatibilidad con el constructor anterior
+    from_dict = from_row
+
+    def replace(self, **changes):
+        """Copia con algunos campos cambiados (los modelos no se modifican)"""
+        values = self.to_dict()
+        values.update(changes)
+        return type(self)(**values)
+
+    def to_dict(self) -> Dict[str, Any]:
+        """Convierte el modelo a diccionario (las fechas quedan como vienen de la DB)"""
+        return {name: getattr(self, name) for name in self._field_names}
+
+    def __setattr__(self, name, value):
+        raise AttributeError(f"{type(self).__name__} es inmutable; usa replace()")
+
+    def __delattr__(self, name):
+        raise AttributeError(f"{type(self).__name__} es inmutable")
+
+    def __eq__(self, other):
+        if type(other) is not type(self):
+            return NotImplemented
+        return all(getattr(self, name) == getattr(other, name) for name in self._field_names)
+
+    def __hash__(self):
+        return hash((type(self), self.id))
+
+    def __getstate__(self):
+        return self.to_dict()
+
+    def __setstate__(self, state):
+        for name, default in self._fields:
+            object.__setattr__(self, name, state.get(name, default))
+
+
+class User(Model):
     """Modelo de usuario"""
+
+    __slots__ = ('id', 'email', 'user_name', 'created_at', 'updated_at', '_created', '_updated')
+    _fields = (('id', None), ('email', None), ('user_name', None), ('created_at', None), ('updated_at', None))
+    _aliases = {'full_name': 'user_name'}
+
     id: str
     email: str
-    full_name: Optional[str] = None
-    created_at: Optional[datetime] = None
-    updated_at: Optional[datetime] = None
-    
-    def to_dict(self) -> Dict[str, Any]:
-        """Convierte el modelo a diccionario"""
-        return asdict(self)
-    
-    @classmethod
-    def from_dict(cls, data: Dict[str, Any]) -> 'User':
-        """Crea un usuario desde un diccionario"""
-        return cls(**data)
+    user_name: Optional[str]
+    created_at: Optional[str]
+    updated_at: Optional[str]
 
-@dataclass
-class Phrase:
+    created = lazy_datetime('created_at')
+    updated = lazy_datetime('updated_at')
+
+    def __repr__(self) -> str:
+        return f'<User {self.id}: {self.email}>'
+
+
+class Phrase(Model):
     """Modelo de frase poética"""
+
+    __slots__ = ('id', 'user_id', 'original_emotion', 'style', 'generated_phrase', 'language',
+                 'is_favorite', 'created_at', 'updated_at', '_created', '_updated')
+    _fields = (('id', None), ('user_id', None), ('original_emotion', ''), ('style', None),
+               ('generated_phrase', ''), ('language', 'es'), ('is_favorite', False),
+               ('created_at', None), ('updated_at', None))
+    # La columna de la DB se llama 'phrase'
+    _aliases = {'phrase': 'generated_phrase'}
+
     id: str
     user_id: str
     original_emotion: str
     style: str
     generated_phrase: str
-    language: str = 'es'
-    is_favorite: bool = False
-    created_at: Optional[datetime] = None
-    updated_at: Optional[datetime] = None
-    
-    def to_dict(self) -> Dict[str, Any]:
-        """Convierte el modelo a diccionario"""
-        return asdict(self)
-    
-    @classmethod
-    def from_dict(cls, data: Dict[str, Any]) -> 'Phrase':
-        """Crea una frase desde un diccionario"""
-        return cls(**data)
-    
+    language: str
+    is_favorite: bool
+    created_at: Optional[str]
+    updated_at: Optional[str]
+
+    created = lazy_datetime('created_at')
+    updated = lazy_datetime('updated_at')
+
     def __repr__(self) -> str:
         return f'<Phrase {self.id}: {self.generated_phrase[:30]}...>'
 
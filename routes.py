@@ -1,104 +1,216 @@
-from flask import render_template, request, redirect, url_for, flash, jsonify, session
-from app import app, USE_SUPABASE
-from services.openai_service import generate_poetic_phrase
+import hmac
+import logging
+import math
+from datetime import datetime, timezone
+from flask import render_template, request, redirect, url_for, flash, jsonify, session, make_response, g, Response, send_from_directory, abort, stream_template
+from app import app, storage_service, ADMIN_EMAILS, ADMIN_TOKEN, LANDING_MAX_AGE
+from services.openai_service import generate_poetic_phrase, MODEL, COMPLETIONS_PER_GENERATION
+from services.rate_limit import (check_generation_allowed, refund_generation, RATE_LIMIT_ENABLED,
+                                 RATE_LIMIT_MODEL_BURST)
+from services.idempotency import idempotency_store
+from services.metrics import metrics, METRICS_ENABLED, METRICS_TOKEN
+from services import profiling
+from services.serialization import json_response
+from services.storage import (COLLECTION_PAGE_SIZE, COLLECTION_MAX_PAGE_SIZE, COLLECTION_STREAM_PAGES,
+                              PHRASE_BATCH_MAX_SIZE, PhrasePageStream)
+from services.data_version import data_versions, APP_RELEASE
+from services.sessions import regenerate_session_id
+from services.tokens import TokenManager
+from services.fragment_cache import fragment_cache
+from markupsafe import Markup
 from functools import wraps
+from werkzeug.http import is_resource_modified
 
-# Importar servicios según configuración
-if USE_SUPABASE:
-    from services.supabase_service import supabase_service
-    from config.supabase_config import get_supabase_client
-    
-    # Función para probar la conexión con Supabase
-    def test_supabase_connection():
-        """Prueba la conexión con Supabase y las tablas necesarias"""
-        try:
-            print("🔄 Probando conexión con Supabase...")
-            supabase = get_supabase_client()
-            
-            # Probar tabla users
-            response = supabase.table('users').select('*').limit(1).execute()
-            print("✅ Conexión con tabla 'users' exitosa")
-            
-            # Probar tabla phrases
-            response = supabase.table('phrases').select('*').limit(1).execute()
-            print("✅ Conexión con tabla 'phrases' exitosa")
-            
-            return True
-        except Exception as e:
-            print(f"❌ Error de conexión con Supabase: {e}")
-            return False
-else:
-    from app import db
-    from models import Phrase
+logger = logging.getLogger(__name__)
+
+# Renovación anticipada de los tokens de Auth guardados en la sesión
+token_manager = TokenManager(storage_service)
+
+# Peor caso de /generate: la generación y, si choca con la DB, una segunda
+GENERATE_MAX_COMPLETIONS = 2 * COMPLETIONS_PER_GENERATION
+if RATE_LIMIT_ENABLED and RATE_LIMIT_MODEL_BURST < GENERATE_MAX_COMPLETIONS:
+    # Con menos capacidad que la reserva de una petición, /generate respondería siempre 429
+    raise ValueError(f"RATE_LIMIT_MODEL_BURST ({RATE_LIMIT_MODEL_BURST:g}) debe ser al menos "
+                     f"{GENERATE_MAX_COMPLETIONS}: cada /generate reserva 2 × (1 + MAX_GENERATION_ATTEMPTS) "
+                     f"completions")
+
+# Tamaño de cada escritura de las páginas en streaming
+STREAM_BUFFER_BYTES = 4096
+
+# Landing anónima ya renderizada, por raíz de la aplicación (no depende de la sesión)
+_anonymous_landing = {}
 
 # Decorador para verificar autenticación
 def login_required(f):
     @wraps(f)
     def decorated_function(*args, **kwargs):
-        if USE_SUPABASE:
-            # Verificar autenticación en Supabase
-            supabase = get_supabase_client()
-            try:
-                # Restaurar sesión si tenemos tokens guardados
-                access_token = session.get('sb_access_token')
-                refresh_token = session.get('sb_refresh_token')
-                if access_token and refresh_token:
-                    try:
-                        if hasattr(supabase.auth, 'set_session'):
-                            supabase.auth.set_session(access_token, refresh_token)
-                        elif hasattr(supabase.auth, 'set_auth'):
-                            supabase.auth.set_auth(access_token)
-                    except Exception as e:
-                        print(f"Error restaurando sesión: {e}")
-                        # Si falla la restauración, limpiar tokens y redirigir
-                        session.pop('sb_access_token', None)
-                        session.pop('sb_refresh_token', None)
-                        return redirect(url_for('landing'))
-
-                user = supabase.auth.get_user()
-                if not user or not user.user:
-                    print("❌ Usuario no encontrado en el decorador")
-                    # Si no hay usuario después de intentar restaurar la sesión, limpiar tokens
+        try:
+            # Restaurar sesión si tenemos tokens guardados (renovados antes de que caduquen)
+            access_token = token_manager.fresh_access_token(session)
+            refresh_token = session.get('sb_refresh_token')
+            if refresh_token and not access_token:
+                logger.info("No se pudo renovar el token; redirigiendo a la landing")
+                session.pop('sb_access_token', None)
+                session.pop('sb_refresh_token', None)
+                return redirect(url_for('landing'))
+            if access_token and refresh_token:
+                try:
+                    storage_service.restore_session(access_token, refresh_token)
+                except Exception as e:
+                    logger.warning("Error restaurando sesión: %s", e)
+                    # Si falla la restauración, limpiar tokens y redirigir
                     session.pop('sb_access_token', None)
                     session.pop('sb_refresh_token', None)
                     return redirect(url_for('landing'))
-                
-                print(f"✅ Usuario autenticado en decorador: {user.user.id}")
-                return f(*args, **kwargs)
-            except Exception as e:
-                print(f"❌ Error en decorador login_required: {e}")
-                return redirect(url_for('landing'))
-        else:
-            # Verificar nombre de usuario en cookies (modo legacy)
-            user_name = request.cookies.get('user_name', '')
-            if not user_name:
+
+            user = storage_service.get_auth_user(access_token)
+            if not user or not user.user:
+                logger.info("Sesión sin usuario válido; redirigiendo a la landing")
+                # Si no hay usuario después de intentar restaurar la sesión, limpiar tokens
+                session.pop('sb_access_token', None)
+                session.pop('sb_refresh_token', None)
                 return redirect(url_for('landing'))
+            
+            g.user_id = user.user.id
             return f(*args, **kwargs)
+        except Exception as e:
+            logger.exception("Error en decorador login_required")
+            return redirect(url_for('landing'))
     return decorated_function
 
+def admin_required(f):
+    """Solo administradores: token Bearer ADMIN_TOKEN o sesión con email en ADMIN_EMAILS"""
+    @wraps(f)
+    def decorated_function(*args, **kwargs):
+        auth = request.headers.get('Authorization', '')
+        if ADMIN_TOKEN and hmac.compare_digest(auth, f"Bearer {ADMIN_TOKEN}"):
+            return f(*args, **kwargs)
+        access_token = session.get('sb_access_token')
+        if access_token and ADMIN_EMAILS:
+            try:
+                user = storage_service.get_auth_user(access_token)
+            except Exception:
+                user = None
+            email = (getattr(user.user, 'email', '') or '').lower() if user and user.user else ''
+            if email in ADMIN_EMAILS:
+                return f(*args, **kwargs)
+        # No revelar que el endpoint existe
+        abort(404)
+    return decorated_function
+
+def current_user_id():
+    """ID del usuario autenticado; login_required ya lo resolvió para esta petición"""
+    user_id = g.get('user_id')
+    if user_id:
+        return user_id
+    user = storage_service.get_auth_user(session.get('sb_access_token'))
+    return user.user.id if user and user.user else None
+
+def conditional_get(f):
+    """
+    GET condicional por usuario: ETag débil y Last-Modified a partir de la versión de
+    sus datos (se incrementa en cada escritura). Si el navegador ya tiene la versión
+    actual responde 304 sin consultar la DB ni renderizar. Va después de login_required.
+    """
+    @wraps(f)
+    def decorated_function(*args, **kwargs):
+        user_id = g.get('user_id')
+        # Los mensajes flash pendientes se muestran una sola vez: la página no es la misma
+        if not user_id or request.method != 'GET' or session.get('_flashes'):
+            return f(*args, **kwargs)
+        
+        etag, modified_at = data_versions.validators(user_id, APP_RELEASE, request.full_path)
+        last_modified = datetime.fromtimestamp(int(modified_at), timezone.utc)
+        if is_resource_modified(request.environ, etag=etag, last_modified=last_modified):
+            response = make_response(f(*args, **kwargs))
+            if response.status_code != 200:
+                return response
+        else:
+            response = Response(status=304)
+        
+        response.set_etag(etag, weak=True)
+        response.last_modified = last_modified
+        response.headers['Cache-Control'] = 'private, no-cache'
+        response.vary.add('Cookie')
+        return response
+    return decorated_function
+
+def cached_fragment(user_id, fragment, template, load_context):
+    """
+    HTML de templates/partials/<template> para el usuario. load_context() hace las
+    consultas y solo se llama si el fragmento no está en la caché para la versión
+    actual de sus datos.
+    """
+    def render():
+        return render_template(f'partials/{template}', **load_context())
+    if fragment_cache is None:
+        return Markup(render())
+    return fragment_cache.render(user_id, fragment, render)
+
+def buffered_stream(chunks, size=STREAM_BUFFER_BYTES):
+    """Agrupa la salida de una plantilla en streaming (muchos trozos pequeños) en escrituras de ~size bytes"""
+    buffer, length = [], 0
+    for chunk in chunks:
+        buffer.append(chunk)
+        length += len(chunk)
+        if length >= size:
+            yield ''.join(buffer)
+            buffer, length = [], 0
+    if buffer:
+        yield ''.join(buffer)
+
+def render_collection(user_id, fragment, filters, **context):
+    """
+    Página de la colección con los filtros de list_phrases. Con COLLECTION_STREAM_PAGES
+    se envía el esqueleto en cuanto se renderiza y después las tarjetas a medida que
+    se leen las páginas de la DB; si no, solo la primera página, desde la caché de
+    fragmentos. En ambos casos main.js carga el resto desde /api/phrases.
+    """
+    # Obtener nombre de usuario
+    user_info = storage_service.get_user_info(user_id)
+    user_name = (user_info.user_name or 'Usuario') if user_info else 'Usuario'
+    
+    if COLLECTION_STREAM_PAGES:
+        phrase_pages = PhrasePageStream(storage_service, user_id, COLLECTION_STREAM_PAGES, **filters)
+        chunks = stream_template('collection.html', phrase_pages=phrase_pages, user_name=user_name, **context)
+        return Response(buffered_stream(chunks), mimetype='text/html')
+    
+    def load_context():
+        phrases, next_cursor = storage_service.list_phrases(user_id, **filters)
+        return {'phrases': phrases, 'next_cursor': next_cursor, **context}
+    phrase_list = cached_fragment(user_id, fragment, 'phrase_list.html', load_context)
+    return render_template('collection.html', phrase_list=phrase_list, user_name=user_name, **context)
+
+def rate_limited_response(retry_after, emotion='', style=None):
+    """Respuesta 429 rápida (sin llamadas a Supabase ni OpenAI) con Retry-After"""
+    retry_after = max(1, math.ceil(retry_after))
+    message = f'Estás creando frases muy rápido. Inténtalo de nuevo en {retry_after} segundos.'
+    
+    if request.is_json or request.accept_mimetypes.best == 'application/json':
+        response = jsonify({'success': False, 'error': message, 'retry_after': retry_after})
+    else:
+        flash(message, 'error')
+        response = make_response(render_template('index.html', original_emotion=emotion, style=style))
+    
+    response.status_code = 429
+    response.headers['Retry-After'] = str(retry_after)
+    return response
+
 @app.route('/')
 @login_required
 def index():
     """Main page with emotion input and style selection."""
-    if USE_SUPABASE:
-        # Obtener información del usuario autenticado
-        supabase = get_supabase_client()
-        try:
-            user = supabase.auth.get_user()
-            if user.user:
-                # Obtener información del usuario desde la tabla users
-                user_info = supabase_service.get_user_info(user.user.id)
-                user_name = user_info.get('user_name', 'Usuario') if user_info else 'Usuario'
-                return render_template('index.html', user_name=user_name, user_id=user.user.id)
-        except Exception as e:
-            print(f"❌ Error en la función index: {e}")
-            return redirect(url_for('landing'))
-    else:
-        # Modo legacy con cookies
-        user_name = request.cookies.get('user_name', '')
-        if not user_name:
-            return redirect(url_for('landing'))
-        return render_template('index.html', user_name=user_name)
+    # Obtener información del usuario autenticado
+    try:
+        user_id = current_user_id()
+        if user_id:
+            # Obtener información del usuario desde la tabla users
+            user_info = storage_service.get_user_info(user_id)
+            user_name = (user_info.user_name or 'Usuario') if user_info else 'Usuario'
+            return render_template('index.html', user_name=user_name, user_id=user_id)
+    except Exception as e:
+        logger.exception("Error en la función index")
+    return redirect(url_for('landing'))
 
 @app.route('/landing', methods=['GET', 'POST'])
 def landing():
@@ -107,25 +219,33 @@ def landing():
         # Esta ruta ya no maneja POST para nombres, solo GET para mostrar el login
         return redirect(url_for('landing'))
     
-    # Verificar si ya está autenticado
-    if USE_SUPABASE:
-        supabase = get_supabase_client()
-        try:
-            user = supabase.auth.get_user()
-            if user.user:
-                return redirect(url_for('index'))
-        except:
-            pass
+    # Verificar si ya está autenticado, sin red: el token de la sesión se comprueba localmente
+    access_token = session.get('sb_access_token')
+    try:
+        if access_token and storage_service.verify_access_token(access_token):
+            return redirect(url_for('index'))
+    except Exception:
+        logger.exception("Error verificando el token en la landing")
     
-    return render_template('landing.html')
+    # Con mensajes flash pendientes la página es de este visitante y de esta vez
+    if session.get('_flashes'):
+        response = make_response(render_template('landing.html'))
+        response.headers['Cache-Control'] = 'private, no-cache'
+        return response
+    
+    # Anónimo: la misma página para todos, renderizada una vez y cacheable por proxies
+    html = _anonymous_landing.get(request.script_root)
+    if html is None:
+        html = _anonymous_landing[request.script_root] = render_template('landing.html')
+    response = make_response(html)
+    response.add_etag()
+    response.cache_control.public = True
+    response.cache_control.max_age = LANDING_MAX_AGE
+    return response.make_conditional(request)
 
 @app.route('/login', methods=['POST'])
 def login():
     """Handle login form submission with email and password"""
-    if not USE_SUPABASE:
-        flash('Autenticación no disponible en modo local', 'error')
-        return redirect(url_for('landing'))
-    
     email = request.form.get('email', '').strip()
     password = request.form.get('password', '')
     
@@ -134,69 +254,38 @@ def login():
         return redirect(url_for('landing'))
     
     try:
-        # Probar conexión con Supabase antes de proceder
-        if not test_supabase_connection():
+        # Probar conexión con la base de datos antes de proceder
+        if not storage_service.test_connection():
             flash('Error de conexión con la base de datos. Por favor, intenta más tarde.', 'error')
             return redirect(url_for('landing'))
         
-        supabase = get_supabase_client()
-        
         # Intentar iniciar sesión con email y contraseña
-        response = supabase.auth.sign_in_with_password({
-            'email': email,
-            'password': password
-        })
-
-        print(f"Respuesta de login: {response}")
-        print(f"Tipo de respuesta: {type(response)}")
-        
-        # Manejar la nueva estructura de respuesta de Supabase
-        session_data = None
-        if hasattr(response, 'data') and response.data:
-            user = getattr(response.data, 'user', None)
-            session_data = getattr(response.data, 'session', None)
-        elif hasattr(response, 'user') or hasattr(response, 'session'):
-            user = getattr(response, 'user', None)
-            session_data = getattr(response, 'session', None)
-        else:
-            print(f"Estructura de respuesta inesperada: {response}")
-            flash('Credenciales incorrectas. Por favor, verifica tu email y contraseña.', 'error')
-            return redirect(url_for('landing'))
+        user, access_token, refresh_token = storage_service.sign_in(email, password)
 
         # Guardar tokens en la sesión de Flask para futuras solicitudes
-        if session_data:
-            access_token = getattr(session_data, 'access_token', None)
-            refresh_token = getattr(session_data, 'refresh_token', None)
-            if access_token is None and isinstance(session_data, dict):
-                access_token = session_data.get('access_token')
-                refresh_token = session_data.get('refresh_token')
-            if access_token:
-                session['sb_access_token'] = access_token
-            if refresh_token:
-                session['sb_refresh_token'] = refresh_token
+        if access_token:
+            regenerate_session_id(session)
+            session['sb_access_token'] = access_token
+        if refresh_token:
+            session['sb_refresh_token'] = refresh_token
         
         if user and hasattr(user, 'id'):
-            print(f"🔍 Usuario autenticado: {user.id}, email: {email}")
-            
             # Verificar si el usuario existe en la tabla users
-            user_info = supabase_service.get_user_info(user.id)
-            print(f"🔍 Resultado get_user_info: {user_info}")
+            user_info = storage_service.get_user_info(user.id)
             
             if user_info:
-                print("✅ Usuario encontrado en la base de datos")
+                logger.info("Inicio de sesión", extra={'user_id': user.id})
                 flash('¡Bienvenido! Has iniciado sesión correctamente.', 'success')
                 return redirect(url_for('index'))
             else:
-                print("⚠️ Usuario no encontrado, creando nuevo usuario...")
+                logger.info("Usuario sin perfil; creándolo", extra={'user_id': user.id})
                 # Usuario no existe en la tabla users, crear uno básico
-                created_user = supabase_service.create_user(user.id, email, email.split('@')[0])
-                print(f"🔍 Resultado create_user: {created_user}")
+                created_user = storage_service.create_user(user.id, email, email.split('@')[0])
                 
                 if created_user:
-                    print("✅ Usuario creado exitosamente")
                     flash('¡Bienvenido! Tu cuenta ha sido configurada.', 'success')
                 else:
-                    print("❌ Error creando usuario")
+                    logger.error("No se pudo crear el perfil del usuario", extra={'user_id': user.id})
                     flash('Que pena! Has iniciado sesión correctamente.', 'success')
                 
                 return redirect(url_for('index'))
@@ -205,7 +294,7 @@ def login():
             return redirect(url_for('landing'))
             
     except Exception as e:
-        print(f"Error en login: {e}")
+        logger.warning("Error en login: %s", e)
         error_message = str(e).lower()
         
         if "invalid login credentials" in error_message:
@@ -217,10 +306,6 @@ def login():
 @app.route('/register', methods=['POST'])
 def register():
     """Handle user registration with username, email, and password"""
-    if not USE_SUPABASE:
-        flash('Registro no disponible en modo local', 'error')
-        return redirect(url_for('landing'))
-    
     username = request.form.get('username', '').strip()
     email = request.form.get('email', '').strip()
     password = request.form.get('password', '')
@@ -234,36 +319,12 @@ def register():
         return redirect(url_for('landing'))
     
     try:
-        supabase = get_supabase_client()
-        
-        # Crear nuevo usuario en Supabase Auth
-        response = supabase.auth.sign_up({
-            'email': email,
-            'password': password,
-            'options': {
-                'data': {
-                    'user_name': username
-                }
-            }
-        })
-        
-        print(f"Respuesta de registro: {response}")
-        print(f"Tipo de respuesta: {type(response)}")
-        print(f"Atributos de respuesta: {dir(response)}")
-        
-        # Manejar la nueva estructura de respuesta de Supabase
-        if hasattr(response, 'data') and response.data and hasattr(response.data, 'user'):
-            user = response.data.user
-        elif hasattr(response, 'user'):
-            user = response.user
-        else:
-            print(f"Estructura de respuesta inesperada: {response}")
-            flash('Error al crear la cuenta. Por favor, inténtalo de nuevo.', 'error')
-            return redirect(url_for('landing'))
+        # Crear nuevo usuario en Auth
+        user = storage_service.sign_up(email, password, username)
         
         if user:
             # Crear usuario en la tabla users
-            user_created = supabase_service.create_user(user.id, email, username)
+            user_created = storage_service.create_user(user.id, email, username)
             
             if user_created:
                 flash('¡Cuenta creada exitosamente! Por favor, verifica tu email para confirmar tu cuenta.', 'success')
@@ -276,10 +337,7 @@ def register():
             return redirect(url_for('landing'))
             
     except Exception as e:
-        print(f"Error en registro: {e}")
-        print(f"Tipo de error: {type(e)}")
-        import traceback
-        traceback.print_exc()
+        logger.exception("Error en registro")
         
         error_message = str(e).lower()
         
@@ -300,31 +358,59 @@ def register():
 @app.route('/logout')
 def logout():
     """Cerrar sesión"""
-    if USE_SUPABASE:
+    try:
         try:
-            supabase = get_supabase_client()
-            try:
-                supabase.auth.sign_out()
-            except:
-                pass
-            # Limpiar tokens almacenados en la sesión
-            session.pop('sb_access_token', None)
-            session.pop('sb_refresh_token', None)
-            flash('Has cerrado sesión correctamente.', 'info')
+            storage_service.sign_out()
         except:
             pass
-    else:
-        # Modo legacy: limpiar cookie
-        response = redirect(url_for('landing'))
-        response.delete_cookie('user_name')
+        # Limpiar tokens almacenados en la sesión
+        session.pop('sb_access_token', None)
+        session.pop('sb_refresh_token', None)
         flash('Has cerrado sesión correctamente.', 'info')
-        return response
+    except:
+        pass
     
     return redirect(url_for('landing'))
 
 @app.route('/generate', methods=['POST'])
 @login_required
 def generate_phrase():
+    """Generate a poetic phrase, at most once per idempotency key"""
+    key = request.form.get('idempotency_key') or request.headers.get('Idempotency-Key')
+    if not key or len(key) > 128:
+        return _generate_phrase()
+    
+    def run():
+        pending_flashes = len(session.get('_flashes', []))
+        response = make_response(_generate_phrase())
+        result = {
+            'body': response.get_data(as_text=True),
+            'status': response.status_code,
+            'headers': [(k, v) for k, v in response.headers.items() if k.lower() != 'content-length'],
+            # Mensajes que la redirección mostrará después: el duplicado debe mostrarlos también
+            'flashes': [list(message) for message in session.get('_flashes', [])[pending_flashes:]]
+        }
+        # Solo se guardan resultados definitivos (frase guardada o límite alcanzado);
+        # los 429 y los errores, que también redirigen, permiten reintentar
+        return result, g.get('generation_final', False)
+    
+    # Las claves se limitan al usuario para que no puedan cruzarse entre cuentas
+    result, replayed = idempotency_store.run(f"{g.get('user_id')}:{key}", run)
+    if result is None:
+        flash('Tu frase aún se está creando. Inténtalo de nuevo en un momento.', 'warning')
+        response = make_response(render_template('index.html',
+                                                 original_emotion=request.form.get('emotion', '').strip(),
+                                                 style=request.form.get('style')), 409)
+        response.headers['Retry-After'] = '1'
+        return response
+    
+    if replayed:
+        logger.info("Envío duplicado de /generate respondido con el resultado guardado")
+        for category, message in result.get('flashes', ()):
+            flash(message, category)
+    return Response(result['body'], status=result['status'], headers=result['headers'])
+
+def _generate_phrase():
     """Generate a poetic phrase from user emotion and style"""
     emotion = request.form.get('emotion', '').strip()
     style = request.form.get('style', 'poetica_minimalista')
@@ -338,43 +424,53 @@ def generate_phrase():
         return redirect(url_for('index'))
     
     try:
-        # Generate phrase using OpenAI
-        result = generate_poetic_phrase(emotion, style)
-        
-        # Check if phrase generation failed
-        if result[0] is None:
-            flash('Unable to generate your phrase right now. Try again later.', 'error')
-            return redirect(url_for('index'))
+        # Obtener user_id del usuario autenticado
+        user_id = current_user_id()
         
-        generated_phrase, language = result
+        if not user_id:
+            flash('Authentication failed. Please log in again.', 'error')
+            return redirect(url_for('landing'))
         
-        # Save to database
-        if USE_SUPABASE:
-            # Obtener user_id del usuario autenticado
-            supabase = get_supabase_client()
-            user = supabase.auth.get_user()
-            user_id = user.user.id if user.user else None
+        # Verificar límite de frases (Free Pass: 3 frases) antes de la llamada a OpenAI
+        phrase_count = storage_service.get_phrase_count(user_id)
+        if phrase_count >= 3:
+            logger.info("Límite de frases alcanzado (%d)", phrase_count, extra={'user_id': user_id})
             
-            if not user_id:
-                flash('Authentication failed. Please log in again.', 'error')
-                return redirect(url_for('landing'))
+            # Obtener nombre de usuario para mostrar en el template
+            user_info = storage_service.get_user_info(user_id)
+            user_name = (user_info.user_name or 'Usuario') if user_info else 'Usuario'
+
+            g.generation_final = True
+            return render_template('index.html', 
+                                 user_name=user_name,
+                                 limit_reached=True,
+                                 original_emotion=emotion,
+                                 style=style)
+        
+        # Control de admisión: límites por usuario y globales por modelo (se reserva el peor caso)
+        retry_after = check_generation_allowed(user_id, MODEL, cost=GENERATE_MAX_COMPLETIONS)
+        if retry_after:
+            logger.info("Límite de tasa alcanzado, reintentar en %.1fs", retry_after, extra={'user_id': user_id})
+            return rate_limited_response(retry_after, emotion, style)
+        
+        usage = {'completions': 0}
+        try:
+            # Frases que el usuario ya tiene (uniq_phrase_per_user) para no generarlas de nuevo
+            existing_hashes = storage_service.get_phrase_hashes(user_id)
             
-            # Verificar límite de frases (Free Pass: 3 frases)
-            phrase_count = supabase_service.get_phrase_count(user_id)
-            if phrase_count >= 3:
-                print(f"⚠️ Usuario {user_id} ha alcanzado el límite de frases ({phrase_count})")
-                
-                # Obtener nombre de usuario para mostrar en el template
-                user_info = supabase_service.get_user_info(user_id)
-                user_name = user_info.get('user_name', 'Usuario') if user_info else 'Usuario'
-
-                return render_template('index.html', 
-                                     user_name=user_name,
-                                     limit_reached=True,
-                                     original_emotion=emotion,
-                                     style=style)
+            # Generate phrase using OpenAI
+            result = generate_poetic_phrase(emotion, style, existing_hashes=existing_hashes,
+                                            usage=usage, user_id=user_id)
+            
+            # Check if phrase generation failed
+            if result[0] is None:
+                flash('Unable to generate your phrase right now. Try again later.', 'error')
+                return redirect(url_for('index'))
             
-            phrase, error = supabase_service.create_phrase(
+            generated_phrase, language = result
+            
+            # Save to database
+            phrase, error = storage_service.create_phrase(
                 user_id=user_id,
                 original_emotion=emotion,
                 style=style,
@@ -382,56 +478,43 @@ def generate_phrase():
                 language=language
             )
             
-            if error:
-                print(f"❌ Error al guardar frase: {error}")
-                error_str = str(error).lower()
-                if "duplicate" in error_str or "unique constraint" in error_str:
-                    flash('¡Vaya! Esta frase ya la tienes guardada en tu colección.', 'warning')
-                    # Intentar buscar la frase existente para mostrarla si es posible, o simplemente redirigir
-                    return redirect(url_for('index'))
-                
-                phrase_id = None
-                flash(f'Error saving phrase: {error}', 'error')
+            if error and storage_service.is_duplicate_error(error):
+                # La caché no estaba al día: refrescarla y regenerar una sola vez
+                existing_hashes = storage_service.get_phrase_hashes(user_id, refresh=True)
+                result = generate_poetic_phrase(emotion, style, existing_hashes=existing_hashes,
+                                                usage=usage, user_id=user_id)
+                if result[0] is not None:
+                    generated_phrase, language = result
+                    phrase, error = storage_service.create_phrase(
+                        user_id=user_id,
+                        original_emotion=emotion,
+                        style=style,
+                        phrase=generated_phrase,
+                        language=language
+                    )
+        finally:
+            # Las completions reservadas y no hechas vuelven al bucket del modelo
+            refund_generation(MODEL, GENERATE_MAX_COMPLETIONS - usage['completions'])
+        
+        if error:
+            logger.warning("Error al guardar frase: %s", error, extra={'user_id': user_id})
+            if storage_service.is_duplicate_error(error):
+                flash('¡Vaya! Esta frase ya la tienes guardada en tu colección.', 'warning')
+                # Intentar buscar la frase existente para mostrarla si es posible, o simplemente redirigir
                 return redirect(url_for('index'))
-                
-            phrase_id = phrase['id'] if phrase else None
-        else:
-            # Modo legacy
-            user_name = request.cookies.get('user_name', '').strip()
-            if not user_name:
-                flash('Name not found. Please re-enter your name.', 'error')
-                return redirect(url_for('landing'))
             
-            # Verificar límite de frases (Free Pass: 3 frases) - Modo Legacy
-            phrase_count = Phrase.query.filter_by(user_name=user_name).count()
-            if phrase_count >= 3:
-                print(f"⚠️ Usuario Legacy {user_name} ha alcanzado el límite de frases ({phrase_count})")
-                return render_template('index.html', 
-                                     user_name=user_name, 
-                                     limit_reached=True,
-                                     original_emotion=emotion,
-                                     style=style)
+            flash(f'Error saving phrase: {error}', 'error')
+            return redirect(url_for('index'))
             
-            phrase = Phrase(
-                user_name=user_name,
-                original_emotion=emotion,
-                style=style,
-                generated_phrase=generated_phrase,
-                language=language
-            )
-            db.session.add(phrase)
-            db.session.commit()
-            phrase_id = phrase.id
+        phrase_id = phrase.id if phrase else None
         
         if phrase_id:
             # Obtener nombre de usuario actualizado
-            user_name = 'Usuario'
-            if USE_SUPABASE:
-                user_info = supabase_service.get_user_info(user_id)
-                user_name = user_info.get('user_name', 'Usuario') if user_info else 'Usuario'
-            else:
-                user_name = request.cookies.get('user_name', 'Usuario')
+            user_info = storage_service.get_user_info(user_id)
+            user_name = (user_info.user_name or 'Usuario') if user_info else 'Usuario'
 
+            # La frase ya está guardada: un reenvío debe ver este resultado, no crear otra
+            g.generation_final = True
             return render_template('index.html', 
                                 user_name=user_name,
                                 generated_phrase=generated_phrase,
@@ -443,7 +526,7 @@ def generate_phrase():
             return redirect(url_for('index'))
             
     except Exception as e:
-        print(f"Error generando frase: {e}")
+        logger.exception("Error generando frase")
         flash('Something unexpected happened. Please try again later.', 'error')
         return redirect(url_for('index'))
 
@@ -452,29 +535,17 @@ def generate_phrase():
 def toggle_favorite(phrase_id):
     """Toggle favorite status of a phrase"""
     try:
-        supabase = get_supabase_client()
-        user = supabase.auth.get_user()
-        user_id = user.user.id if user.user else None
+        user_id = current_user_id()
 
         if not user_id:
             return jsonify({'success': False, 'error': 'No autorizado'})
         
-        if USE_SUPABASE:
-            # Verificar que la frase pertenece al usuario
-            phrase = supabase_service.get_phrase_by_id(phrase_id)
-            if phrase and phrase.get('user_id') == user_id:
-                is_favorite = supabase_service.toggle_favorite(phrase_id)
-            else:
-                return jsonify({'success': False, 'error': 'No autorizado'})
+        # Verificar que la frase pertenece al usuario
+        phrase = storage_service.get_phrase_by_id(phrase_id)
+        if phrase and phrase.user_id == user_id:
+            is_favorite = storage_service.toggle_favorite(phrase_id)
         else:
-            phrase = Phrase.query.get_or_404(phrase_id)
-            # Verificar que la frase pertenece al usuario
-            if phrase.user_name == request.cookies.get('user_name', ''): # Assuming user_name is the key for legacy
-                phrase.is_favorite = not phrase.is_favorite
-                db.session.commit()
-                is_favorite = phrase.is_favorite
-            else:
-                return jsonify({'success': False, 'error': 'No autorizado'})
+            return jsonify({'success': False, 'error': 'No autorizado'})
         
         return jsonify({'success': True, 'is_favorite': is_favorite})
     except Exception as e:
@@ -482,74 +553,41 @@ def toggle_favorite(phrase_id):
 
 @app.route('/collection')
 @login_required
+@conditional_get
 def collection():
     """View all saved phrases"""
     try:
-        supabase = get_supabase_client()
-        user = supabase.auth.get_user()
-        user_id = user.user.id if user.user else None
+        user_id = current_user_id()
         
         if not user_id:
             flash('Authentication failed. Please log in again.', 'error')
             return redirect(url_for('landing'))
         
-        if USE_SUPABASE:
-            phrases = supabase_service.get_all_phrases(user_id=user_id)
-        else:
-            if user_id:
-                phrases = Phrase.query.filter_by(user_name=request.cookies.get('user_name', '')).order_by(Phrase.created_at.desc()).all() # Assuming user_name is the key for legacy
-            else:
-                phrases = Phrase.query.order_by(Phrase.created_at.desc()).all()
-        
-        # Obtener nombre de usuario
-        user_name = 'Usuario'
-        if USE_SUPABASE:
-            user_info = supabase_service.get_user_info(user_id)
-            user_name = user_info.get('user_name', 'Usuario') if user_info else 'Usuario'
-        else:
-            user_name = request.cookies.get('user_name', 'Usuario')
-            
-        return render_template('collection.html', phrases=phrases, user_name=user_name)
+        return render_collection(user_id, 'collection', {})
     except Exception as e:
         flash('Error al cargar la colección.', 'error')
         return redirect(url_for('index'))
 
 @app.route('/collection/favorites')
 @login_required
+@conditional_get
 def favorites():
     """View favorite phrases only"""
     try:
-        supabase = get_supabase_client()
-        user = supabase.auth.get_user()
-        user_id = user.user.id if user.user else None
+        user_id = current_user_id()
         
         if not user_id:
             flash('Authentication failed. Please log in again.', 'error')
             return redirect(url_for('landing'))
         
-        if USE_SUPABASE:
-            phrases = supabase_service.get_favorite_phrases(user_id=user_id)
-        else:
-            if user_id:
-                phrases = Phrase.query.filter_by(user_name=request.cookies.get('user_name', '')).order_by(Phrase.created_at.desc()).all() # Assuming user_name is the key for legacy
-            else:
-                phrases = Phrase.query.filter_by(is_favorite=True).order_by(Phrase.created_at.desc()).all()
-        
-        # Obtener nombre de usuario
-        user_name = 'Usuario'
-        if USE_SUPABASE:
-            user_info = supabase_service.get_user_info(user_id)
-            user_name = user_info.get('user_name', 'Usuario') if user_info else 'Usuario'
-        else:
-            user_name = request.cookies.get('user_name', 'Usuario')
-
-        return render_template('collection.html', phrases=phrases, show_favorites=True, user_name=user_name)
+        return render_collection(user_id, 'collection:favorites', {'favorites': True}, show_favorites=True)
     except Exception as e:
         flash('Error al cargar los favoritos.', 'error')
         return redirect(url_for('index'))
 
 @app.route('/collection/language/<language>')
 @login_required
+@conditional_get
 def collection_by_language(language):
     """View phrases filtered by language"""
     try:
@@ -557,81 +595,39 @@ def collection_by_language(language):
             flash('Idioma no válido.', 'error')
             return redirect(url_for('collection'))
         
-        supabase = get_supabase_client()
-        user = supabase.auth.get_user()
-        user_id = user.user.id if user.user else None
+        user_id = current_user_id()
         
         if not user_id:
             flash('Authentication failed. Please log in again.', 'error')
             return redirect(url_for('landing'))
         
-        if USE_SUPABASE:
-            phrases = supabase_service.get_phrases_by_language(language, user_id=user_id)
-        else:
-            if user_id:
-                phrases = Phrase.query.filter_by(user_name=request.cookies.get('user_name', '')).order_by(Phrase.created_at.desc()).all() # Assuming user_name is the key for legacy
-            else:
-                phrases = Phrase.query.filter_by(language=language).order_by(Phrase.created_at.desc()).all()
-        
-        # Obtener nombre de usuario
-        user_name = 'Usuario'
-        if USE_SUPABASE:
-            user_info = supabase_service.get_user_info(user_id)
-            user_name = user_info.get('user_name', 'Usuario') if user_info else 'Usuario'
-        else:
-            user_name = request.cookies.get('user_name', 'Usuario')
-
         language_name = 'Español' if language == 'es' else 'English'
-        return render_template('collection.html', phrases=phrases, language_filter=language, language_name=language_name, user_name=user_name)
+        return render_collection(user_id, f'collection:{language}', {'language': language},
+                                 language_filter=language, language_name=language_name)
     except Exception as e:
         flash('Error al cargar las frases por idioma.', 'error')
         return redirect(url_for('collection'))
 
 @app.route('/stats')
 @login_required
+@conditional_get
 def stats():
     """View database statistics"""
     try:
-        supabase = get_supabase_client()
-        user = supabase.auth.get_user()
-        user_id = user.user.id if user.user else None
+        user_id = current_user_id()
         
         if not user_id:
             flash('Authentication failed. Please log in again.', 'error')
             return redirect(url_for('landing'))
         
-        if USE_SUPABASE:
-            stats_data = supabase_service.get_stats(user_id=user_id)
-        else:
-            # Calcular estadísticas para SQLite
-            if user_id:
-                total_phrases = Phrase.query.filter_by(user_name=request.cookies.get('user_name', '')).count() # Assuming user_name is the key for legacy
-                favorite_phrases = Phrase.query.filter_by(user_name=request.cookies.get('user_name', '')).count() # Assuming user_name is the key for legacy
-                phrases = Phrase.query.filter_by(user_name=request.cookies.get('user_name', '')).all() # Assuming user_name is the key for legacy
-            else:
-                total_phrases = Phrase.query.count()
-                favorite_phrases = Phrase.query.filter_by(is_favorite=True).count()
-                phrases = Phrase.query.all()
-            
-            # Distribución por idioma
-            language_stats = {}
-            for phrase in phrases:
-                lang = phrase.language or 'es'
-                language_stats[lang] = language_stats.get(lang, 0) + 1
-            
-            stats_data = {
-                'total_phrases': total_phrases,
-                'favorite_phrases': favorite_phrases,
-                'language_stats': language_stats,
-                'user_name': request.cookies.get('user_name', 'Usuario')
-            }
-        
-        # Añadir user_name a stats_data para Supabase también si no está
-        if USE_SUPABASE and 'user_name' not in stats_data:
-            user_info = supabase_service.get_user_info(user_id)
-            stats_data['user_name'] = user_info.get('user_name', 'Usuario') if user_info else 'Usuario'
-        
-        return render_template('stats.html', stats=stats_data, user_name=stats_data.get('user_name'))
+        stats_blocks = cached_fragment(user_id, 'stats', 'stats_blocks.html',
+                                       lambda: {'stats': storage_service.get_stats(user_id=user_id)})
+        
+        # Obtener nombre de usuario
+        user_info = storage_service.get_user_info(user_id)
+        user_name = (user_info.user_name or 'Usuario') if user_info else 'Usuario'
+        
+        return render_template('stats.html', stats_blocks=stats_blocks, user_name=user_name)
     except Exception as e:
         flash('Error al cargar las estadísticas.', 'error')
         return redirect(url_for('index'))
@@ -641,32 +637,19 @@ def stats():
 def delete_phrase(phrase_id):
     """Delete a phrase from collection"""
     try:
-        supabase = get_supabase_client()
-        user = supabase.auth.get_user()
-        user_id = user.user.id if user.user else None
+        user_id = current_user_id()
         
         if not user_id:
             flash('Authentication failed. Please log in again.', 'error')
             return redirect(url_for('landing'))
         
-        if USE_SUPABASE:
-            # Verificar que la frase pertenece al usuario
-            phrase = supabase_service.get_phrase_by_id(phrase_id)
-            if phrase and phrase.get('user_id') == user_id:
-                success = supabase_service.delete_phrase(phrase_id)
-            else:
-                flash('No tienes permisos para eliminar esta frase.', 'error')
-                return redirect(url_for('collection'))
+        # Verificar que la frase pertenece al usuario
+        phrase = storage_service.get_phrase_by_id(phrase_id)
+        if phrase and phrase.user_id == user_id:
+            success = storage_service.delete_phrase(phrase_id)
         else:
-            phrase = Phrase.query.get_or_404(phrase_id)
-            # Verificar que la frase pertenece al usuario
-            if phrase.user_name == request.cookies.get('user_name', ''): # Assuming user_name is the key for legacy
-                db.session.delete(phrase)
-                db.session.commit()
-                success = True
-            else:
-                flash('No tienes permisos para eliminar esta frase.', 'error')
-                return redirect(url_for('collection'))
+            flash('No tienes permisos para eliminar esta frase.', 'error')
+            return redirect(url_for('collection'))
         
         if success:
             flash('Frase eliminada correctamente.', 'success')
@@ -680,26 +663,79 @@ def delete_phrase(phrase_id):
 
 @app.route('/api/phrase/<phrase_id>')
 @login_required
+@conditional_get
 def get_phrase_api(phrase_id):
     """API endpoint to get phrase data"""
     try:
-        supabase = get_supabase_client()
-        user = supabase.auth.get_user()
-        user_id = user.user.id if user.user else None
+        user_id = current_user_id()
         
         if not user_id:
             return jsonify({'error': 'No autorizado'}), 401
         
-        if USE_SUPABASE:
-            phrase = supabase_service.get_phrase_by_id(phrase_id)
-        else:
-            phrase = Phrase.query.get_or_404(phrase_id)
-            phrase = phrase.to_dict()
+        phrase = storage_service.get_phrase_by_id(phrase_id)
+        # Las frases de otros usuarios no existen para este
+        if phrase and phrase.user_id != user_id:
+            phrase = None
         
-        return jsonify(phrase)
+        return jsonify(phrase.to_dict() if phrase else None)
     except Exception as e:
         return jsonify({'error': str(e)}), 404
 
+@app.route('/api/phrases')
+@login_required
+def list_phrases_api():
+    """Paginated phrases of the current user: ?cursor=&limit=&favorites=1&language=es|en"""
+    user_id = current_user_id()
+    if not user_id:
+        return json_response({'error': 'No autorizado'}, 401)
+    
+    language = request.args.get('language') or None
+    if language not in (None, 'es', 'en'):
+        return json_response({'error': 'Idioma no válido'}, 400)
+    limit = max(1, min(request.args.get('limit', COLLECTION_PAGE_SIZE, type=int), COLLECTION_MAX_PAGE_SIZE))
+    favorites = request.args.get('favorites', '').lower() in ('1', 'true')
+    
+    try:
+        phrases, next_cursor = storage_service.list_phrases(user_id, limit=limit, cursor=request.args.get('cursor'),
+                                                            favorites=favorites, language=language)
+    except ValueError as e:
+        return json_response({'error': str(e)}, 400)
+    return json_response({'phrases': [phrase.to_dict() for phrase in phrases], 'next_cursor': next_cursor})
+
+@app.route('/api/phrases/batch', methods=['POST'])
+@login_required
+def phrases_batch_api():
+    """Bulk operation on the user's phrases: {"op": "fetch|favorite|unfavorite|delete", "ids": [...]}"""
+    user_id = current_user_id()
+    if not user_id:
+        return json_response({'success': False, 'error': 'No autorizado'}, 401)
+    
+    body = request.get_json(silent=True) or {}
+    op = body.get('op')
+    ids = body.get('ids')
+    if op not in ('fetch', 'favorite', 'unfavorite', 'delete'):
+        return json_response({'success': False, 'error': 'Operación no válida'}, 400)
+    if not isinstance(ids, list) or not all(isinstance(phrase_id, str) for phrase_id in ids):
+        return json_response({'success': False, 'error': 'ids debe ser una lista de ids'}, 400)
+    ids = list(dict.fromkeys(ids))
+    if len(ids) > PHRASE_BATCH_MAX_SIZE:
+        return json_response({'success': False, 'error': f'Máximo {PHRASE_BATCH_MAX_SIZE} ids por lote'}, 400)
+    
+    # Cada lote es una sola sentencia filtrada por user_id: las frases ajenas se ignoran
+    payload = {'success': True, 'op': op}
+    if op == 'fetch':
+        phrases = storage_service.get_phrases_by_ids(user_id, ids)
+        payload['phrases'] = [phrase.to_dict() for phrase in phrases]
+        affected = [phrase.id for phrase in phrases]
+    elif op == 'delete':
+        affected = storage_service.delete_phrases(user_id, ids)
+    else:
+        affected = storage_service.set_favorites(user_id, ids, op == 'favorite')
+    payload['ids'] = affected
+    found = set(affected)
+    payload['missing'] = [phrase_id for phrase_id in ids if phrase_id not in found]
+    return json_response(payload)
+
 @app.route('/test-api')
 def test_api():
     """Test OpenAI API status"""
@@ -721,3 +757,49 @@ def test_api():
             'status': 'error',
             'message': str(e)
         })
+
+@app.route('/metrics')
+def metrics_endpoint():
+    """Prometheus metrics (text exposition format), aggregated across workers"""
+    # Sin METRICS_TOKEN no se exponen: revelan rutas, cachés y el uso de los servicios externos
+    if not METRICS_ENABLED or not METRICS_TOKEN:
+        return make_response('Not found', 404)
+    auth = request.headers.get('Authorization', '')
+    if not hmac.compare_digest(auth, f"Bearer {METRICS_TOKEN}"):
+        return make_response('Unauthorized', 401)
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4; charset=utf-8')
+
+@app.route('/admin/profiles', methods=['GET', 'POST'])
+@admin_required
+def admin_profiles():
+    """List stored request profiles; POST issues a signed token to profile requests"""
+    if not profiling.PROFILING_ENABLED:
+        abort(404)
+    if request.method == 'POST':
+        return jsonify({
+            'token': profiling.make_profile_token(),
+            'expires_in': profiling.PROFILE_TOKEN_TTL,
+            'usage': 'Send it as the X-Profile header or the ?profile= query parameter'
+        })
+    return jsonify({'profiles': [
+        {'name': name, 'url': url_for('admin_profile_download', name=name)}
+        for name in profiling.list_profiles()
+    ]})
+
+@app.route('/admin/profiles/<name>')
+@admin_required
+def admin_profile_download(name):
+    """Download a stored cProfile dump (open with pstats or snakeviz)"""
+    if not profiling.PROFILING_ENABLED:
+        abort(404)
+    return send_from_directory(profiling.PROFILE_DIR, name, as_attachment=True,
+                               mimetype='application/octet-stream')
+
+@app.route('/admin/profiles/stacks')
+@admin_required
+def admin_profile_stacks():
+    """Sampled stacks of this worker in collapsed format (?reset=1 starts over)"""
+    if profiling.sampler is None:
+        abort(404)
+    collapsed = profiling.sampler.collapsed(reset=request.args.get('reset') == '1')
+    return Response(collapsed, mimetype='text/plain; charset=utf-8')
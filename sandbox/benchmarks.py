@@ -0,0 +1,373 @@
+#!/usr/bin/env python3
+"""
+Micro-benchmarks de las funciones calientes de la capa de servicios.
+
+Usa los servicios simulados (sin red) y compara con una línea base guardada:
+    python sandbox/benchmarks.py --save            # guardar línea base
+    python sandbox/benchmarks.py                   # comparar; sale con 1 si hay regresiones
+    python sandbox/benchmarks.py -k get_stats --threshold 0.2
+"""
+
+import argparse
+import contextlib
+import io
+import json
+import logging
+import os
+import platform
+import statistics
+import sys
+import time
+import tracemalloc
+import uuid
+from datetime import datetime, timedelta, timezone
+from types import SimpleNamespace
+
+# Servicios simulados: los benchmarks nunca salen a la red
+os.environ.setdefault("SUPABASE_FAKE", "true")
+os.environ.setdefault("OPENAI_FAKE", "true")
+os.environ.setdefault("RATE_LIMIT_ENABLED", "false")
+os.environ["SUPABASE_WRITE_BEHIND"] = "false"
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+DEFAULT_BASELINE = "instance/benchmarks_baseline.json"
+STYLES = ["poetica_minimalista", "indirecta_redes", "diario_intimo", "reflexiva"]
+
+BENCHMARKS = {}
+MEMORY_BENCHMARKS = {}
+
+
+def benchmark(name):
+    """Registra una función de preparación que retorna el callable a medir"""
+    def decorator(setup):
+        BENCHMARKS[name] = setup
+        return setup
+    return decorator
+
+
+def memory_benchmark(name):
+    """Registra una función que construye y retorna lo que se quiere medir en memoria"""
+    def decorator(build):
+        MEMORY_BENCHMARKS[name] = build
+        return build
+    return decorator
+
+
+def make_rows(count, user_id="bench-user"):
+    """Filas de phrases con la forma que devuelve la base de datos"""
+    now = datetime.now(timezone.utc)
+    return [{
+        'id': str(uuid.uuid4()),
+        'user_id': user_id,
+        'original_emotion': "Me siento " + "muy " * (i % 60) + "nostálgico",
+        'style': STYLES[i % len(STYLES)],
+        'phrase': f"La lluvia guarda lo que no dije número {i}",
+        'language': 'en' if i % 3 == 0 else 'es',
+        'is_favorite': i % 4 == 0,
+        'created_at': (now - timedelta(minutes=i)).isoformat(),
+        'updated_at': (now - timedelta(minutes=i)).isoformat(),
+    } for i in range(count)]
+
+
+@contextlib.contextmanager
+def _quiet():
+    """Silencia los logs del código medido (y cualquier print que quede)"""
+    previous = logging.root.manager.disable
+    logging.disable(logging.CRITICAL)
+    try:
+        with contextlib.redirect_stdout(io.StringIO()):
+            yield
+    finally:
+        logging.disable(previous)
+
+
+@benchmark("generate_poetic_phrase")
+def bench_generate_poetic_phrase():
+    from services import openai_service
+    from services.cache import content_hash
+
+    # Cliente sin latencia: se mide la construcción del prompt y el post-proceso
+    reply = SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(
+        content="  La luna guarda en voz baja lo que nunca te dije, entre líneas y sin prisa, cada noche  "))])
+    detect = SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content="es"))])
+    stub = SimpleNamespace(chat=SimpleNamespace(completions=SimpleNamespace(
+        create=lambda **kw: detect if kw.get('max_tokens') == 5 else reply)))
+    openai_service.client = stub
+    existing = frozenset(content_hash(f"frase {i}") for i in range(50))
+    return lambda: openai_service.generate_poetic_phrase("Me siento nostálgico", "reflexiva", existing)
+
+
+@benchmark("SupabaseService._map_phrase_data[100]")
+def bench_map_phrase_data():
+    from services.supabase_service import supabase_service
+    rows = make_rows(100)
+    return lambda: supabase_service._map_phrase_data(rows)
+
+
+def _register_get_stats(size):
+    @benchmark(f"get_stats[{size}]")
+    def bench_get_stats():
+        from services.supabase_service import SupabaseService
+        service = SupabaseService()
+        phrases = service._map_phrase_data(make_rows(size))
+        # Solo la agregación: las frases ya están cargadas
+        service.get_all_phrases = lambda user_id=None: phrases
+        return lambda: service.get_stats("bench-user")
+
+
+for _size in (100, 1_000, 10_000, 100_000):
+    _register_get_stats(_size)
+
+
+@benchmark("models.Phrase.from_row")
+def bench_phrase_from_row():
+    from models import Phrase
+    row = make_rows(1)[0]
+    return lambda: Phrase.from_row(row)
+
+
+@benchmark("models.Phrase.to_dict")
+def bench_phrase_to_dict():
+    from models import Phrase
+    phrase = Phrase.from_row(make_rows(1)[0])
+    return phrase.to_dict
+
+
+def _phrases_payload(count):
+    """Respuesta JSON de PostgREST con `count` frases"""
+    return json.dumps(make_rows(count))
+
+
+@memory_benchmark("phrases as dicts[10000]")
+def memory_phrase_dicts():
+    """Representación anterior: los dict de PostgREST con generated_phrase añadido"""
+    payload = _phrases_payload(10_000)
+    def build():
+        rows = json.loads(payload)
+        for row in rows:
+            row['generated_phrase'] = row['phrase']
+        return rows
+    return build
+
+
+@memory_benchmark("phrases as models[10000]")
+def memory_phrase_models():
+    from models import Phrase
+    payload = _phrases_payload(10_000)
+    return lambda: Phrase.from_rows(json.loads(payload))
+
+
+def _register_collection_render(size):
+    @benchmark(f"render collection.html[{size}]")
+    def bench_collection_render():
+        from flask import render_template
+        from markupsafe import Markup
+        from services.supabase_service import supabase_service
+        with _quiet():
+            from app import app
+        phrases = supabase_service._map_phrase_data(make_rows(size))
+
+        def render():
+            with app.test_request_context('/collection'):
+                phrase_list = Markup(render_template('partials/phrase_list.html', phrases=phrases))
+                return render_template('collection.html', phrase_list=phrase_list, user_name='Bench')
+        return render
+
+    @benchmark(f"render collection.html[{size}] (fragment cache hit)")
+    def bench_collection_render_cached():
+        from flask import render_template
+        from services.fragment_cache import FragmentCache, InMemoryFragmentBackend
+        from services.supabase_service import supabase_service
+        with _quiet():
+            from app import app
+        phrases = supabase_service._map_phrase_data(make_rows(size))
+        cache = FragmentCache(InMemoryFragmentBackend())
+
+        def render():
+            with app.test_request_context('/collection'):
+                phrase_list = cache.render('bench-user', 'collection', lambda: render_template(
+                    'partials/phrase_list.html', phrases=phrases))
+                return render_template('collection.html', phrase_list=phrase_list, user_name='Bench')
+        return render
+
+
+# La colección solo renderiza la primera página; el resto llega por /api/phrases
+from services.storage import COLLECTION_PAGE_SIZE  # noqa: E402
+
+for _size in (10, COLLECTION_PAGE_SIZE):
+    _register_collection_render(_size)
+
+
+def _login_required_setup(decorated):
+    from flask import session
+    with _quiet():
+        from app import app, storage_service
+        import routes
+    email = f"bench-{uuid.uuid4().hex[:8]}@example.com"
+    with _quiet():
+        storage_service.sign_up(email, "bench-password", "bench")
+        _, access_token, refresh_token = storage_service.sign_in(email, "bench-password")
+
+    def view():
+        return "ok"
+    target = routes.login_required(view) if decorated else view
+
+    def call():
+        with app.test_request_context('/collection'):
+            session['sb_access_token'] = access_token
+            session['sb_refresh_token'] = refresh_token
+            with _quiet():
+                return target()
+    return call
+
+
+@benchmark("login_required")
+def bench_login_required():
+    return _login_required_setup(decorated=True)
+
+
+@benchmark("login_required.baseline")
+def bench_login_required_baseline():
+    """La misma vista sin decorador, para restar el coste del contexto de petición"""
+    return _login_required_setup(decorated=False)
+
+
+def measure(fn, repeat, min_time):
+    """Como timeit.autorange: ajusta las vueltas a min_time y repite; segundos por llamada"""
+    fn()  # calentamiento
+    loops = 1
+    while True:
+        start = time.perf_counter()
+        for _ in range(loops):
+            fn()
+        elapsed = time.perf_counter() - start
+        if elapsed >= min_time:
+            break
+        loops = max(loops * 2, int(loops * min_time / max(elapsed, 1e-9) * 1.1))
+    runs = [elapsed / loops]
+    for _ in range(repeat - 1):
+        start = time.perf_counter()
+        for _ in range(loops):
+            fn()
+        runs.append((time.perf_counter() - start) / loops)
+    return {
+        'median_s': statistics.median(runs),
+        'min_s': min(runs),
+        'stdev_s': statistics.stdev(runs) if len(runs) > 1 else 0.0,
+        'loops': loops,
+        'repeat': repeat,
+    }
+
+
+def measure_memory(build):
+    """Bytes que siguen reservados tras construir (y conservar) el resultado de build()"""
+    build()  # calentamiento (imports, cachés internas)
+    tracemalloc.start()
+    try:
+        before = tracemalloc.get_traced_memory()[0]
+        kept = build()
+        retained = tracemalloc.get_traced_memory()[0] - before
+    finally:
+        tracemalloc.stop()
+    del kept
+    return {'bytes': retained}
+
+
+def format_bytes(size):
+    for unit, scale in (('MiB', 1 << 20), ('KiB', 1 << 10)):
+        if size >= scale:
+            return f"{size / scale:.2f}{unit}"
+    return f"{size}B"
+
+
+def format_time(seconds):
+    for unit, scale in (('s', 1), ('ms', 1e-3), ('µs', 1e-6)):
+        if seconds >= scale:
+            return f"{seconds / scale:.2f}{unit}"
+    return f"{seconds / 1e-9:.0f}ns"
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Micro-benchmarks con comparación contra una línea base")
+    parser.add_argument('-k', '--filter', help="Solo benchmarks cuyo nombre contenga este texto")
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--min-time', type=float, default=0.2, help="Segundos mínimos por repetición")
+    parser.add_argument('--baseline', default=DEFAULT_BASELINE, help="Archivo JSON de la línea base")
+    parser.add_argument('--save', action='store_true', help="Guardar los resultados como nueva línea base")
+    parser.add_argument('--threshold', type=float, default=0.10,
+                        help="Regresión si la mediana supera la base en esta fracción")
+    parser.add_argument('--list', action='store_true', help="Listar los benchmarks disponibles")
+    args = parser.parse_args()
+
+    names = [name for name in BENCHMARKS if not args.filter or args.filter in name]
+    memory_names = [name for name in MEMORY_BENCHMARKS if not args.filter or args.filter in name]
+    if args.list:
+        print("\n".join(names + memory_names))
+        return
+
+    baseline = {}
+    if os.path.exists(args.baseline) and not args.save:
+        with open(args.baseline) as f:
+            baseline = json.load(f).get('results', {})
+
+    results = {}
+    regressions = []
+    print(f"{'Benchmark':<42}{'mediana':>11}{'mín':>11}{'vueltas':>9}{'vs base':>10}")
+    for name in names:
+        fn = BENCHMARKS[name]()
+        result = measure(fn, args.repeat, args.min_time)
+        results[name] = result
+        line = (f"{name:<42}{format_time(result['median_s']):>11}{format_time(result['min_s']):>11}"
+                f"{result['loops']:>9}")
+        base = baseline.get(name)
+        if base:
+            change = result['median_s'] / base['median_s'] - 1
+            flag = ''
+            if change > args.threshold:
+                regressions.append((name, change))
+                flag = ' ⚠️'
+            line += f"{100 * change:>+9.1f}%{flag}"
+        print(line)
+
+    if memory_names:
+        print(f"\n{'Memoria retenida':<42}{'total':>11}{'por ítem':>11}{'':>9}{'vs base':>10}")
+    for name in memory_names:
+        build = MEMORY_BENCHMARKS[name]()
+        result = measure_memory(build)
+        results[name] = result
+        items = int(name.rsplit('[', 1)[1].rstrip(']')) if name.endswith(']') else 1
+        line = f"{name:<42}{format_bytes(result['bytes']):>11}{format_bytes(result['bytes'] // items):>11}{'':>9}"
+        base = baseline.get(name)
+        if base and base.get('bytes'):
+            change = result['bytes'] / base['bytes'] - 1
+            flag = ''
+            if change > args.threshold:
+                regressions.append((name, change))
+                flag = ' ⚠️'
+            line += f"{100 * change:>+9.1f}%{flag}"
+        print(line)
+    if {"phrases as dicts[10000]", "phrases as models[10000]"} <= results.keys():
+        saved = results["phrases as dicts[10000]"]['bytes'] - results["phrases as models[10000]"]['bytes']
+        print(f"{'  ahorro con models.Phrase por 10k frases':<42}{format_bytes(saved):>11}")
+
+    if args.save:
+        os.makedirs(os.path.dirname(args.baseline) or '.', exist_ok=True)
+        with open(args.baseline, 'w') as f:
+            json.dump({
+                'saved_at': datetime.now(timezone.utc).isoformat(),
+                'python': platform.python_version(),
+                'machine': platform.machine(),
+                'results': results,
+            }, f, indent=2)
+        print(f"\n💾 Línea base guardada en {args.baseline}")
+    elif regressions:
+        print(f"\n❌ {len(regressions)} regresiones por encima del {args.threshold:.0%}:")
+        for name, change in regressions:
+            print(f"   {name}: {100 * change:+.1f}%")
+        sys.exit(1)
+    elif baseline:
+        print(f"\n✅ Sin regresiones por encima del {args.threshold:.0%}")
+
+
+if __name__ == "__main__":
+    main()
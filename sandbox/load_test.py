@@ -0,0 +1,247 @@
+#!/usr/bin/env python3
+"""
+Generador de carga: reproduce recorridos de usuario contra una instancia local
+y reporta latencias p50/p95/p99, throughput y tasa de errores por ruta.
+
+Levantar antes la aplicación con los servicios simulados, por ejemplo:
+    SUPABASE_FAKE=true OPENAI_FAKE=true RATE_LIMIT_ENABLED=false python main.py
+
+y luego:
+    python sandbox/load_test.py --users 20 --iterations 5 --output results.json
+    python sandbox/load_test.py --users 20 --compare results.json
+"""
+
+import argparse
+import json
+import random
+import re
+import sys
+import threading
+import time
+import uuid
+from collections import defaultdict
+from datetime import datetime, timezone
+
+import requests
+
+PHRASE_ID_PATTERN = re.compile(r'id="favoriteBtn([\w-]+)"')
+PHRASE_LIMIT = 3
+
+EMOTIONS = [
+    "Me siento triste porque extraño a alguien",
+    "Estoy feliz por un nuevo comienzo",
+    "I feel nostalgic about my childhood",
+    "I am anxious about the future",
+    "Tengo miedo de no ser suficiente",
+    "I feel grateful for small things",
+]
+STYLES = ["poetica_minimalista", "indirecta_redes", "diario_intimo", "reflexiva"]
+
+
+class Recorder:
+    """Acumula latencias y códigos de estado por ruta (seguro entre hilos)"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.latencies = defaultdict(list)
+        self.statuses = defaultdict(lambda: defaultdict(int))
+        self.errors = defaultdict(int)
+
+    def record(self, route, elapsed, status, failed):
+        with self.lock:
+            self.latencies[route].append(elapsed)
+            self.statuses[route][str(status)] += 1
+            if failed:
+                self.errors[route] += 1
+
+
+def percentile(sorted_values, pct):
+    """Percentil por rango más cercano sobre una lista ya ordenada"""
+    if not sorted_values:
+        return 0.0
+    index = max(0, min(len(sorted_values) - 1, int(round(pct / 100 * len(sorted_values))) - 1))
+    return sorted_values[index]
+
+
+class VirtualUser:
+    """Un usuario que se registra, inicia sesión y repite el recorrido principal"""
+
+    def __init__(self, base_url, recorder, rng, think_time, timeout):
+        self.base_url = base_url.rstrip('/')
+        self.recorder = recorder
+        self.rng = rng
+        self.think_time = think_time
+        self.timeout = timeout
+        self.http = requests.Session()
+        self.email = f"load-{uuid.uuid4().hex[:12]}@example.com"
+        self.password = "load-test-password"
+
+    def request(self, method, path, route, expected=(200,), **kwargs):
+        """Hace una petición sin seguir redirecciones y la registra bajo `route`"""
+        start = time.perf_counter()
+        try:
+            response = self.http.request(method, self.base_url + path, allow_redirects=False,
+                                         timeout=self.timeout, **kwargs)
+        except requests.RequestException:
+            self.recorder.record(route, time.perf_counter() - start, 'exception', True)
+            return None
+        elapsed = time.perf_counter() - start
+        self.recorder.record(route, elapsed, response.status_code, response.status_code not in expected)
+        return response
+
+    def think(self):
+        if self.think_time:
+            time.sleep(self.rng.uniform(0, 2 * self.think_time))
+
+    def login(self):
+        self.request('POST', '/register', 'POST /register', expected=(302,), data={
+            'username': self.email.split('@')[0], 'email': self.email, 'password': self.password})
+        response = self.request('POST', '/login', 'POST /login', expected=(302,), data={
+            'email': self.email, 'password': self.password})
+        # Un login fallido redirige de vuelta a la landing
+        return response is not None and 'landing' not in response.headers.get('Location', '')
+
+    def journey(self):
+        """Genera hasta el límite, revisa la colección, marca favoritos, estadísticas y borra"""
+        for _ in range(PHRASE_LIMIT):
+            self.request('POST', '/generate', 'POST /generate', data={
+                'emotion': self.rng.choice(EMOTIONS),
+                'style': self.rng.choice(STYLES),
+            }, headers={'Idempotency-Key': uuid.uuid4().hex})
+            self.think()
+
+        response = self.request('GET', '/collection', 'GET /collection')
+        phrase_ids = PHRASE_ID_PATTERN.findall(response.text) if response is not None else []
+        self.think()
+
+        for phrase_id in phrase_ids:
+            self.request('POST', f'/favorite/{phrase_id}', 'POST /favorite/<id>')
+            self.request('GET', f'/api/phrase/{phrase_id}', 'GET /api/phrase/<id>')
+        self.request('GET', '/collection/favorites', 'GET /collection/favorites')
+        self.request('GET', '/api/phrases?favorites=1', 'GET /api/phrases')
+        self.request('GET', '/stats', 'GET /stats')
+        self.think()
+
+        # Borrar todo para que la siguiente vuelta pueda generar de nuevo
+        for phrase_id in phrase_ids:
+            self.request('POST', f'/delete/{phrase_id}', 'POST /delete/<id>', expected=(302,))
+
+    def run(self, iterations, deadline):
+        if not self.login():
+            return
+        done = 0
+        while (iterations is None or done < iterations) and (deadline is None or time.time() < deadline):
+            self.journey()
+            done += 1
+
+
+def summarize(recorder, wall_time):
+    routes = {}
+    for route in sorted(recorder.latencies):
+        values = sorted(recorder.latencies[route])
+        count = len(values)
+        routes[route] = {
+            'count': count,
+            'errors': recorder.errors[route],
+            'error_rate': recorder.errors[route] / count,
+            'throughput_rps': count / wall_time,
+            'mean_ms': 1000 * sum(values) / count,
+            'p50_ms': 1000 * percentile(values, 50),
+            'p95_ms': 1000 * percentile(values, 95),
+            'p99_ms': 1000 * percentile(values, 99),
+            'max_ms': 1000 * values[-1],
+            'statuses': dict(recorder.statuses[route]),
+        }
+    all_values = sorted(v for values in recorder.latencies.values() for v in values)
+    total_errors = sum(recorder.errors.values())
+    total = {
+        'count': len(all_values),
+        'errors': total_errors,
+        'error_rate': total_errors / len(all_values) if all_values else 0.0,
+        'throughput_rps': len(all_values) / wall_time,
+        'p50_ms': 1000 * percentile(all_values, 50),
+        'p95_ms': 1000 * percentile(all_values, 95),
+        'p99_ms': 1000 * percentile(all_values, 99),
+    }
+    return routes, total
+
+
+def print_report(routes, total, baseline=None):
+    header = f"{'Ruta':<28}{'n':>7}{'rps':>8}{'p50':>9}{'p95':>9}{'p99':>9}{'err%':>7}"
+    if baseline:
+        header += f"{'Δp95':>9}"
+    print(header)
+    print('-' * len(header))
+    for route, s in list(routes.items()) + [('TOTAL', total)]:
+        line = (f"{route:<28}{s['count']:>7}{s['throughput_rps']:>8.1f}{s['p50_ms']:>8.1f}ms"
+                f"{s['p95_ms']:>7.1f}ms{s['p99_ms']:>7.1f}ms{100 * s['error_rate']:>6.1f}%")
+        if baseline:
+            previous = baseline['total'] if route == 'TOTAL' else baseline['routes'].get(route)
+            if previous and previous['p95_ms']:
+                line += f"{100 * (s['p95_ms'] / previous['p95_ms'] - 1):>+8.1f}%"
+        print(line)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Prueba de carga de recorridos de usuario")
+    parser.add_argument('--base-url', default='http://127.0.0.1:5000')
+    parser.add_argument('--users', type=int, default=10, help="Usuarios virtuales concurrentes")
+    parser.add_argument('--iterations', type=int, default=3, help="Recorridos por usuario (0 = sin límite)")
+    parser.add_argument('--duration', type=float, default=None, help="Duración máxima en segundos")
+    parser.add_argument('--think-time', type=float, default=0.0, help="Pausa media entre pasos (s)")
+    parser.add_argument('--ramp-up', type=float, default=0.0, help="Segundos para arrancar a todos los usuarios")
+    parser.add_argument('--timeout', type=float, default=30.0)
+    parser.add_argument('--seed', type=int, default=None)
+    parser.add_argument('--output', help="Guardar resultados en este archivo JSON")
+    parser.add_argument('--compare', help="Resultados JSON previos con los que comparar")
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    recorder = Recorder()
+    iterations = args.iterations or None
+    deadline = time.time() + args.duration if args.duration else None
+    if iterations is None and deadline is None:
+        parser.error("--iterations 0 requiere --duration")
+
+    print(f"🚀 {args.users} usuarios contra {args.base_url}")
+    started_at = datetime.now(timezone.utc)
+    start = time.perf_counter()
+    threads = []
+    for i in range(args.users):
+        user = VirtualUser(args.base_url, recorder, random.Random(rng.random()), args.think_time, args.timeout)
+        thread = threading.Thread(target=user.run, args=(iterations, deadline), name=f"vu-{i}", daemon=True)
+        thread.start()
+        threads.append(thread)
+        if args.ramp_up and args.users > 1:
+            time.sleep(args.ramp_up / (args.users - 1))
+    for thread in threads:
+        thread.join()
+    wall_time = time.perf_counter() - start
+
+    if not recorder.latencies:
+        print("❌ No se registró ninguna petición; ¿está la aplicación en marcha?")
+        sys.exit(1)
+
+    routes, total = summarize(recorder, wall_time)
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+    print_report(routes, total, baseline)
+    print(f"\n⏱️  {wall_time:.1f}s, {total['count']} peticiones, {total['throughput_rps']:.1f} req/s")
+
+    if args.output:
+        result = {
+            'started_at': started_at.isoformat(),
+            'wall_time_s': wall_time,
+            'config': {k: v for k, v in vars(args).items() if k not in ('output', 'compare')},
+            'routes': routes,
+            'total': total,
+        }
+        with open(args.output, 'w') as f:
+            json.dump(result, f, indent=2)
+        print(f"💾 Resultados guardados en {args.output}")
+
+
+if __name__ == "__main__":
+    main()
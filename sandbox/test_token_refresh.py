@@ -0,0 +1,91 @@
+#!/usr/bin/env python3
+"""
+Script para probar la renovación de tokens tras una inactividad larga
+
+Reproduce el caso de un usuario que se va justo después de que una petición
+dispare la renovación en segundo plano: su sesión se queda con el refresh token
+ya canjeado y, al volver (en otro worker, con el access token caducado), debe
+recoger el par nuevo en lugar de canjear otra vez el viejo y quedar deslogueado.
+
+Usa el backend SQLite (refresh tokens de un solo uso, como Supabase) en un
+directorio temporal y adelanta el reloj de services.tokens.
+"""
+
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import services.tokens as tokens
+from services.sqlite_service import SQLiteService, ACCESS_TOKEN_TTL
+from services.tokens import TokenManager, SQLiteRotationStore, ACCESS_TOKEN_KEY, REFRESH_TOKEN_KEY
+
+
+class FakeClock:
+    """Reloj de pared adelantable; monotonic y sleep siguen siendo los reales"""
+
+    monotonic = staticmethod(time.monotonic)
+    sleep = staticmethod(time.sleep)
+
+    def __init__(self):
+        self.offset = 0
+
+    def time(self):
+        return time.time() + self.offset
+
+
+def wait_background(manager):
+    """Espera a que terminen las renovaciones en segundo plano"""
+    deadline = time.monotonic() + 10
+    while manager._scheduled and time.monotonic() < deadline:
+        time.sleep(0.01)
+
+
+def test_idle_after_background_refresh(workdir):
+    """La sesión vuelve con el refresh token que se canjeó en segundo plano"""
+    print("🧪 Probando la vuelta tras una renovación en segundo plano...")
+
+    clock = FakeClock()
+    tokens.time = clock
+    try:
+        storage = SQLiteService(os.path.join(workdir, 'backend.db'))
+        rotations = os.path.join(workdir, 'token_rotations.db')
+        storage.sign_up('idle@example.com', 'secret1', 'Idle')
+        _, access_token, refresh_token = storage.sign_in('idle@example.com', 'secret1')
+        session = {ACCESS_TOKEN_KEY: access_token, REFRESH_TOKEN_KEY: refresh_token}
+
+        # Petición dentro del margen: sigue con el token actual y renueva en segundo plano
+        worker_a = TokenManager(storage, margin=300, async_refresh=True, store=SQLiteRotationStore(rotations))
+        clock.offset = ACCESS_TOKEN_TTL - 200
+        assert worker_a.fresh_access_token(dict(session)) == access_token
+        wait_background(worker_a)
+
+        # El usuario vuelve una hora después, con la sesión intacta, a otro worker
+        clock.offset += 3600
+        worker_b = TokenManager(storage, margin=300, async_refresh=True, store=SQLiteRotationStore(rotations))
+        returned = dict(session)
+        fresh = worker_b.fresh_access_token(returned)
+        assert fresh is not None, "la sesión se cerró: se canjeó otra vez el refresh token viejo"
+        assert returned[REFRESH_TOKEN_KEY] != refresh_token
+        assert storage.verify_access_token(fresh) is not None
+        print("   ✅ La sesión recoge el par renovado y sigue abierta")
+
+        # Una segunda pestaña con la misma sesión vieja obtiene el mismo par
+        assert worker_b.fresh_access_token(dict(session)) == fresh
+        print("   ✅ Las peticiones siguientes con el token viejo reciben el mismo par")
+    finally:
+        tokens.time = time
+
+
+def main():
+    print("🚀 Iniciando pruebas de renovación de tokens")
+    print("=" * 50)
+    with tempfile.TemporaryDirectory() as workdir:
+        test_idle_after_background_refresh(workdir)
+    print("\n🎉 ¡Pruebas de renovación de tokens completadas!")
+
+
+if __name__ == "__main__":
+    main()
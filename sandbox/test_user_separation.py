@@ -70,7 +70,7 @@ def test_user_filtering():
                 
                 # Mostrar algunas frases
                 for i, phrase in enumerate(phrases[:3]):
-                    print(f"   {i+1}. '{phrase['generated_phrase']}' ({phrase['language']})")
+                    print(f"   {i+1}. '{phrase.generated_phrase}' ({phrase.language})")
                 
                 if len(phrases) > 3:
                     print(f"   ... y {len(phrases) - 3} más")
@@ -115,7 +115,7 @@ def test_user_favorites():
                 print(f"   📊 Total favoritos: {len(favorites)}")
                 
                 for i, phrase in enumerate(favorites[:2]):
-                    print(f"   {i+1}. '{phrase['generated_phrase']}'")
+                    print(f"   {i+1}. '{phrase.generated_phrase}'")
                 
                 if len(favorites) > 2:
                     print(f"   ... y {len(favorites) - 2} más")
@@ -146,7 +146,7 @@ def test_user_language_filtering():
                 print(f"   📊 Total: {len(phrases)} frases")
                 
                 for i, phrase in enumerate(phrases[:2]):
-                    print(f"   {i+1}. '{phrase['generated_phrase']}'")
+                    print(f"   {i+1}. '{phrase.generated_phrase}'")
                 
                 if len(phrases) > 2:
                     print(f"   ... y {len(phrases) - 2} más")
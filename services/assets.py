@@ -0,0 +1,246 @@
+#!/usr/bin/env python3
+"""
+Archivos estáticos con huella de contenido.
+
+`python -m services.assets` minifica static/css/*.css y static/js/*.js y los
+escribe en static/dist con el hash del contenido en el nombre, junto con sus
+variantes .gz y .br (esta última si el paquete opcional `brotli` está instalado)
+y un manifest.json {original: versión con hash}.
+
+En ejecución, `asset_url_for` (mismos argumentos que url_for) resuelve los
+archivos del manifest, y la ruta static sirve los de dist con Cache-Control
+immutable y la variante precomprimida que acepte el navegador. Sin manifest
+(desarrollo) todo funciona como el static de Flask.
+"""
+
+import argparse
+import gzip
+import hashlib
+import json
+import logging
+import mimetypes
+import os
+import re
+import shutil
+import sys
+
+from dotenv import load_dotenv
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# Cargar variables de entorno desde .env
+load_dotenv()
+
+ASSETS_DIR = "dist"
+ASSETS_SOURCES = ("css/*.css", "js/*.js")
+# Un año: el nombre cambia con el contenido, así que nunca hace falta revalidar
+ASSETS_MAX_AGE = int(os.environ.get("ASSETS_MAX_AGE", str(365 * 24 * 3600)))
+
+# Variantes precomprimidas por orden de preferencia: (Content-Encoding, sufijo)
+PRECOMPRESSED = (('br', '.br'), ('gzip', '.gz'))
+
+logger = logging.getLogger(__name__)
+
+_manifest = {}
+
+
+# Minificación (conservadora, sin dependencias)
+
+_CSS_SKIP = re.compile(r'("(?:\\.|[^"\\])*"|\'(?:\\.|[^\'\\])*\')|/\*.*?\*/', re.S)
+_JS_WORD = re.compile(r'[\w$]')
+# Tras estos caracteres una '/' empieza una expresión regular y no una división
+_JS_REGEX_PREFIX = set('(,=:[!&|?{};+-*%<>~^')
+
+
+def _squeeze_css(text):
+    text = re.sub(r'\s+', ' ', text)
+    text = re.sub(r'\s*([{};,>])\s*', r'\1', text)
+    return re.sub(r':\s+', ':', text).replace(';}', '}')
+
+
+def minify_css(source):
+    """Quita comentarios y espacios sobrantes sin tocar las cadenas"""
+    parts, position = [], 0
+    for match in _CSS_SKIP.finditer(source):
+        parts.append(_squeeze_css(source[position:match.start()]))
+        if match.group(1):
+            parts.append(match.group(1))
+        position = match.end()
+    parts.append(_squeeze_css(source[position:]))
+    return ''.join(parts).strip() + '\n'
+
+
+def minify_js(source):
+    """
+    Quita comentarios, sangrías y líneas vacías. Conserva los saltos de línea que
+    puedan cerrar una sentencia (inserción automática de ';') y copia tal cual las
+    cadenas, plantillas (sin plantillas anidadas) y expresiones regulares
+    """
+    out, last, i, n = [], '', 0, len(source)
+    while i < n:
+        char = source[i]
+        if char in '\'"`':
+            j = i + 1
+            while j < n and source[j] != char:
+                j += 2 if source[j] == '\\' else 1
+            out.append(source[i:j + 1])
+            last, i = char, j + 1
+        elif source.startswith('//', i):
+            j = source.find('\n', i)
+            i = n if j < 0 else j
+        elif source.startswith('/*', i):
+            j = source.find('*/', i + 2)
+            i = n if j < 0 else j + 2
+        elif char == '/' and (not last or last in _JS_REGEX_PREFIX):
+            j, in_class = i + 1, False
+            while j < n and source[j] != '\n':
+                if source[j] == '\\':
+                    j += 2
+                    continue
+                if source[j] == '[':
+                    in_class = True
+                elif source[j] == ']':
+                    in_class = False
+                elif source[j] == '/' and not in_class:
+                    break
+                j += 1
+            out.append(source[i:j + 1])
+            last, i = '/', j + 1
+        elif char.isspace():
+            j = i
+            while j < n and source[j].isspace():
+                j += 1
+            following = source[j] if j < n else ''
+            if not last or not following:
+                pass
+            elif '\n' in source[i:j] and last not in '{(,[;' and following not in '})],;.:?':
+                out.append('\n')
+            elif (_JS_WORD.match(last) and _JS_WORD.match(following)) or (last in '+-' and following == last):
+                out.append(' ')
+            i = j
+        else:
+            out.append(char)
+            last, i = char, i + 1
+    return ''.join(out) + '\n'
+
+
+MINIFIERS = {'.css': minify_css, '.js': minify_js}
+
+
+# Construcción
+
+def build(static_folder, verbose=True):
+    """Genera static/dist y su manifest; retorna el manifest"""
+    import glob
+
+    output = os.path.join(static_folder, ASSETS_DIR)
+    shutil.rmtree(output, ignore_errors=True)
+    manifest = {}
+    for pattern in ASSETS_SOURCES:
+        for path in sorted(glob.glob(os.path.join(static_folder, pattern))):
+            name = os.path.relpath(path, static_folder).replace(os.sep, '/')
+            stem, ext = os.path.splitext(name)
+            with open(path, encoding='utf-8') as f:
+                source = f.read()
+            data = MINIFIERS[ext](source).encode('utf-8')
+            digest = hashlib.sha256(data).hexdigest()[:10]
+            hashed = f"{ASSETS_DIR}/{stem}.{digest}{ext}"
+
+            target = os.path.join(static_folder, hashed)
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            variants = {'': data, '.gz': gzip.compress(data, 9, mtime=0)}
+            if brotli is not None:
+                variants['.br'] = brotli.compress(data, quality=11)
+            for suffix, content in variants.items():
+                # Una variante que no ahorra nada no merece la pena servirla
+                if not suffix or len(content) < len(data):
+                    with open(target + suffix, 'wb') as f:
+                        f.write(content)
+
+            manifest[name] = hashed
+            if verbose:
+                sizes = ' '.join(f"{suffix or 'min'}={len(content)}" for suffix, content in variants.items())
+                print(f"{name} -> {hashed}  original={len(source.encode('utf-8'))} {sizes}")
+
+    with open(os.path.join(output, 'manifest.json'), 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+    return manifest
+
+
+# Ejecución
+
+def load_manifest(static_folder):
+    """Carga static/dist/manifest.json si existe (si no, los archivos se sirven sin hash)"""
+    global _manifest
+    path = os.path.join(static_folder, ASSETS_DIR, 'manifest.json')
+    try:
+        with open(path, encoding='utf-8') as f:
+            _manifest = json.load(f)
+    except FileNotFoundError:
+        _manifest = {}
+    return _manifest
+
+
+def asset_url_for(endpoint, **values):
+    """url_for que cambia los archivos estáticos del manifest por su versión con hash"""
+    from flask import url_for
+
+    if endpoint == 'static' and values.get('filename') in _manifest:
+        values['filename'] = _manifest[values['filename']]
+    return url_for(endpoint, **values)
+
+
+def send_static(filename):
+    """
+    Sustituto de la vista static de Flask: los archivos de dist son inmutables y
+    se sirven precomprimidos si el navegador acepta br o gzip
+    """
+    from flask import current_app, request, send_from_directory
+    from werkzeug.security import safe_join
+
+    if not filename.startswith(ASSETS_DIR + '/'):
+        return current_app.send_static_file(filename)
+
+    static_folder = current_app.static_folder
+    encoding, suffix = None, ''
+    for candidate, candidate_suffix in PRECOMPRESSED:
+        path = safe_join(static_folder, filename + candidate_suffix)
+        if request.accept_encodings[candidate] and path and os.path.isfile(path):
+            encoding, suffix = candidate, candidate_suffix
+            break
+
+    response = send_from_directory(static_folder, filename + suffix, max_age=ASSETS_MAX_AGE,
+                                   mimetype=mimetypes.guess_type(filename)[0])
+    if encoding:
+        response.headers['Content-Encoding'] = encoding
+    response.vary.add('Accept-Encoding')
+    response.cache_control.public = True
+    response.cache_control.immutable = True
+    return response
+
+
+def init_app(app):
+    """Carga el manifest, expone asset_url_for en las plantillas y sirve static/dist"""
+    manifest = load_manifest(app.static_folder)
+    if manifest:
+        logger.info("Archivos estáticos con hash: %d", len(manifest))
+    app.jinja_env.globals['asset_url_for'] = asset_url_for
+    app.view_functions['static'] = send_static
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Minifica y versiona los archivos estáticos en static/dist")
+    parser.add_argument('--static', default=os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                                                         'static'), help="Carpeta static")
+    args = parser.parse_args(argv)
+    if brotli is None:
+        print("brotli no está instalado: solo se generan variantes .gz", file=sys.stderr)
+    manifest = build(args.static)
+    print(f"{len(manifest)} archivos en {os.path.join(args.static, ASSETS_DIR)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,83 @@
+#!/usr/bin/env python3
+"""
+Caché en memoria con expiración (TTL) para datos de corta vida
+"""
+
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+
+# Cachés con nombre, para exponer sus aciertos y fallos
+_caches = {}
+
+
+def content_hash(text):
+    """Hash corto y estable de un texto (p. ej. una frase) para conjuntos en caché"""
+    return hashlib.blake2b(text.strip().encode('utf-8'), digest_size=8).hexdigest()
+
+
+def register_cache(name, cache):
+    """Registra una caché con nombre (con atributos hits, misses y evictions, y len())"""
+    _caches[name] = cache
+
+
+class TTLCache:
+    """Caché LRU en memoria con expiración por entrada, segura entre hilos"""
+
+    def __init__(self, ttl=300, max_entries=1024, name=None):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        if name:
+            register_cache(name, self)
+
+    def get(self, key, default=None):
+        """Obtiene un valor si existe y no ha expirado"""
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                self.misses += 1
+                return default
+            expires_at, value = item
+            if expires_at < time.monotonic():
+                del self._data[key]
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key, value, ttl=None):
+        """Guarda un valor, expulsando el menos usado si se supera el límite"""
+        expires_at = time.monotonic() + (self.ttl if ttl is None else ttl)
+        with self._lock:
+            self._data[key] = (expires_at, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def pop(self, key, default=None):
+        """Elimina una entrada y devuelve su valor"""
+        with self._lock:
+            item = self._data.pop(key, None)
+        return item[1] if item else default
+
+    def clear(self):
+        """Vacía la caché"""
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+
+def cache_stats():
+    """Aciertos, fallos, expulsiones y tamaño de todas las cachés con nombre"""
+    return {name: {'hits': c.hits, 'misses': c.misses, 'evictions': c.evictions, 'entries': len(c)}
+            for name, c in _caches.items()}
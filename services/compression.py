@@ -0,0 +1,138 @@
+#!/usr/bin/env python3
+"""
+Compresión gzip o brotli de las respuestas HTML y JSON (middleware WSGI).
+
+Solo se comprimen respuestas completas con Content-Length de al menos
+COMPRESSION_MIN_SIZE bytes: las respuestas en streaming (sin Content-Length,
+p. ej. la colección con COLLECTION_STREAM_PAGES) y los eventos SSE pasan sin
+tocar para no retener sus trozos. Tampoco se recomprime lo que ya trae
+Content-Encoding (los estáticos precomprimidos de services/assets).
+"""
+
+import gzip
+import os
+
+from dotenv import load_dotenv
+from werkzeug.datastructures import Headers
+from werkzeug.http import parse_accept_header, parse_options_header
+
+from services.metrics import METRICS_ENABLED, compressed_responses, compression_saved_bytes
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# Cargar variables de entorno desde .env
+load_dotenv()
+
+COMPRESSION_ENABLED = os.environ.get("COMPRESSION_ENABLED", "true").lower() == "true"
+COMPRESSION_MIN_SIZE = int(os.environ.get("COMPRESSION_MIN_SIZE", "1024"))
+# Niveles: gzip 1-9 y brotli 0-11; los intermedios comprimen casi igual y mucho más rápido
+COMPRESSION_GZIP_LEVEL = int(os.environ.get("COMPRESSION_GZIP_LEVEL", "6"))
+COMPRESSION_BROTLI_LEVEL = int(os.environ.get("COMPRESSION_BROTLI_LEVEL", "5"))
+
+COMPRESSIBLE_TYPES = {'text/html', 'text/plain', 'text/css', 'text/csv', 'application/json',
+                      'application/javascript', 'text/javascript', 'image/svg+xml'}
+
+
+def _gzip(data):
+    return gzip.compress(data, COMPRESSION_GZIP_LEVEL, mtime=0)
+
+
+def _brotli(data):
+    return brotli.compress(data, quality=COMPRESSION_BROTLI_LEVEL)
+
+
+# Por orden de preferencia
+ENCODERS = ([('br', _brotli)] if brotli is not None else []) + [('gzip', _gzip)]
+
+
+def negotiate(accept_encoding):
+    """(codificación, función) preferida entre las que acepta el cliente, o (None, None)"""
+    accepted = parse_accept_header(accept_encoding or '')
+    for encoding, encode in ENCODERS:
+        if accepted[encoding]:
+            return encoding, encode
+    return None, None
+
+
+def is_compressible(status, headers, min_size=COMPRESSION_MIN_SIZE):
+    """Indica si una respuesta (estado y cabeceras WSGI) se puede comprimir"""
+    if int(status.split(' ', 1)[0]) in (204, 206, 304):
+        return False
+    headers = Headers(headers)
+    if 'Content-Encoding' in headers or 'Content-Range' in headers:
+        return False
+    if 'no-transform' in headers.get('Cache-Control', ''):
+        return False
+    # Sin Content-Length es streaming (plantillas en streaming, SSE): no se retiene
+    length = headers.get('Content-Length', type=int)
+    if length is None or length < min_size:
+        return False
+    mimetype, _ = parse_options_header(headers.get('Content-Type', ''))
+    return mimetype in COMPRESSIBLE_TYPES
+
+
+class CompressionMiddleware:
+    """Comprime con gzip o brotli según Accept-Encoding las respuestas que lo merecen"""
+
+    def __init__(self, app, min_size=COMPRESSION_MIN_SIZE):
+        self.app = app
+        self.min_size = min_size
+
+    def __call__(self, environ, start_response):
+        encoding, encode = negotiate(environ.get('HTTP_ACCEPT_ENCODING'))
+        if encoding is None:
+            return self.app(environ, start_response)
+
+        captured = {}
+
+        def capture_start_response(status, headers, exc_info=None):
+            if exc_info is not None or not is_compressible(status, headers, self.min_size):
+                captured['passthrough'] = True
+                return start_response(status, headers, exc_info)
+            captured['response'] = (status, headers)
+            body = captured.setdefault('body', [])
+            return body.append
+
+        app_iter = self.app(environ, capture_start_response)
+        # Flask llama a start_response antes de devolver el cuerpo; si no, no se toca
+        if 'response' not in captured:
+            return app_iter
+
+        try:
+            body = b''.join(captured['body']) + b''.join(app_iter)
+        finally:
+            if hasattr(app_iter, 'close'):
+                app_iter.close()
+
+        status, headers = captured['response']
+        headers = Headers(headers)
+        vary = headers.get('Vary', '')
+        if 'accept-encoding' not in vary.lower():
+            headers['Vary'] = f"{vary}, Accept-Encoding" if vary else 'Accept-Encoding'
+
+        compressed = encode(body) if body else body
+        if not body or len(compressed) >= len(body):
+            start_response(status, headers.to_wsgi_list())
+            return [body]
+
+        headers['Content-Encoding'] = encoding
+        headers['Content-Length'] = str(len(compressed))
+        # El ETag fuerte identifica los bytes exactos, que ahora son otros
+        etag = headers.get('ETag')
+        if etag and not etag.startswith('W/'):
+            headers['ETag'] = 'W/' + etag
+        if METRICS_ENABLED:
+            compressed_responses.inc(encoding=encoding)
+            compression_saved_bytes.inc(len(body) - len(compressed), encoding=encoding)
+        start_response(status, headers.to_wsgi_list())
+        return [compressed]
+
+
+def wrap(wsgi_app):
+    """Envuelve la aplicación WSGI con la compresión si está activada"""
+    if not COMPRESSION_ENABLED:
+        return wsgi_app
+    return CompressionMiddleware(wsgi_app)
@@ -0,0 +1,168 @@
+#!/usr/bin/env python3
+"""
+Versión de los datos de cada usuario para peticiones condicionales (ETag y
+Last-Modified) y cachés de fragmentos: cualquier escritura de sus frases o de
+su perfil la incrementa. Debe compartirse entre workers (SQLite o Redis): con
+una versión por proceso, otro worker respondería 304 con datos viejos.
+"""
+
+import hashlib
+import logging
+import os
+import sqlite3
+import threading
+import time
+from dotenv import load_dotenv
+from config.redis_config import get_redis_client
+
+# Cargar variables de entorno desde .env
+load_dotenv()
+
+DATA_VERSION_BACKEND = os.environ.get("DATA_VERSION_BACKEND", "")   # memory | sqlite | redis
+DATA_VERSION_PATH = os.environ.get("DATA_VERSION_PATH", "instance/data_versions.db")
+# Identificador del despliegue: forma parte del ETag para que un cambio de plantillas o
+# de código invalide las copias de los navegadores. Si no se define, se calcula.
+APP_RELEASE = os.environ.get("APP_RELEASE", "")
+
+logger = logging.getLogger(__name__)
+
+
+class InMemoryDataVersionBackend:
+    """Versiones en memoria del proceso (solo para un único worker)"""
+
+    def __init__(self):
+        self._versions = {}
+        self._lock = threading.Lock()
+
+    def get(self, user_id):
+        with self._lock:
+            return self._versions.setdefault(user_id, (0, time.time()))
+
+    def bump(self, user_id):
+        with self._lock:
+            version, _ = self._versions.get(user_id, (0, 0.0))
+            self._versions[user_id] = (version + 1, time.time())
+
+
+class SQLiteDataVersionBackend:
+    """Versiones en un archivo SQLite compartido por los workers de una máquina"""
+
+    def __init__(self, path):
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None, timeout=5)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS data_versions "
+                           "(user_id TEXT PRIMARY KEY, version INTEGER NOT NULL, modified_at REAL NOT NULL)")
+        self._lock = threading.Lock()
+
+    def get(self, user_id):
+        with self._lock:
+            row = self._conn.execute("SELECT version, modified_at FROM data_versions WHERE user_id = ?",
+                                     (user_id,)).fetchone()
+            if row is None:
+                # Primera vez que se ve al usuario: fijar la fecha para que todos los workers coincidan
+                self._conn.execute("INSERT OR IGNORE INTO data_versions VALUES (?, 0, ?)", (user_id, time.time()))
+                row = self._conn.execute("SELECT version, modified_at FROM data_versions WHERE user_id = ?",
+                                         (user_id,)).fetchone()
+            return row
+
+    def bump(self, user_id):
+        with self._lock:
+            self._conn.execute(
+                "INSERT INTO data_versions VALUES (?, 1, ?) "
+                "ON CONFLICT(user_id) DO UPDATE SET version = version + 1, modified_at = excluded.modified_at",
+                (user_id, time.time()))
+
+
+class RedisDataVersionBackend:
+    """Versiones en un hash de Redis por usuario, compartidas entre máquinas"""
+
+    def __init__(self, client):
+        self.client = client
+
+    def _key(self, user_id):
+        return f"data_version:{user_id}"
+
+    def get(self, user_id):
+        key = self._key(user_id)
+        version, modified_at = self.client.hmget(key, 'version', 'modified_at')
+        if modified_at is None:
+            self.client.hsetnx(key, 'modified_at', time.time())
+            version, modified_at = self.client.hmget(key, 'version', 'modified_at')
+        return int(version or 0), float(modified_at)
+
+    def bump(self, user_id):
+        pipe = self.client.pipeline(transaction=True)
+        pipe.hincrby(self._key(user_id), 'version', 1)
+        pipe.hset(self._key(user_id), 'modified_at', time.time())
+        pipe.execute()
+
+
+class DataVersions:
+    """Versión y fecha de modificación de los datos de cada usuario"""
+
+    def __init__(self, backend):
+        self.backend = backend
+        self._listeners = []
+
+    def subscribe(self, callback):
+        """callback(user_id) tras cada incremento en este worker (p. ej. liberar cachés locales)"""
+        self._listeners.append(callback)
+
+    def get(self, user_id):
+        """(versión, fecha de modificación en segundos epoch) del usuario"""
+        version, modified_at = self.backend.get(user_id)
+        return int(version), float(modified_at)
+
+    def bump(self, user_id):
+        """Marca que los datos del usuario cambiaron (no falla la escritura si el almacén no responde)"""
+        if not user_id:
+            return
+        try:
+            self.backend.bump(user_id)
+        except Exception:
+            logger.exception("Error incrementando la versión de datos", extra={'user_id': user_id})
+        for callback in self._listeners:
+            try:
+                callback(user_id)
+            except Exception:
+                logger.exception("Error notificando el cambio de versión", extra={'user_id': user_id})
+
+    def validators(self, user_id, *parts):
+        """(ETag, fecha de modificación) de la versión actual; `parts` se añaden al ETag"""
+        version, modified_at = self.get(user_id)
+        raw = f"{user_id}:{version}:{modified_at!r}:{':'.join(map(str, parts))}"
+        return hashlib.blake2b(raw.encode('utf-8'), digest_size=12).hexdigest(), modified_at
+
+
+def _compute_release():
+    """Huella de las plantillas y el código (ruta, tamaño y fecha): igual en todos los workers"""
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    digest = hashlib.blake2b(digest_size=8)
+    # El manifest de los estáticos cambia las URLs de CSS y JS de todas las páginas
+    for folder in ('templates', 'templates/partials', 'services', '.', 'static/dist'):
+        base = os.path.join(root, folder)
+        if not os.path.isdir(base):
+            continue
+        for name in sorted(os.listdir(base)):
+            if name.endswith(('.html', '.py', 'manifest.json')):
+                stat = os.stat(os.path.join(base, name))
+                digest.update(f"{folder}/{name}:{stat.st_size}:{stat.st_mtime_ns}".encode('utf-8'))
+    return digest.hexdigest()
+
+
+def _create_backend():
+    """Redis si está configurado; si no, un archivo SQLite compartido entre workers"""
+    backend = DATA_VERSION_BACKEND.lower()
+    if backend in ('', 'redis'):
+        client = get_redis_client()
+        if client is not None:
+            return RedisDataVersionBackend(client)
+    if backend == 'memory':
+        return InMemoryDataVersionBackend()
+    return SQLiteDataVersionBackend(DATA_VERSION_PATH)
+
+
+APP_RELEASE = APP_RELEASE or _compute_release()
+data_versions = DataVersions(_create_backend())
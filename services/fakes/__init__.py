@@ -0,0 +1 @@
+# Sustitutos locales de Supabase y OpenAI para pruebas de carga sin red
@@ -0,0 +1,177 @@
+#!/usr/bin/env python3
+"""
+Grabación y reproducción del tráfico HTTP con Supabase y OpenAI (cassettes).
+
+Un transporte de httpx que, en modo 'record', hace las peticiones reales y guarda
+cada interacción en un archivo JSON Lines; en modo 'replay' responde desde el
+archivo sin red, con los tiempos grabados, sin espera o con una distribución
+sintética (ver services/fakes/latency.py).
+"""
+
+import base64
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from collections import defaultdict
+from urllib.parse import parse_qsl, urlencode
+
+import httpx
+from dotenv import load_dotenv
+
+from services.fakes.latency import LatencyModel
+
+# Cargar variables de entorno desde .env
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+CASSETTE_MODE = os.environ.get("CASSETTE_MODE", "off").lower()
+CASSETTE_DIR = os.environ.get("CASSETTE_DIR", "instance/cassettes")
+# 'recorded' (tiempos originales), 'none' o una distribución como 'lognormal:80:0.3'
+CASSETTE_TIMING = os.environ.get("CASSETTE_TIMING", "recorded")
+CASSETTE_SEED = os.environ.get("CASSETTE_SEED")
+
+# Credenciales y cabeceras que cambian en cada respuesta: nunca se guardan
+SKIPPED_REQUEST_HEADERS = {'authorization', 'apikey', 'cookie', 'x-client-info', 'user-agent'}
+SKIPPED_RESPONSE_HEADERS = {'content-encoding', 'content-length', 'transfer-encoding', 'connection',
+                            'date', 'set-cookie', 'server', 'cf-ray', 'x-request-id'}
+
+
+class CassetteMiss(httpx.TransportError):
+    """La petición no está en el cassette"""
+
+
+def _route_key(method, url):
+    """Método, ruta y query ordenada (sin host, para poder cambiar de proyecto)"""
+    query = urlencode(sorted(parse_qsl(url.query.decode('ascii'), keep_blank_values=True)))
+    return f"{method} {url.path}?{query}"
+
+
+def _body_hash(content):
+    return hashlib.sha256(content or b'').hexdigest()[:16]
+
+
+class CassetteTransport(httpx.BaseTransport):
+    """
+    Transporte de httpx con modos 'record' y 'replay'.
+
+    En reproducción se busca primero una interacción con la misma ruta y el mismo
+    cuerpo; si no la hay (p. ej. inserts con ids o fechas nuevas), cualquiera con la
+    misma ruta. Las coincidencias se sirven en el orden grabado y se reciclan.
+    """
+
+    def __init__(self, path, mode='replay', timing='recorded', seed=None, transport=None):
+        if mode not in ('record', 'replay'):
+            raise ValueError(f"Modo de cassette no soportado: {mode}")
+        self.path = path
+        self.mode = mode
+        self._lock = threading.Lock()
+
+        if timing in ('recorded', 'none'):
+            self.timing = timing
+            self.latency = None
+        else:
+            self.timing = 'synthetic'
+            self.latency = LatencyModel.from_spec(timing, seed=seed)
+
+        if mode == 'record':
+            os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+            self._inner = transport or httpx.HTTPTransport()
+            self._file = open(path, 'a', encoding='utf-8')
+        else:
+            self._exact = defaultdict(list)
+            self._loose = defaultdict(list)
+            self._cursors = defaultdict(int)
+            with open(path, encoding='utf-8') as f:
+                for line in f:
+                    if line.strip():
+                        interaction = json.loads(line)
+                        request = interaction['request']
+                        self._loose[request['route']].append(interaction)
+                        self._exact[(request['route'], request['body_hash'])].append(interaction)
+
+    def handle_request(self, request):
+        if self.mode == 'record':
+            return self._record(request)
+        return self._replay(request)
+
+    def _record(self, request):
+        start = time.perf_counter()
+        response = self._inner.handle_request(request)
+        content = response.read()
+        elapsed = time.perf_counter() - start
+
+        try:
+            body = {'text': content.decode('utf-8')}
+        except UnicodeDecodeError:
+            body = {'base64': base64.b64encode(content).decode('ascii')}
+        interaction = {
+            'request': {
+                'route': _route_key(request.method, request.url),
+                'body_hash': _body_hash(request.content),
+                'headers': {k: v for k, v in request.headers.items() if k.lower() not in SKIPPED_REQUEST_HEADERS},
+            },
+            'response': {
+                'status': response.status_code,
+                'headers': [(k, v) for k, v in response.headers.items()
+                            if k.lower() not in SKIPPED_RESPONSE_HEADERS],
+                **body,
+            },
+            'elapsed_ms': round(elapsed * 1000, 3),
+        }
+        with self._lock:
+            self._file.write(json.dumps(interaction, ensure_ascii=False) + "\n")
+            self._file.flush()
+
+        return httpx.Response(response.status_code, headers=interaction['response']['headers'],
+                              content=content, request=request)
+
+    def _next(self, table, key):
+        candidates = table.get(key)
+        if not candidates:
+            return None
+        with self._lock:
+            index = self._cursors[key]
+            self._cursors[key] = index + 1
+        return candidates[index % len(candidates)]
+
+    def _replay(self, request):
+        route = _route_key(request.method, request.url)
+        interaction = (self._next(self._exact, (route, _body_hash(request.content)))
+                       or self._next(self._loose, route))
+        if interaction is None:
+            raise CassetteMiss(f"Sin grabación para {route} en {self.path}", request=request)
+
+        if self.timing == 'recorded':
+            time.sleep(interaction['elapsed_ms'] / 1000)
+        elif self.timing == 'synthetic':
+            self.latency.wait()
+
+        recorded = interaction['response']
+        if 'base64' in recorded:
+            content = base64.b64decode(recorded['base64'])
+        else:
+            content = recorded['text'].encode('utf-8')
+        return httpx.Response(recorded['status'], headers=recorded['headers'], content=content, request=request)
+
+    def close(self):
+        if self.mode == 'record':
+            self._inner.close()
+            self._file.close()
+
+
+def cassette_http_client(name, **kwargs):
+    """
+    Cliente httpx que graba o reproduce el cassette `name` según CASSETTE_MODE,
+    o None si está desactivado (el SDK usa entonces su cliente por defecto)
+    """
+    if CASSETTE_MODE in ('', 'off'):
+        return None
+    path = os.path.join(CASSETTE_DIR, f"{name}.jsonl")
+    transport = CassetteTransport(path, CASSETTE_MODE, CASSETTE_TIMING,
+                                  int(CASSETTE_SEED) if CASSETTE_SEED else None)
+    logger.info("Cassette %s: %s (%s)", name, CASSETTE_MODE, path)
+    return httpx.Client(transport=transport, timeout=kwargs.pop('timeout', 30.0), **kwargs)
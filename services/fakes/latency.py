@@ -0,0 +1,59 @@
+#!/usr/bin/env python3
+"""
+Modelos de latencia y errores configurables para los servicios simulados
+"""
+
+import random
+import time
+
+
+class LatencyModel:
+    """
+    Distribución de latencia en milisegundos, descrita como texto:
+      constant:50            siempre 50 ms
+      uniform:20:80          uniforme entre 20 y 80 ms
+      normal:100:20          normal con media 100 y desviación 20
+      lognormal:800:0.5      lognormal con mediana 800 y sigma 0.5
+      exponential:100        exponencial con media 100
+    """
+
+    def __init__(self, kind='constant', params=(0,), error_rate=0.0, seed=None):
+        self.kind = kind
+        self.params = params
+        self.error_rate = error_rate
+        self.random = random.Random(seed)
+
+    @classmethod
+    def from_spec(cls, spec, error_rate=0.0, seed=None):
+        """Crea el modelo a partir de un texto como 'lognormal:800:0.5'"""
+        kind, *params = (spec or 'constant:0').split(':')
+        if kind not in ('constant', 'uniform', 'normal', 'lognormal', 'exponential'):
+            raise ValueError(f"Distribución de latencia no soportada: {kind}")
+        return cls(kind, tuple(float(p) for p in params) or (0,), float(error_rate or 0), seed)
+
+    def sample(self):
+        """Latencia en segundos"""
+        r = self.random
+        p = self.params
+        if self.kind == 'uniform':
+            ms = r.uniform(p[0], p[1])
+        elif self.kind == 'normal':
+            ms = r.gauss(p[0], p[1])
+        elif self.kind == 'lognormal':
+            ms = p[0] * r.lognormvariate(0, p[1])
+        elif self.kind == 'exponential':
+            ms = r.expovariate(1 / p[0]) if p[0] else 0
+        else:
+            ms = p[0]
+        return max(0.0, ms) / 1000
+
+    def should_fail(self):
+        """Decide si esta llamada debe fallar según la tasa de errores"""
+        return self.error_rate > 0 and self.random.random() < self.error_rate
+
+    def wait(self):
+        """Duerme la latencia muestreada"""
+        delay = self.sample()
+        if delay:
+            time.sleep(delay)
+        return delay
@@ -0,0 +1,203 @@
+#!/usr/bin/env python3
+"""
+Sustituto de la API de chat completions de OpenAI con latencia y errores configurables.
+
+Se puede usar en proceso (OPENAI_FAKE=true) o como servidor local:
+    python -m services.fakes.openai --port 8081
+y apuntar la aplicación con OPENAI_BASE_URL=http://127.0.0.1:8081/v1
+"""
+
+import argparse
+import json
+import os
+import re
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import httpx
+import openai
+from dotenv import load_dotenv
+from openai.types.chat import ChatCompletion
+
+from services.fakes.latency import LatencyModel
+
+# Cargar variables de entorno desde .env
+load_dotenv()
+
+FAKE_OPENAI_LATENCY = os.environ.get("FAKE_OPENAI_LATENCY", "constant:0")
+FAKE_OPENAI_ERROR_RATE = os.environ.get("FAKE_OPENAI_ERROR_RATE", "0")
+FAKE_OPENAI_SEED = os.environ.get("FAKE_OPENAI_SEED")
+
+ENGLISH_HINTS = {'i', 'the', 'and', 'feel', 'am', 'my', 'is', 'so', 'of', 'to', 'with', 'you', 'me', 'sad', 'happy'}
+SPANISH_HINTS = {'yo', 'el', 'la', 'y', 'me', 'siento', 'estoy', 'mi', 'es', 'muy', 'de', 'que', 'con', 'triste', 'feliz'}
+
+WORDS = {
+    'es': {
+        'subjects': ['La luna', 'El silencio', 'Tu nombre', 'La lluvia', 'El mar', 'Mi sombra', 'La memoria', 'El viento'],
+        'verbs': ['guarda', 'susurra', 'dibuja', 'olvida', 'abraza', 'enciende', 'deshace', 'espera'],
+        'objects': ['lo que no dije', 'un verano lejano', 'la última carta', 'tus pasos', 'el eco de ayer',
+                    'una promesa tibia', 'la orilla del alba', 'mis preguntas'],
+        'endings': ['en voz baja', 'sin prisa', 'entre líneas', 'cada noche', 'todavía', 'como antes'],
+    },
+    'en': {
+        'subjects': ['The moon', 'Silence', 'Your name', 'The rain', 'The sea', 'My shadow', 'Memory', 'The wind'],
+        'verbs': ['keeps', 'whispers', 'draws', 'forgets', 'embraces', 'kindles', 'unravels', 'awaits'],
+        'objects': ['what I never said', 'a distant summer', 'the last letter', 'your footsteps', 'yesterday\'s echo',
+                    'a gentle promise', 'the edge of dawn', 'my questions'],
+        'endings': ['softly', 'unhurried', 'between the lines', 'every night', 'still', 'as before'],
+    },
+}
+
+
+def _guess_language(text):
+    """Heurística barata: palabras frecuentes y tildes"""
+    words = re.findall(r"[a-záéíóúñü']+", text.lower())
+    en = sum(w in ENGLISH_HINTS for w in words)
+    es = sum(w in SPANISH_HINTS for w in words) + 2 * bool(re.search(r"[áéíóúñ¿¡]", text.lower()))
+    return 'en' if en > es else 'es'
+
+
+def _count_tokens(text):
+    """Aproximación de tokens (~4 caracteres por token)"""
+    return max(1, len(text) // 4)
+
+
+class FakeChatModel:
+    """Genera respuestas de chat completions plausibles para los prompts de la aplicación"""
+
+    def __init__(self, latency=None):
+        self.latency = latency or LatencyModel.from_spec(
+            FAKE_OPENAI_LATENCY, FAKE_OPENAI_ERROR_RATE,
+            int(FAKE_OPENAI_SEED) if FAKE_OPENAI_SEED else None)
+        self._lock = threading.Lock()
+
+    def _phrase(self, language):
+        words = WORDS[language]
+        with self._lock:
+            r = self.latency.random
+            return (f"{r.choice(words['subjects'])} {r.choice(words['verbs'])} "
+                    f"{r.choice(words['objects'])} {r.choice(words['endings'])}")
+
+    def reply(self, messages):
+        """Texto de la respuesta según el tipo de prompt"""
+        system = next((m['content'] for m in messages if m['role'] == 'system'), '')
+        if system.startswith('Detect the language'):
+            return _guess_language(messages[-1]['content'].replace('Detect language:', ''))
+        return self._phrase('en' if 'in English' in system else 'es')
+
+    def complete(self, body):
+        """
+        Procesa una petición de chat completions (dict con el cuerpo JSON).
+        Retorna (status, payload) tras aplicar la latencia simulada.
+        """
+        self.latency.wait()
+        if self.latency.should_fail():
+            with self._lock:
+                status = self.latency.random.choice((429, 500, 503))
+            return status, {'error': {
+                'message': f'Simulated upstream error ({status})',
+                'type': 'rate_limit_error' if status == 429 else 'server_error',
+                'code': None,
+            }}
+
+        messages = body.get('messages', [])
+        content = self.reply(messages)
+        prompt_tokens = sum(_count_tokens(m.get('content') or '') for m in messages)
+        completion_tokens = _count_tokens(content)
+        return 200, {
+            'id': f'chatcmpl-fake-{uuid.uuid4().hex[:24]}',
+            'object': 'chat.completion',
+            'created': int(time.time()),
+            'model': body.get('model', 'gpt-4o'),
+            'choices': [{
+                'index': 0,
+                'message': {'role': 'assistant', 'content': content},
+                'finish_reason': 'stop',
+            }],
+            'usage': {
+                'prompt_tokens': prompt_tokens,
+                'completion_tokens': completion_tokens,
+                'total_tokens': prompt_tokens + completion_tokens,
+            },
+        }
+
+
+class _FakeCompletions:
+    def __init__(self, model):
+        self.model = model
+
+    def create(self, **kwargs):
+        status, payload = self.model.complete(kwargs)
+        if status != 200:
+            request = httpx.Request('POST', 'http://fake-openai.local/v1/chat/completions')
+            response = httpx.Response(status, request=request, json=payload)
+            error_class = openai.RateLimitError if status == 429 else openai.InternalServerError
+            raise error_class(payload['error']['message'], response=response, body=payload['error'])
+        return ChatCompletion.model_validate(payload)
+
+
+class _FakeChat:
+    def __init__(self, model):
+        self.completions = _FakeCompletions(model)
+
+
+class FakeOpenAI:
+    """Sustituto en proceso del cliente OpenAI (solo client.chat.completions.create)"""
+
+    def __init__(self, latency=None):
+        self.model = FakeChatModel(latency)
+        self.chat = _FakeChat(self.model)
+
+
+def make_handler(model):
+    class ChatCompletionsHandler(BaseHTTPRequestHandler):
+        def do_POST(self):
+            if self.path.rstrip('/') not in ('/v1/chat/completions', '/chat/completions'):
+                self._send(404, {'error': {'message': 'Not found', 'type': 'invalid_request_error'}})
+                return
+            length = int(self.headers.get('Content-Length') or 0)
+            try:
+                body = json.loads(self.rfile.read(length) or b'{}')
+            except ValueError:
+                self._send(400, {'error': {'message': 'Invalid JSON', 'type': 'invalid_request_error'}})
+                return
+            self._send(*model.complete(body))
+
+        def _send(self, status, payload):
+            data = json.dumps(payload).encode('utf-8')
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def log_message(self, format, *args):
+            pass
+
+    return ChatCompletionsHandler
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Servidor local que imita la API de chat completions de OpenAI")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8081)
+    parser.add_argument('--latency', default=FAKE_OPENAI_LATENCY,
+                        help="Distribución de latencia en ms, p. ej. lognormal:800:0.5")
+    parser.add_argument('--error-rate', type=float, default=float(FAKE_OPENAI_ERROR_RATE))
+    parser.add_argument('--seed', type=int, default=int(FAKE_OPENAI_SEED) if FAKE_OPENAI_SEED else None)
+    args = parser.parse_args()
+
+    model = FakeChatModel(LatencyModel.from_spec(args.latency, args.error_rate, args.seed))
+    server = ThreadingHTTPServer((args.host, args.port), make_handler(model))
+    print(f"🧪 OpenAI simulado en http://{args.host}:{args.port}/v1 "
+          f"(latencia {args.latency}, errores {args.error_rate:.1%})")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
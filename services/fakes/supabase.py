@@ -0,0 +1,332 @@
+#!/usr/bin/env python3
+"""
+Cliente de Supabase simulado en memoria: la parte de PostgREST y Auth que usan
+SupabaseService y login_required, con latencia y errores configurables
+"""
+
+import copy
+import operator
+import os
+import threading
+import time
+import uuid
+from datetime import datetime, timezone
+from types import SimpleNamespace
+
+import jwt
+from dotenv import load_dotenv
+from werkzeug.security import generate_password_hash, check_password_hash
+
+from services.fakes.latency import LatencyModel
+
+# Cargar variables de entorno desde .env
+load_dotenv()
+
+FAKE_SUPABASE_LATENCY = os.environ.get("FAKE_SUPABASE_LATENCY", "constant:0")
+FAKE_SUPABASE_ERROR_RATE = os.environ.get("FAKE_SUPABASE_ERROR_RATE", "0")
+FAKE_SUPABASE_SEED = os.environ.get("FAKE_SUPABASE_SEED")
+FAKE_SUPABASE_JWT_SECRET = os.environ.get("SUPABASE_JWT_SECRET", "fake-supabase-jwt-secret-for-local-testing")
+FAKE_ACCESS_TOKEN_TTL = int(os.environ.get("FAKE_SUPABASE_TOKEN_TTL", "3600"))
+
+# Restricciones de unicidad del esquema real
+UNIQUE_CONSTRAINTS = {
+    'users': [('users_pkey', ('id',)), ('users_email_key', ('email',))],
+    'phrases': [('phrases_pkey', ('id',)), ('uniq_phrase_per_user', ('user_id', 'phrase'))],
+}
+
+# Operadores de filtro de PostgREST que entiende or_()
+FILTER_OPERATORS = {
+    'eq': operator.eq, 'neq': operator.ne,
+    'lt': operator.lt, 'lte': operator.le, 'gt': operator.gt, 'gte': operator.ge,
+}
+
+
+def _split_filters(text):
+    """Separa 'a,and(b,c),d' por las comas de primer nivel (fuera de paréntesis y comillas)"""
+    parts, depth, quoted, current = [], 0, False, ''
+    for char in text:
+        if char == '"':
+            quoted = not quoted
+        elif not quoted and char == '(':
+            depth += 1
+        elif not quoted and char == ')':
+            depth -= 1
+        elif not quoted and depth == 0 and char == ',':
+            parts.append(current)
+            current = ''
+            continue
+        current += char
+    parts.append(current)
+    return parts
+
+
+def _coerce(value, text):
+    """Convierte el texto de un filtro al tipo del valor de la fila"""
+    if isinstance(value, bool):
+        return text == 'true'
+    if isinstance(value, (int, float)):
+        return type(value)(text)
+    return text
+
+
+def _parse_filter(text):
+    """Filtro de PostgREST ('col.op.valor', 'and(...)', 'or(...)') como predicado sobre filas"""
+    for group, combine in (('and(', all), ('or(', any)):
+        if text.startswith(group) and text.endswith(')'):
+            predicates = [_parse_filter(part) for part in _split_filters(text[len(group):-1])]
+            return lambda row: combine(p(row) for p in predicates)
+    column, op, value = text.split('.', 2)
+    if len(value) >= 2 and value[0] == value[-1] == '"':
+        value = value[1:-1]
+    compare = FILTER_OPERATORS[op]
+
+    def predicate(row):
+        current = row.get(column)
+        return current is not None and compare(current, _coerce(current, value))
+    return predicate
+
+
+class FakeAPIError(Exception):
+    """Error con el mismo texto que devuelve PostgREST"""
+
+    def __init__(self, message, code=None):
+        super().__init__({'message': message, 'code': code})
+        self.message = message
+        self.code = code
+
+
+class FakeResponse:
+    def __init__(self, data, count=None):
+        self.data = data
+        self.count = count
+
+    def __repr__(self):
+        return f"FakeResponse(data={self.data!r}, count={self.count!r})"
+
+
+class FakeQuery:
+    """Constructor de consultas encadenable al estilo de postgrest-py"""
+
+    def __init__(self, client, table):
+        self.client = client
+        self.table = table
+        self.operation = 'select'
+        self.columns = '*'
+        self.count = None
+        self.head = False
+        self.payload = None
+        self.filters = []
+        self.ordering = []
+        self.max_rows = None
+
+    def select(self, columns='*', count=None, head=False):
+        self.operation = 'select'
+        self.columns = columns
+        self.count = count
+        self.head = head
+        return self
+
+    def insert(self, data):
+        self.operation = 'insert'
+        self.payload = data
+        return self
+
+    def update(self, data):
+        self.operation = 'update'
+        self.payload = data
+        return self
+
+    def delete(self):
+        self.operation = 'delete'
+        return self
+
+    def eq(self, column, value):
+        self.filters.append(lambda row: row.get(column) == value)
+        return self
+
+    def in_(self, column, values):
+        values = set(values)
+        self.filters.append(lambda row: row.get(column) in values)
+        return self
+
+    def lt(self, column, value):
+        self.filters.append(_parse_filter(f"{column}.lt.{value}"))
+        return self
+
+    def gt(self, column, value):
+        self.filters.append(_parse_filter(f"{column}.gt.{value}"))
+        return self
+
+    def or_(self, filters):
+        self.filters.append(_parse_filter(f"or({filters})"))
+        return self
+
+    def order(self, column, desc=False):
+        self.ordering.append((column, desc))
+        return self
+
+    def limit(self, count):
+        self.max_rows = count
+        return self
+
+    def _matches(self, row):
+        return all(f(row) for f in self.filters)
+
+    def _project(self, row):
+        if self.columns in ('*', None):
+            return copy.deepcopy(row)
+        return {c.strip(): copy.deepcopy(row.get(c.strip())) for c in self.columns.split(',')}
+
+    def execute(self):
+        self.client.simulate_call()
+        with self.client.lock:
+            rows = self.client.tables.setdefault(self.table, [])
+            if self.operation == 'insert':
+                return FakeResponse(self._insert(rows))
+            matched = [row for row in rows if self._matches(row)]
+            if self.operation == 'update':
+                for row in matched:
+                    row.update(copy.deepcopy(self.payload))
+                return FakeResponse([copy.deepcopy(row) for row in matched])
+            if self.operation == 'delete':
+                self.client.tables[self.table] = [row for row in rows if not self._matches(row)]
+                return FakeResponse([copy.deepcopy(row) for row in matched])
+
+            # Ordenación estable: de la última clave a la primera
+            for column, desc in reversed(self.ordering):
+                matched.sort(key=lambda row: row.get(column) or '', reverse=desc)
+            count = len(matched) if self.count else None
+            if self.max_rows is not None:
+                matched = matched[:self.max_rows]
+            data = [] if self.head else [self._project(row) for row in matched]
+            return FakeResponse(data, count)
+
+    def _insert(self, rows):
+        new_rows = self.payload if isinstance(self.payload, list) else [self.payload]
+        prepared = []
+        for data in new_rows:
+            row = copy.deepcopy(data)
+            row.setdefault('id', str(uuid.uuid4()))
+            row.setdefault('created_at', datetime.now(timezone.utc).isoformat())
+            if self.table == 'phrases':
+                row.setdefault('language', 'es')
+                row.setdefault('is_favorite', False)
+            prepared.append(row)
+
+        # Validar todo el lote antes de insertar (los inserts masivos son atómicos)
+        existing = rows + []
+        for row in prepared:
+            for name, columns in UNIQUE_CONSTRAINTS.get(self.table, []):
+                key = tuple(row.get(c) for c in columns)
+                if any(tuple(other.get(c) for c in columns) == key for other in existing):
+                    raise FakeAPIError(f'duplicate key value violates unique constraint "{name}"', '23505')
+            existing.append(row)
+
+        rows.extend(prepared)
+        return [copy.deepcopy(row) for row in prepared]
+
+
+class FakeAuth:
+    """Subconjunto de Supabase Auth (GoTrue) con JWT HS256 sin estado"""
+
+    def __init__(self, client):
+        self.client = client
+        self.accounts = {}
+        self.current_session = None
+
+    def _user(self, user_id, email, user_metadata):
+        return SimpleNamespace(id=user_id, email=email, user_metadata=user_metadata or {})
+
+    def _session(self, user):
+        now = int(time.time())
+        claims = {
+            'sub': user.id,
+            'email': user.email,
+            'user_metadata': user.user_metadata,
+            'role': 'authenticated',
+            'iat': now,
+            'exp': now + FAKE_ACCESS_TOKEN_TTL,
+        }
+        access_token = jwt.encode(claims, FAKE_SUPABASE_JWT_SECRET, algorithm='HS256')
+        refresh_claims = dict(claims, typ='refresh', jti=uuid.uuid4().hex, exp=now + 30 * 24 * 3600)
+        refresh_token = jwt.encode(refresh_claims, FAKE_SUPABASE_JWT_SECRET, algorithm='HS256')
+        return SimpleNamespace(access_token=access_token, refresh_token=refresh_token,
+                               expires_at=claims['exp'], user=user)
+
+    def _decode(self, token):
+        try:
+            claims = jwt.decode(token, FAKE_SUPABASE_JWT_SECRET, algorithms=['HS256'])
+        except jwt.PyJWTError as e:
+            raise FakeAPIError(f"invalid JWT: {e}", '401')
+        return claims
+
+    def sign_up(self, credentials):
+        self.client.simulate_call()
+        email = credentials['email']
+        with self.client.lock:
+            if email in self.accounts:
+                raise FakeAPIError("User already registered", '422')
+            user_metadata = credentials.get('options', {}).get('data', {})
+            user = self._user(str(uuid.uuid4()), email, user_metadata)
+            self.accounts[email] = (user, generate_password_hash(credentials['password'], method='pbkdf2:sha256:1000'))
+        return SimpleNamespace(user=user, session=None)
+
+    def sign_in_with_password(self, credentials):
+        self.client.simulate_call()
+        account = self.accounts.get(credentials['email'])
+        if account is None or not check_password_hash(account[1], credentials['password']):
+            raise FakeAPIError("Invalid login credentials", '400')
+        session = self._session(account[0])
+        self.current_session = session
+        return SimpleNamespace(user=account[0], session=session)
+
+    def set_session(self, access_token, refresh_token):
+        self.client.simulate_call()
+        claims = self._decode(access_token)
+        user = self._user(claims['sub'], claims.get('email'), claims.get('user_metadata'))
+        self.current_session = SimpleNamespace(access_token=access_token, refresh_token=refresh_token,
+                                               expires_at=claims['exp'], user=user)
+        return SimpleNamespace(user=user, session=self.current_session)
+
+    def refresh_session(self, refresh_token=None):
+        self.client.simulate_call()
+        claims = self._decode(refresh_token or self.current_session.refresh_token)
+        if claims.get('typ') != 'refresh':
+            raise FakeAPIError("Invalid Refresh Token", '400')
+        user = self._user(claims['sub'], claims.get('email'), claims.get('user_metadata'))
+        session = self._session(user)
+        self.current_session = session
+        return SimpleNamespace(user=user, session=session)
+
+    def get_user(self, jwt_token=None):
+        self.client.simulate_call()
+        if jwt_token is None:
+            if self.current_session is None:
+                return None
+            jwt_token = self.current_session.access_token
+        claims = self._decode(jwt_token)
+        return SimpleNamespace(user=self._user(claims['sub'], claims.get('email'), claims.get('user_metadata')))
+
+    def sign_out(self, options=None):
+        self.current_session = None
+
+
+class FakeSupabaseClient:
+    """Sustituto en proceso del cliente de Supabase"""
+
+    def __init__(self, latency=None):
+        self.latency = latency or LatencyModel.from_spec(
+            FAKE_SUPABASE_LATENCY, FAKE_SUPABASE_ERROR_RATE,
+            int(FAKE_SUPABASE_SEED) if FAKE_SUPABASE_SEED else None)
+        self.lock = threading.RLock()
+        self.tables = {'users': [], 'phrases': []}
+        self.auth = FakeAuth(self)
+
+    def simulate_call(self):
+        """Aplica la latencia simulada y, según la tasa configurada, un error"""
+        self.latency.wait()
+        if self.latency.should_fail():
+            raise FakeAPIError("simulated upstream error", '503')
+
+    def table(self, name):
+        return FakeQuery(self, name)
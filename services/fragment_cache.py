@@ -0,0 +1,156 @@
+#!/usr/bin/env python3
+"""
+Caché de fragmentos HTML renderizados (lista de frases de la colección, bloques
+de estadísticas). La clave lleva el usuario, la versión de sus datos y el id del
+despliegue: cualquier escritura cambia la versión, así que una entrada nunca se
+sirve obsoleta aunque otro worker no se entere. Las entradas de versiones viejas
+se liberan al instante en el worker que escribe y, en los demás, por LRU.
+"""
+
+import logging
+import os
+import threading
+from collections import OrderedDict
+from dotenv import load_dotenv
+from markupsafe import Markup
+from config.redis_config import get_redis_client
+from services.cache import register_cache
+from services.data_version import data_versions, APP_RELEASE
+
+# Cargar variables de entorno desde .env
+load_dotenv()
+
+FRAGMENT_CACHE_ENABLED = os.environ.get("FRAGMENT_CACHE_ENABLED", "true").lower() == "true"
+FRAGMENT_CACHE_BACKEND = os.environ.get("FRAGMENT_CACHE_BACKEND", "memory")   # memory | redis
+FRAGMENT_CACHE_MAX_BYTES = int(os.environ.get("FRAGMENT_CACHE_MAX_BYTES", str(32 * 1024 * 1024)))
+FRAGMENT_CACHE_TTL = int(os.environ.get("FRAGMENT_CACHE_TTL", "3600"))
+
+logger = logging.getLogger(__name__)
+
+
+class InMemoryFragmentBackend:
+    """LRU en memoria del proceso limitado por bytes (el tamaño del HTML varía mucho)"""
+
+    def __init__(self, max_bytes=FRAGMENT_CACHE_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.evictions = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            value = self._data.get(key)
+            if value is not None:
+                self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl):
+        # Un fragmento más grande que toda la caché solo expulsaría al resto
+        if len(value) > self.max_bytes:
+            return
+        with self._lock:
+            previous = self._data.pop(key, None)
+            if previous is not None:
+                self.size -= len(previous)
+            self._data[key] = value
+            self.size += len(value)
+            while self.size > self.max_bytes:
+                _, evicted = self._data.popitem(last=False)
+                self.size -= len(evicted)
+                self.evictions += 1
+
+    def delete_prefix(self, prefix):
+        with self._lock:
+            for key in [key for key in self._data if key.startswith(prefix)]:
+                self.size -= len(self._data.pop(key))
+
+    def __len__(self):
+        return len(self._data)
+
+
+class RedisFragmentBackend:
+    """
+    Fragmentos compartidos entre workers y máquinas. La expulsión por tamaño es la
+    de Redis (maxmemory con allkeys-lru); aquí solo se fija un TTL por entrada.
+    """
+
+    def __init__(self, client, prefix='fragment:'):
+        self.client = client
+        self.prefix = prefix
+        self.evictions = 0
+
+    def get(self, key):
+        return self.client.get(self.prefix + key)
+
+    def set(self, key, value, ttl):
+        self.client.set(self.prefix + key, value, ex=ttl)
+
+    def delete_prefix(self, prefix):
+        # Las versiones viejas ya no se leen y caducan solas: recorrer el keyspace saldría más caro
+        pass
+
+    def __len__(self):
+        return 0
+
+
+class FragmentCache:
+    """Fragmentos HTML por usuario y versión de datos, con aciertos y fallos para /metrics"""
+
+    def __init__(self, backend, ttl=FRAGMENT_CACHE_TTL, name=None):
+        self.backend = backend
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        if name:
+            register_cache(name, self)
+        # Liberar en este worker los fragmentos del usuario en cuanto cambian sus datos
+        data_versions.subscribe(self.invalidate)
+
+    @property
+    def evictions(self):
+        return self.backend.evictions
+
+    def render(self, user_id, fragment, render_fn):
+        """
+        HTML del fragmento `fragment` (nombre y variante, p. ej. 'collection:favorites')
+        del usuario; si no está en caché llama a render_fn() y lo guarda
+        """
+        version, _ = data_versions.get(user_id)
+        key = f"{user_id}:{version}:{APP_RELEASE}:{fragment}"
+        try:
+            cached = self.backend.get(key)
+        except Exception as e:
+            logger.warning("Error leyendo la caché de fragmentos: %s", e)
+            cached = None
+        if cached is not None:
+            self.hits += 1
+            return Markup(cached.decode('utf-8'))
+
+        self.misses += 1
+        html = render_fn()
+        try:
+            self.backend.set(key, html.encode('utf-8'), self.ttl)
+        except Exception as e:
+            logger.warning("Error guardando en la caché de fragmentos: %s", e)
+        return Markup(html)
+
+    def invalidate(self, user_id):
+        """Elimina los fragmentos del usuario (de todas sus versiones) en este worker"""
+        self.backend.delete_prefix(f"{user_id}:")
+
+    def __len__(self):
+        return len(self.backend)
+
+
+def _create_backend():
+    """Redis si se pide y está configurado; si no, memoria del proceso"""
+    if FRAGMENT_CACHE_BACKEND.lower() == 'redis':
+        client = get_redis_client()
+        if client is not None:
+            return RedisFragmentBackend(client)
+        logger.warning("FRAGMENT_CACHE_BACKEND=redis sin REDIS_URL; se usa memoria")
+    return InMemoryFragmentBackend()
+
+
+fragment_cache = FragmentCache(_create_backend(), name='fragments') if FRAGMENT_CACHE_ENABLED else None
@@ -0,0 +1,150 @@
+#!/usr/bin/env python3
+"""
+Almacén de claves de idempotencia para deduplicar envíos de /generate
+"""
+
+import json
+import os
+import threading
+import time
+from dotenv import load_dotenv
+from config.redis_config import get_redis_client
+
+# Cargar variables de entorno desde .env
+load_dotenv()
+
+IDEMPOTENCY_TTL = int(os.environ.get("IDEMPOTENCY_TTL", "600"))
+IDEMPOTENCY_WAIT_TIMEOUT = float(os.environ.get("IDEMPOTENCY_WAIT_TIMEOUT", "30"))
+
+# Marca de una petición que todavía se está procesando
+PENDING = "__pending__"
+
+
+class _Entry:
+    """Resultado (o espera) asociado a una clave"""
+
+    def __init__(self, expires_at):
+        self.done = threading.Event()
+        self.result = None
+        self.expires_at = expires_at
+
+
+class InMemoryIdempotencyBackend:
+    """Entradas en memoria del proceso; los duplicados esperan con un Event"""
+
+    def __init__(self, ttl):
+        self.ttl = ttl
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    def begin(self, key):
+        """Retorna (True, None) si esta petición debe ejecutar el trabajo,
+        o (False, entry) si otra ya lo hizo o lo está haciendo"""
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry.expires_at > now:
+                return False, entry
+            self._entries[key] = _Entry(now + self.ttl)
+            # Limpieza oportunista de claves expiradas
+            if len(self._entries) > 1024:
+                for k in [k for k, e in self._entries.items() if e.expires_at <= now]:
+                    del self._entries[k]
+            return True, None
+
+    def complete(self, key, result):
+        """Guarda el resultado y despierta a los que esperan"""
+        with self._lock:
+            entry = self._entries.get(key)
+        if entry is not None:
+            entry.result = result
+            entry.done.set()
+
+    def fail(self, key):
+        """Libera la clave para que un reintento pueda ejecutar el trabajo"""
+        with self._lock:
+            entry = self._entries.pop(key, None)
+        if entry is not None:
+            entry.done.set()
+
+    def wait(self, key, entry, timeout):
+        """Espera el resultado de la petición en curso (None si no llega)"""
+        entry.done.wait(timeout)
+        return entry.result
+
+
+class RedisIdempotencyBackend:
+    """Entradas en Redis, compartidas entre workers; los duplicados sondean"""
+
+    POLL_INTERVAL = 0.1
+
+    def __init__(self, client, ttl):
+        self.client = client
+        self.ttl = ttl
+
+    def _key(self, key):
+        return f"idempotency:{key}"
+
+    def begin(self, key):
+        if self.client.set(self._key(key), PENDING, nx=True, ex=self.ttl):
+            return True, None
+        return False, key
+
+    def complete(self, key, result):
+        self.client.set(self._key(key), json.dumps(result), ex=self.ttl)
+
+    def fail(self, key):
+        self.client.delete(self._key(key))
+
+    def wait(self, key, entry, timeout):
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            value = self.client.get(self._key(key))
+            if value is None:
+                return None
+            if value.decode() != PENDING:
+                return json.loads(value)
+            time.sleep(self.POLL_INTERVAL)
+        return None
+
+
+class IdempotencyStore:
+    """Garantiza como mucho una ejecución por clave durante el TTL"""
+
+    def __init__(self, backend, wait_timeout=IDEMPOTENCY_WAIT_TIMEOUT):
+        self.backend = backend
+        self.wait_timeout = wait_timeout
+
+    def run(self, key, fn):
+        """
+        Ejecuta fn() una sola vez por clave y comparte su resultado.
+        fn debe retornar (result, cacheable); los resultados no cacheables
+        liberan la clave para que el cliente pueda reintentar.
+        Retorna (result, replayed) o (None, True) si la espera expiró.
+        """
+        is_owner, entry = self.backend.begin(key)
+        if not is_owner:
+            return self.backend.wait(key, entry, self.wait_timeout), True
+
+        try:
+            result, cacheable = fn()
+        except Exception:
+            self.backend.fail(key)
+            raise
+
+        if cacheable:
+            self.backend.complete(key, result)
+        else:
+            self.backend.fail(key)
+        return result, False
+
+
+def _create_backend():
+    """Usa Redis si está configurado; si no, memoria del proceso"""
+    client = get_redis_client()
+    if client is not None:
+        return RedisIdempotencyBackend(client, IDEMPOTENCY_TTL)
+    return InMemoryIdempotencyBackend(IDEMPOTENCY_TTL)
+
+
+idempotency_store = IdempotencyStore(_create_backend())
@@ -0,0 +1,392 @@
+#!/usr/bin/env python3
+"""
+Métricas de latencia y llamadas a servicios externos en formato de texto de Prometheus
+"""
+
+import logging
+import os
+import sqlite3
+import threading
+import time
+from bisect import bisect_left
+from functools import wraps
+from dotenv import load_dotenv
+from config.redis_config import get_redis_client
+
+# Cargar variables de entorno desde .env
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+METRICS_ENABLED = os.environ.get("METRICS_ENABLED", "true").lower() == "true"
+# Token de /metrics (Authorization: Bearer <token>); sin él el endpoint no se expone
+METRICS_TOKEN = os.environ.get("METRICS_TOKEN")
+# memory (un solo worker), sqlite (workers de una máquina) o redis; por defecto redis si hay REDIS_URL
+METRICS_BACKEND = os.environ.get("METRICS_BACKEND", "")
+METRICS_PATH = os.environ.get("METRICS_PATH", "instance/metrics.db")
+# Cada cuánto se vuelcan los contadores locales al backend compartido (segundos)
+METRICS_FLUSH_INTERVAL = float(os.environ.get("METRICS_FLUSH_INTERVAL", "5"))
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+UPSTREAM_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _series(name, labels):
+    """Nombre de serie en formato de exposición: name{a="1",b="2"}"""
+    if not labels:
+        return name
+    return name + '{' + ','.join(f'{k}="{_escape(v)}"' for k, v in labels) + '}'
+
+
+class InMemoryMetricsBackend:
+    """Totales en memoria del proceso (un solo worker)"""
+
+    def __init__(self):
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def add(self, deltas):
+        with self._lock:
+            for series, value in deltas.items():
+                self._values[series] = self._values.get(series, 0.0) + value
+
+    def read(self):
+        with self._lock:
+            return dict(self._values)
+
+
+class SQLiteMetricsBackend:
+    """Totales en un archivo SQLite compartido por los workers de una máquina"""
+
+    def __init__(self, path):
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None, timeout=5)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS metrics (series TEXT PRIMARY KEY, value REAL NOT NULL)")
+        self._lock = threading.Lock()
+
+    def add(self, deltas):
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            self._conn.executemany(
+                "INSERT INTO metrics (series, value) VALUES (?, ?) "
+                "ON CONFLICT(series) DO UPDATE SET value = value + excluded.value",
+                deltas.items())
+            self._conn.execute("COMMIT")
+
+    def read(self):
+        with self._lock:
+            return dict(self._conn.execute("SELECT series, value FROM metrics"))
+
+
+class RedisMetricsBackend:
+    """Totales en un hash de Redis, compartidos entre workers y máquinas"""
+
+    KEY = "metrics:values"
+
+    def __init__(self, client):
+        self.client = client
+
+    def add(self, deltas):
+        pipe = self.client.pipeline(transaction=False)
+        for series, value in deltas.items():
+            pipe.hincrbyfloat(self.KEY, series, value)
+        pipe.execute()
+
+    def read(self):
+        return {k.decode('utf-8'): float(v) for k, v in self.client.hgetall(self.KEY).items()}
+
+
+class Metrics:
+    """
+    Registro de contadores e histogramas. Todo se guarda como series de contadores
+    (los histogramas como _bucket/_sum/_count), de modo que los totales de varios
+    workers se agregan sumando. Cada proceso acumula localmente y vuelca los
+    incrementos al backend; así el coste por observación es solo un lock y una suma.
+    """
+
+    def __init__(self, backend, flush_interval=METRICS_FLUSH_INTERVAL):
+        self.backend = backend
+        self._families = {}       # nombre -> (tipo, ayuda)
+        self._pending = {}        # serie -> incremento aún no volcado
+        self._collected = {}      # serie -> último total visto de un colector
+        self._collectors = []
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._shared = not isinstance(backend, InMemoryMetricsBackend)
+        if self._shared:
+            thread = threading.Thread(target=self._run, args=(flush_interval,), name="metrics-flusher", daemon=True)
+            thread.start()
+
+    def counter(self, name, help_text):
+        self._families[name] = ('counter', help_text, None)
+        return Counter(self, name)
+
+    def histogram(self, name, help_text, buckets=LATENCY_BUCKETS):
+        self._families[name] = ('histogram', help_text, tuple(buckets))
+        return Histogram(self, name, buckets)
+
+    def register_collector(self, fn, families):
+        """
+        fn() retorna [(nombre, labels, total_acumulado)] leídos de otros módulos
+        (p. ej. aciertos de caché); se convierten en incrementos al volcar.
+        families: {nombre: ayuda} de las series de contadores que produce
+        """
+        for name, help_text in families.items():
+            self._families[name] = ('counter', help_text, None)
+        self._collectors.append(fn)
+
+    def _add(self, series, value):
+        with self._lock:
+            self._pending[series] = self._pending.get(series, 0.0) + value
+
+    def _observe(self, name, labels, buckets, value):
+        index = bisect_left(buckets, value)
+        le = str(buckets[index]) if index < len(buckets) else '+Inf'
+        with self._lock:
+            pending = self._pending
+            for series, amount in ((_series(name + '_bucket', labels + (('le', le),)), 1),
+                                   (_series(name + '_sum', labels), value),
+                                   (_series(name + '_count', labels), 1)):
+                pending[series] = pending.get(series, 0.0) + amount
+
+    def flush(self):
+        """Vuelca los incrementos pendientes (y los de los colectores) al backend"""
+        with self._flush_lock:
+            for collector in self._collectors:
+                try:
+                    for name, labels, total in collector():
+                        series = _series(name, tuple(labels.items()))
+                        previous = self._collected.get(series, 0)
+                        # Si el total baja, el objeto se recreó: se cuenta desde cero
+                        delta = total - previous if total >= previous else total
+                        if delta:
+                            self._collected[series] = total
+                            self._add(series, delta)
+                except Exception as e:
+                    logger.warning("Error en colector de métricas: %s", e)
+
+            with self._lock:
+                pending, self._pending = self._pending, {}
+            if not pending:
+                return
+            try:
+                self.backend.add(pending)
+            except Exception as e:
+                # Conservar los incrementos para el siguiente volcado
+                logger.warning("Error volcando métricas: %s", e)
+                with self._lock:
+                    for series, value in pending.items():
+                        self._pending[series] = self._pending.get(series, 0.0) + value
+
+    def _run(self, interval):
+        while True:
+            time.sleep(interval)
+            self.flush()
+
+    def render(self):
+        """Texto de exposición de Prometheus con los totales de todos los workers"""
+        self.flush()
+        values = self.backend.read()
+
+        by_family = {}
+        for series, value in values.items():
+            base = series.split('{', 1)[0]
+            family = base
+            for suffix in ('_bucket', '_sum', '_count'):
+                if base.endswith(suffix) and self._families.get(base[:-len(suffix)], ('',))[0] == 'histogram':
+                    family = base[:-len(suffix)]
+            by_family.setdefault(family, []).append((series, value))
+
+        lines = []
+        for family in sorted(by_family):
+            kind, help_text, buckets = self._families.get(family, ('untyped', '', None))
+            lines.append(f"# HELP {family} {help_text}")
+            lines.append(f"# TYPE {family} {kind}")
+            samples = by_family[family]
+            if kind == 'histogram':
+                samples = _histogram_samples(family, buckets, samples)
+            else:
+                samples = sorted(samples)
+            for series, value in samples:
+                lines.append(f"{series} {_format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+
+def _format_value(value):
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+
+def _histogram_samples(family, buckets, samples):
+    """
+    Los buckets se guardan por intervalo; Prometheus los espera acumulados y completos,
+    seguidos de _sum y _count para cada combinación de etiquetas
+    """
+    groups = {}
+    for series, value in samples:
+        base, _, labels = series.partition('{')
+        labels = labels[:-1]
+        suffix = base[len(family):]
+        if suffix == '_bucket':
+            labels, _, le = labels.rpartition('le="')
+            groups.setdefault(labels.rstrip(','), {}).setdefault('buckets', {})[le[:-1]] = value
+        else:
+            groups.setdefault(labels, {})[suffix] = value
+
+    result = []
+    for labels in sorted(groups):
+        group = groups[labels]
+        counts = group.get('buckets', {})
+        prefix = labels + ',' if labels else ''
+        total = 0
+        for bound in [str(b) for b in buckets] + ['+Inf']:
+            total += counts.get(bound, 0)
+            result.append((f'{family}_bucket{{{prefix}le="{bound}"}}', total))
+        suffix_labels = f'{{{labels}}}' if labels else ''
+        result.append((f'{family}_sum{suffix_labels}', group.get('_sum', 0)))
+        result.append((f'{family}_count{suffix_labels}', group.get('_count', 0)))
+    return result
+
+
+class Counter:
+    def __init__(self, metrics, name):
+        self.metrics = metrics
+        self.name = name
+
+    def inc(self, amount=1, **labels):
+        self.metrics._add(_series(self.name, tuple(labels.items())), amount)
+
+
+class Histogram:
+    def __init__(self, metrics, name, buckets):
+        self.metrics = metrics
+        self.name = name
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, **labels):
+        self.metrics._observe(self.name, tuple(labels.items()), self.buckets, value)
+
+
+def _create_backend():
+    """Redis si está configurado; si no, un archivo SQLite compartido entre workers"""
+    backend = METRICS_BACKEND.lower()
+    if backend in ('', 'redis'):
+        client = get_redis_client()
+        if client is not None:
+            return RedisMetricsBackend(client)
+    if backend == 'memory':
+        return InMemoryMetricsBackend()
+    return SQLiteMetricsBackend(METRICS_PATH)
+
+
+metrics = Metrics(_create_backend() if METRICS_ENABLED else InMemoryMetricsBackend())
+
+http_request_duration = metrics.histogram(
+    'http_request_duration_seconds', 'Latencia de las peticiones HTTP por ruta')
+storage_call_duration = metrics.histogram(
+    'storage_call_duration_seconds', 'Latencia de los métodos del servicio de almacenamiento', UPSTREAM_BUCKETS)
+storage_call_errors = metrics.counter(
+    'storage_call_errors_total', 'Excepciones lanzadas por los métodos del servicio de almacenamiento')
+openai_request_duration = metrics.histogram(
+    'openai_request_duration_seconds', 'Latencia de las llamadas a OpenAI', UPSTREAM_BUCKETS)
+openai_tokens = metrics.counter('openai_tokens_total', 'Tokens consumidos en OpenAI')
+openai_errors = metrics.counter('openai_errors_total', 'Errores en las llamadas a OpenAI')
+compressed_responses = metrics.counter(
+    'http_compressed_responses_total', 'Respuestas comprimidas por el middleware, por codificación')
+compression_saved_bytes = metrics.counter(
+    'http_compression_saved_bytes_total', 'Bytes ahorrados por la compresión de respuestas, por codificación')
+
+
+def instrument_methods(cls):
+    """
+    Decorador de clase: mide la latencia y las excepciones de cada método público
+    (storage_call_duration_seconds{backend, method})
+    """
+    if not METRICS_ENABLED:
+        return cls
+    for attr, fn in list(vars(cls).items()):
+        if attr.startswith('_') or not callable(fn) or isinstance(fn, (staticmethod, classmethod, type)):
+            continue
+        setattr(cls, attr, _timed_method(fn))
+    return cls
+
+
+def _timed_method(fn):
+    @wraps(fn)
+    def wrapper(self, *args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return fn(self, *args, **kwargs)
+        except Exception as e:
+            storage_call_errors.inc(backend=self.name, method=fn.__name__, error=type(e).__name__)
+            raise
+        finally:
+            storage_call_duration.observe(time.perf_counter() - start, backend=self.name, method=fn.__name__)
+    return wrapper
+
+
+def observe_openai_call(operation, fn, **kwargs):
+    """Llama a fn(**kwargs) (una completion) registrando latencia, tokens y errores"""
+    if not METRICS_ENABLED:
+        return fn(**kwargs)
+    model = kwargs.get('model', 'unknown')
+    start = time.perf_counter()
+    try:
+        response = fn(**kwargs)
+    except Exception as e:
+        openai_errors.inc(model=model, operation=operation, error=type(e).__name__)
+        raise
+    finally:
+        openai_request_duration.observe(time.perf_counter() - start, model=model, operation=operation)
+    usage = getattr(response, 'usage', None)
+    if usage is not None:
+        openai_tokens.inc(usage.prompt_tokens, model=model, type='prompt')
+        openai_tokens.inc(usage.completion_tokens, model=model, type='completion')
+    return response
+
+
+def _cache_stats():
+    from services.cache import cache_stats
+    from services.singleflight import singleflight_stats
+    for name, stats in cache_stats().items():
+        yield 'cache_hits_total', {'cache': name}, stats['hits']
+        yield 'cache_misses_total', {'cache': name}, stats['misses']
+        yield 'cache_evictions_total', {'cache': name}, stats['evictions']
+    for name, stats in singleflight_stats().items():
+        yield 'singleflight_calls_total', {'group': name}, stats['calls']
+        yield 'singleflight_coalesced_total', {'group': name}, stats['coalesced']
+
+
+metrics.register_collector(_cache_stats, {
+    'cache_hits_total': 'Aciertos de las cachés en memoria',
+    'cache_misses_total': 'Fallos de las cachés en memoria',
+    'cache_evictions_total': 'Entradas expulsadas por falta de espacio',
+    'singleflight_calls_total': 'Llamadas a grupos single-flight',
+    'singleflight_coalesced_total': 'Llamadas resueltas con el resultado de otra en curso',
+})
+
+
+def init_app(app):
+    """Registra la latencia de cada petición por ruta (plantilla de la URL), método y estado"""
+    if not METRICS_ENABLED:
+        return
+
+    from flask import g, request
+
+    @app.before_request
+    def _start_timer():
+        g._metrics_start = time.perf_counter()
+
+    @app.after_request
+    def _record_latency(response):
+        start = g.pop('_metrics_start', None)
+        if start is not None:
+            rule = request.url_rule.rule if request.url_rule else 'unmatched'
+            http_request_duration.observe(time.perf_counter() - start, route=rule,
+                                          method=request.method, status=str(response.status_code))
+        return response
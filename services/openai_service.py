@@ -1,22 +1,57 @@
 import os
 import json
+import logging
 from openai import OpenAI
 from dotenv import load_dotenv
+from services.cache import content_hash
+from services.singleflight import SingleFlight
+from services.metrics import observe_openai_call
+from services.tracing import traced
 load_dotenv()
 
+logger = logging.getLogger(__name__)
+
 # The newest OpenAI model is "gpt-4o" which was released May 13, 2024.
 # Do not change this unless explicitly requested by the user
+MODEL = "gpt-4o"
 OPENAI_API_KEY = os.environ.get("OPENAI_API_KEY")
-client = OpenAI(api_key=OPENAI_API_KEY)
 
-def detect_language(text):
+# OPENAI_FAKE=true uses the in-process stand-in from services/fakes/openai.py.
+# To use the localhost fake server instead, set OPENAI_BASE_URL (read by the SDK).
+OPENAI_FAKE = os.environ.get("OPENAI_FAKE", "false").lower() == "true"
+if OPENAI_FAKE:
+    from services.fakes.openai import FakeOpenAI
+    client = FakeOpenAI()
+else:
+    # CASSETTE_MODE=record|replay routes the traffic through services/fakes/cassette.py
+    from services.fakes.cassette import cassette_http_client
+    client = OpenAI(api_key=OPENAI_API_KEY, http_client=cassette_http_client('openai'))
+
+# Maximum completions per request when the phrase collides with one the user already has
+MAX_GENERATION_ATTEMPTS = int(os.environ.get("MAX_GENERATION_ATTEMPTS", "3"))
+
+# Worst case of one generate_poetic_phrase call: language detection plus every attempt
+COMPLETIONS_PER_GENERATION = 1 + MAX_GENERATION_ATTEMPTS
+
+# Identical concurrent generations share a single completion
+_generation_flight = SingleFlight('generate_poetic_phrase')
+
+def _complete(operation, usage, **kwargs):
+    """Chat completion, counted in usage['completions'] (for the model rate limiter)"""
+    if usage is not None:
+        usage['completions'] = usage.get('completions', 0) + 1
+    return observe_openai_call(operation, client.chat.completions.create, **kwargs)
+
+@traced('openai.detect_language')
+def detect_language(text, usage=None):
     """
     Detect the language of the input text using OpenAI.
     Returns 'en' for English, 'es' for Spanish, or 'es' as default.
     """
     try:
-        response = client.chat.completions.create(
-            model="gpt-4o",
+        response = _complete(
+            'detect_language', usage,
+            model=MODEL,
             messages=[
                 {"role": "system", "content": "Detect the language of the following text. Respond only with 'en' for English or 'es' for Spanish."},
                 {"role": "user", "content": f"Detect language: {text}"}
@@ -28,18 +63,32 @@ def detect_language(text):
         detected_lang = response.choices[0].message.content.strip().lower()
         return 'en' if detected_lang == 'en' else 'es'
     except Exception as e:
-        print(f"Error detecting language: {e}")
+        logger.warning("Error detecting language: %s", e)
         return 'es'  # Default to Spanish
 
-def generate_poetic_phrase(emotion, style):
+def generate_poetic_phrase(emotion, style, existing_hashes=None, usage=None, user_id=None):
+    """
+    Generate a poetic phrase, coalescing identical concurrent requests of the
+    same user (e.g. a double submit); different users never share a phrase.
+    See _generate_poetic_phrase for details; a request that joins another
+    one in flight makes no completions of its own.
+    """
+    key = (user_id, emotion, style, frozenset(existing_hashes or ()))
+    return _generation_flight.do(key, _generate_poetic_phrase, emotion, style, existing_hashes, usage)
+
+@traced('openai.generate')
+def _generate_poetic_phrase(emotion, style, existing_hashes=None, usage=None):
     """
     Generate a poetic phrase based on user emotion and selected style.
     Maximum 20 words in the same language as the input.
+    If existing_hashes (content hashes of the user's phrases) is given, phrases
+    that collide with it are regenerated up to MAX_GENERATION_ATTEMPTS times.
+    Completions made are added to usage['completions'] when usage is given.
     Returns a tuple: (phrase, language)
     """
     
     # Detect the language of the input
-    language = detect_language(emotion)
+    language = detect_language(emotion, usage)
     
     if language == 'en':
         # English prompts
@@ -68,6 +117,7 @@ def generate_poetic_phrase(emotion, style):
         """
         
         system_message = "You are an expert poet who creates brief, elegant, and emotional phrases in English."
+        retry_message = "The user already has that phrase. Create a different one."
     else:
         # Spanish prompts (default)
         style_prompts = {
@@ -95,28 +145,43 @@ def generate_poetic_phrase(emotion, style):
         """
         
         system_message = "Eres un poeta experto que crea frases breves, elegantes y emotivas en español."
+        retry_message = "El usuario ya tiene esa frase. Crea una diferente."
+    
+    messages = [
+        {"role": "system", "content": system_message},
+        {"role": "user", "content": prompt}
+    ]
     
     try:
-        response = client.chat.completions.create(
-            model="gpt-4o",
-            messages=[
-                {"role": "system", "content": system_message},
-                {"role": "user", "content": prompt}
-            ],
-            max_tokens=50,
-            temperature=0.8
-        )
-        
-        phrase = response.choices[0].message.content.strip()
-        
-        # Ensure the phrase doesn't exceed 20 words
-        words = phrase.split()
-        if len(words) > 20:
-            phrase = ' '.join(words[:20])
+        for attempt in range(1, MAX_GENERATION_ATTEMPTS + 1):
+            response = _complete(
+                'generate', usage,
+                model=MODEL,
+                messages=messages,
+                max_tokens=50,
+                temperature=0.8
+            )
+            
+            phrase = response.choices[0].message.content.strip()
+            
+            # Ensure the phrase doesn't exceed 20 words
+            words = phrase.split()
+            if len(words) > 20:
+                phrase = ' '.join(words[:20])
+            
+            if not existing_hashes or content_hash(phrase) not in existing_hashes:
+                break
+            
+            # Collides with uniq_phrase_per_user: ask for a different one
+            logger.debug("Generated phrase already exists for user, retrying (%d/%d)", attempt, MAX_GENERATION_ATTEMPTS)
+            messages = messages + [
+                {"role": "assistant", "content": phrase},
+                {"role": "user", "content": retry_message}
+            ]
         
         return phrase, language
     
     except Exception as e:
-        print(f"Error generating phrase: {e}")
+        logger.error("Error generating phrase: %s", e)
         # Return None instead of a generic phrase to indicate failure
         return None, None
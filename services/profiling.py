@@ -0,0 +1,131 @@
+#!/usr/bin/env python3
+"""
+Perfiles de peticiones en producción:
+- cProfile de una petición concreta, activado con un token firmado (cabecera
+  X-Profile o parámetro ?profile=), guardado en PROFILE_DIR para descargarlo
+- muestreo estadístico de pilas de todos los hilos, agregado en formato
+  "collapsed stacks" listo para flamegraph.pl / speedscope
+"""
+
+import cProfile
+import os
+import sys
+import threading
+import time
+import uuid
+from collections import Counter
+from dotenv import load_dotenv
+from itsdangerous import URLSafeTimedSerializer, BadSignature
+
+# Cargar variables de entorno desde .env
+load_dotenv()
+
+PROFILING_ENABLED = os.environ.get("PROFILING_ENABLED", "false").lower() == "true"
+PROFILE_DIR = os.path.abspath(os.environ.get("PROFILE_DIR", "instance/profiles"))
+PROFILE_MAX_FILES = int(os.environ.get("PROFILE_MAX_FILES", "50"))
+PROFILE_TOKEN_TTL = int(os.environ.get("PROFILE_TOKEN_TTL", "600"))
+# Muestreo continuo de pilas (ms entre muestras; 0 = desactivado)
+PROFILE_SAMPLE_INTERVAL_MS = float(os.environ.get("PROFILE_SAMPLE_INTERVAL_MS", "0"))
+
+_serializer = URLSafeTimedSerializer(os.environ.get("SESSION_SECRET", "dev-secret-key-change-in-production"),
+                                     salt="request-profile")
+
+
+def make_profile_token():
+    """Token firmado que permite perfilar peticiones durante PROFILE_TOKEN_TTL segundos"""
+    return _serializer.dumps({'n': uuid.uuid4().hex[:8]})
+
+
+def verify_profile_token(token):
+    try:
+        _serializer.loads(token, max_age=PROFILE_TOKEN_TTL)
+        return True
+    except BadSignature:
+        return False
+
+
+def list_profiles():
+    """Perfiles guardados, del más reciente al más antiguo"""
+    if not os.path.isdir(PROFILE_DIR):
+        return []
+    names = [n for n in os.listdir(PROFILE_DIR) if n.endswith('.prof')]
+    return sorted(names, reverse=True)
+
+
+def _save_profile(profiler, method, path):
+    os.makedirs(PROFILE_DIR, exist_ok=True)
+    slug = path.strip('/').replace('/', '_') or 'root'
+    name = f"{time.strftime('%Y%m%d-%H%M%S')}-{method}-{slug[:40]}-{uuid.uuid4().hex[:6]}.prof"
+    profiler.dump_stats(os.path.join(PROFILE_DIR, name))
+    for old in list_profiles()[PROFILE_MAX_FILES:]:
+        try:
+            os.remove(os.path.join(PROFILE_DIR, old))
+        except OSError:
+            pass
+    return name
+
+
+class StackSampler:
+    """Muestrea periódicamente las pilas de todos los hilos y cuenta cada pila"""
+
+    def __init__(self, interval):
+        self.interval = interval
+        self.samples = 0
+        self._stacks = Counter()
+        self._lock = threading.Lock()
+        self._thread = threading.Thread(target=self._run, name="stack-sampler", daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        own_id = threading.get_ident()
+        while True:
+            time.sleep(self.interval)
+            frames = sys._current_frames()
+            stacks = []
+            for thread_id, frame in frames.items():
+                if thread_id == own_id:
+                    continue
+                names = []
+                while frame is not None:
+                    code = frame.f_code
+                    names.append(f"{os.path.basename(code.co_filename)}:{code.co_name}")
+                    frame = frame.f_back
+                stacks.append(';'.join(reversed(names)))
+            with self._lock:
+                self.samples += 1
+                self._stacks.update(stacks)
+
+    def collapsed(self, reset=False):
+        """Líneas 'frame;frame;frame cuenta' (formato de flamegraph.pl)"""
+        with self._lock:
+            lines = [f"{stack} {count}" for stack, count in self._stacks.most_common()]
+            if reset:
+                self._stacks.clear()
+                self.samples = 0
+        return "\n".join(lines) + "\n"
+
+
+sampler = StackSampler(PROFILE_SAMPLE_INTERVAL_MS / 1000) if PROFILING_ENABLED and PROFILE_SAMPLE_INTERVAL_MS else None
+
+
+def init_app(app):
+    """Perfila con cProfile las peticiones que traen un token válido"""
+    if not PROFILING_ENABLED:
+        return
+
+    from flask import g, request
+
+    @app.before_request
+    def _start_profile():
+        token = request.headers.get('X-Profile') or request.args.get('profile')
+        if token and verify_profile_token(token):
+            g._profiler = cProfile.Profile()
+            g._profiler.enable()
+
+    @app.after_request
+    def _finish_profile(response):
+        profiler = g.pop('_profiler', None)
+        if profiler is not None:
+            profiler.disable()
+            response.headers['X-Profile-Id'] = _save_profile(profiler, request.method, request.path)
+        return response
@@ -0,0 +1,144 @@
+#!/usr/bin/env python3
+"""
+Limitadores de tasa (token bucket) para la generación de frases
+"""
+
+import logging
+import os
+import threading
+import time
+from dotenv import load_dotenv
+from config.redis_config import get_redis_client
+
+# Cargar variables de entorno desde .env
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+RATE_LIMIT_ENABLED = os.environ.get("RATE_LIMIT_ENABLED", "true").lower() == "true"
+
+# Por usuario: ráfaga pequeña para absorber dobles envíos, recarga lenta
+RATE_LIMIT_USER_BURST = float(os.environ.get("RATE_LIMIT_USER_BURST", "3"))
+RATE_LIMIT_USER_PER_MINUTE = float(os.environ.get("RATE_LIMIT_USER_PER_MINUTE", "6"))
+
+# Global por modelo de OpenAI: protege el límite de la cuenta
+RATE_LIMIT_MODEL_BURST = float(os.environ.get("RATE_LIMIT_MODEL_BURST", "50"))
+RATE_LIMIT_MODEL_PER_MINUTE = float(os.environ.get("RATE_LIMIT_MODEL_PER_MINUTE", "300"))
+
+
+class InMemoryBucketBackend:
+    """Buckets en memoria del proceso (un solo worker)"""
+
+    def __init__(self):
+        self._buckets = {}
+        self._lock = threading.Lock()
+
+    def acquire(self, key, capacity, refill_rate, cost=1):
+        """Consume tokens; retorna 0 si se permite o los segundos a esperar"""
+        now = time.monotonic()
+        with self._lock:
+            tokens, updated_at = self._buckets.get(key, (capacity, now))
+            tokens = min(capacity, tokens + (now - updated_at) * refill_rate)
+            if tokens >= cost:
+                self._buckets[key] = (min(capacity, tokens - cost), now)
+                return 0
+            self._buckets[key] = (tokens, now)
+            return (cost - tokens) / refill_rate
+
+
+class RedisBucketBackend:
+    """Buckets en Redis, compartidos entre workers y máquinas"""
+
+    # Recarga y consumo atómicos en un solo viaje de ida y vuelta
+    SCRIPT = """
+    local capacity = tonumber(ARGV[1])
+    local refill_rate = tonumber(ARGV[2])
+    local cost = tonumber(ARGV[3])
+    local now = tonumber(ARGV[4])
+    local state = redis.call('HMGET', KEYS[1], 'tokens', 'ts')
+    local tokens = tonumber(state[1]) or capacity
+    local ts = tonumber(state[2]) or now
+    tokens = math.min(capacity, tokens + math.max(0, now - ts) * refill_rate)
+    local wait = 0
+    if tokens >= cost then
+        tokens = math.min(capacity, tokens - cost)
+    else
+        wait = (cost - tokens) / refill_rate
+    end
+    redis.call('HSET', KEYS[1], 'tokens', tokens, 'ts', now)
+    redis.call('EXPIRE', KEYS[1], math.ceil(capacity / refill_rate) + 1)
+    return tostring(wait)
+    """
+
+    def __init__(self, client):
+        self.client = client
+        self._script = client.register_script(self.SCRIPT)
+
+    def acquire(self, key, capacity, refill_rate, cost=1):
+        """Consume tokens; retorna 0 si se permite o los segundos a esperar"""
+        wait = self._script(keys=[f"ratelimit:{key}"], args=[capacity, refill_rate, cost, time.time()])
+        return float(wait)
+
+
+class RateLimiter:
+    """Limitador token bucket con nombre, capacidad (ráfaga) y tasa de recarga"""
+
+    def __init__(self, name, capacity, per_minute, backend):
+        self.name = name
+        self.capacity = capacity
+        self.refill_rate = per_minute / 60.0
+        self.backend = backend
+
+    def acquire(self, key, cost=1):
+        """Retorna 0 si la petición se admite o los segundos hasta poder reintentar"""
+        try:
+            return self.backend.acquire(f"{self.name}:{key}", self.capacity, self.refill_rate, cost)
+        except Exception as e:
+            # Si el backend compartido falla, no bloquear la generación
+            logger.warning("Error en limitador de tasa '%s': %s", self.name, e)
+            return 0
+
+    def release(self, key, cost=1):
+        """Devuelve tokens consumidos por una petición que finalmente no se atendió"""
+        self.acquire(key, cost=-cost)
+
+
+def _create_backend():
+    """Usa Redis si está configurado; si no, buckets en memoria"""
+    client = get_redis_client()
+    if client is not None:
+        return RedisBucketBackend(client)
+    return InMemoryBucketBackend()
+
+
+_backend = _create_backend()
+user_limiter = RateLimiter('user', RATE_LIMIT_USER_BURST, RATE_LIMIT_USER_PER_MINUTE, _backend)
+model_limiter = RateLimiter('model', RATE_LIMIT_MODEL_BURST, RATE_LIMIT_MODEL_PER_MINUTE, _backend)
+
+
+def check_generation_allowed(user_id, model, cost=1):
+    """
+    Control de admisión antes de llamar a OpenAI. El bucket del modelo cuenta
+    completions: `cost` es el máximo que puede hacer la petición y lo que no
+    use se devuelve con refund_generation.
+    Retorna 0 si se permite o los segundos a esperar (para Retry-After).
+    """
+    if not RATE_LIMIT_ENABLED:
+        return 0
+
+    retry_after = user_limiter.acquire(user_id)
+    if retry_after:
+        return retry_after
+
+    retry_after = model_limiter.acquire(model, cost)
+    if retry_after:
+        # El usuario no debe perder su token si el límite global lo rechaza
+        user_limiter.release(user_id)
+        return retry_after
+    return 0
+
+
+def refund_generation(model, unused):
+    """Devuelve al bucket del modelo las completions reservadas que no se hicieron"""
+    if RATE_LIMIT_ENABLED and unused > 0:
+        model_limiter.release(model, unused)
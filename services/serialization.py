@@ -0,0 +1,26 @@
+#!/usr/bin/env python3
+"""
+Serialización JSON rápida para las respuestas de la API: orjson si está
+instalado (opcional) y, si no, json con separadores compactos
+"""
+
+import json
+
+from flask import Response
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+def dumps(payload):
+    """Codifica en JSON (bytes UTF-8) sin espacios ni escapes de caracteres no ASCII"""
+    if orjson is not None:
+        return orjson.dumps(payload)
+    return json.dumps(payload, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+
+
+def json_response(payload, status=200):
+    """Respuesta application/json sin pasar por el proveedor JSON de Flask (ordena claves)"""
+    return Response(dumps(payload), status=status, mimetype='application/json')
@@ -0,0 +1,277 @@
+#!/usr/bin/env python3
+"""
+Sesiones en el servidor: la cookie solo lleva un id opaco y aleatorio (y un
+contador de versión) en lugar de los tokens de Supabase firmados, que ocupaban
+kilobytes y se verificaban con HMAC en cada petición, estáticos incluidos.
+
+Los datos se guardan en un almacén duradero (SQLite por defecto, Redis si está
+configurado) con caducidad, y cada worker mantiene una caché local. La versión
+de la cookie cambia con cada escritura, así que la caché local solo se usa si
+coincide con la última versión que recibió ese navegador; nunca da datos viejos.
+"""
+
+import logging
+import os
+import secrets
+import sqlite3
+import threading
+import time
+
+from dotenv import load_dotenv
+from flask.sessions import SessionInterface, SecureCookieSession, SecureCookieSessionInterface
+
+from config.redis_config import get_redis_client
+from services.cache import TTLCache
+
+# Cargar variables de entorno desde .env
+load_dotenv()
+
+SESSION_BACKEND = os.environ.get("SESSION_BACKEND", "")   # cookie | memory | sqlite | redis
+SESSION_PATH = os.environ.get("SESSION_PATH", "instance/sessions.db")
+SESSION_TTL = int(os.environ.get("SESSION_TTL", str(7 * 24 * 3600)))
+SESSION_LOCAL_CACHE_TTL = int(os.environ.get("SESSION_LOCAL_CACHE_TTL", "60"))
+SESSION_SWEEP_INTERVAL = int(os.environ.get("SESSION_SWEEP_INTERVAL", "600"))
+
+logger = logging.getLogger(__name__)
+
+
+class InMemorySessionBackend:
+    """Sesiones en memoria del proceso (solo para un único worker o pruebas)"""
+
+    def __init__(self):
+        self._data = {}
+        self._lock = threading.Lock()
+
+    def get(self, sid):
+        with self._lock:
+            return self._data.get(sid)
+
+    def set(self, sid, payload, expires_at):
+        with self._lock:
+            self._data[sid] = (payload, expires_at)
+
+    def delete(self, sid):
+        with self._lock:
+            self._data.pop(sid, None)
+
+    def sweep(self, now):
+        with self._lock:
+            expired = [sid for sid, (_, expires_at) in self._data.items() if expires_at <= now]
+            for sid in expired:
+                del self._data[sid]
+        return len(expired)
+
+
+class SQLiteSessionBackend:
+    """Sesiones en un archivo SQLite compartido por los workers de una máquina"""
+
+    def __init__(self, path):
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None, timeout=5)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS sessions "
+                           "(sid TEXT PRIMARY KEY, payload TEXT NOT NULL, expires_at REAL NOT NULL)")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_sessions_expires_at ON sessions (expires_at)")
+        self._lock = threading.Lock()
+
+    def get(self, sid):
+        with self._lock:
+            return self._conn.execute("SELECT payload, expires_at FROM sessions WHERE sid = ?", (sid,)).fetchone()
+
+    def set(self, sid, payload, expires_at):
+        with self._lock:
+            self._conn.execute("INSERT OR REPLACE INTO sessions VALUES (?, ?, ?)", (sid, payload, expires_at))
+
+    def delete(self, sid):
+        with self._lock:
+            self._conn.execute("DELETE FROM sessions WHERE sid = ?", (sid,))
+
+    def sweep(self, now):
+        with self._lock:
+            return self._conn.execute("DELETE FROM sessions WHERE expires_at <= ?", (now,)).rowcount
+
+
+class RedisSessionBackend:
+    """Sesiones compartidas entre máquinas; Redis las expira solo"""
+
+    def __init__(self, client):
+        self.client = client
+
+    def _key(self, sid):
+        return f"session:{sid}"
+
+    def get(self, sid):
+        payload, ttl = self.client.pipeline().get(self._key(sid)).pttl(self._key(sid)).execute()
+        if payload is None:
+            return None
+        return payload.decode('utf-8'), time.time() + max(ttl, 0) / 1000
+
+    def set(self, sid, payload, expires_at):
+        self.client.set(self._key(sid), payload, px=max(1, int((expires_at - time.time()) * 1000)))
+
+    def delete(self, sid):
+        self.client.delete(self._key(sid))
+
+    def sweep(self, now):
+        return 0
+
+
+class ServerSideSession(SecureCookieSession):
+    """Sesión cuyo contenido vive en el servidor; `sid` y `version` van en la cookie"""
+
+    def __init__(self, initial=None, sid=None, version=0, expires_at=None):
+        super().__init__(initial)
+        self.sid = sid
+        self.version = version
+        self.expires_at = expires_at
+        self.rotated = False
+
+    def regenerate(self):
+        """Nuevo id para la misma sesión (al iniciar sesión, contra la fijación de sesión)"""
+        self.rotated = True
+        self.modified = True
+
+
+def regenerate_session_id(session):
+    """Cambia el id de la sesión si el backend lo permite (las de cookie no tienen id)"""
+    if isinstance(session, ServerSideSession):
+        session.regenerate()
+
+
+class ServerSideSessionInterface(SessionInterface):
+    """
+    Cookie `<sid>.<versión>`; datos serializados como en las sesiones de Flask
+    (TaggedJSONSerializer) en el almacén, con caducidad deslizante de SESSION_TTL
+    """
+
+    serializer = SecureCookieSessionInterface.serializer
+
+    def __init__(self, backend, ttl=SESSION_TTL, local_cache_ttl=SESSION_LOCAL_CACHE_TTL,
+                 sweep_interval=SESSION_SWEEP_INTERVAL):
+        self.backend = backend
+        self.ttl = ttl
+        self.local = TTLCache(ttl=local_cache_ttl, max_entries=10_000, name='sessions')
+        self._stopped = threading.Event()
+        if sweep_interval and not isinstance(backend, RedisSessionBackend):
+            threading.Thread(target=self._run_sweeper, args=(sweep_interval,), name="session-sweeper",
+                             daemon=True).start()
+
+    def _run_sweeper(self, interval):
+        while not self._stopped.wait(interval):
+            try:
+                removed = self.backend.sweep(time.time())
+                if removed:
+                    logger.info("Sesiones caducadas eliminadas: %d", removed)
+            except Exception:
+                logger.exception("Error eliminando sesiones caducadas")
+
+    @staticmethod
+    def _parse_cookie(value):
+        sid, _, version = (value or '').partition('.')
+        if len(sid) < 32 or not version.isdigit():
+            return None, 0
+        return sid, int(version)
+
+    def _load(self, sid, version):
+        """(payload, caducidad) de la caché local si es la versión de la cookie; si no, del almacén"""
+        cached = self.local.get(sid)
+        if cached is not None and cached[0] == version:
+            return cached[1], cached[2]
+        row = self.backend.get(sid)
+        if row is None:
+            return None
+        payload, expires_at = row
+        self.local.set(sid, (version, payload, expires_at))
+        return payload, expires_at
+
+    def open_session(self, app, request):
+        sid, version = self._parse_cookie(request.cookies.get(self.get_cookie_name(app)))
+        if sid is None:
+            return ServerSideSession()
+        try:
+            loaded = self._load(sid, version)
+        except Exception:
+            logger.exception("Error leyendo la sesión")
+            loaded = None
+        if loaded is None or loaded[1] <= time.time():
+            # Caducada o desconocida: se empieza una nueva (con otro id)
+            return ServerSideSession()
+        payload, expires_at = loaded
+        return ServerSideSession(self.serializer.loads(payload), sid=sid, version=version, expires_at=expires_at)
+
+    def save_session(self, app, session, response):
+        name = self.get_cookie_name(app)
+        domain = self.get_cookie_domain(app)
+        path = self.get_cookie_path(app)
+        secure = self.get_cookie_secure(app)
+        samesite = self.get_cookie_samesite(app)
+        httponly = self.get_cookie_httponly(app)
+
+        if session.accessed:
+            response.vary.add('Cookie')
+
+        now = time.time()
+        if not session:
+            # Vacía: nada que guardar; si existía, se borra junto con la cookie
+            if session.sid is not None:
+                self._delete(session.sid)
+                response.delete_cookie(name, domain=domain, path=path, secure=secure,
+                                       samesite=samesite, httponly=httponly)
+                response.vary.add('Cookie')
+            return
+
+        # Renovar la caducidad solo cuando ha pasado la mitad: evita una escritura por petición
+        refresh = session.expires_at is None or session.expires_at - now < self.ttl / 2
+        if not (session.modified or refresh):
+            return
+
+        if session.sid is None or session.rotated:
+            if session.sid is not None:
+                self._delete(session.sid)
+            session.sid, session.version = secrets.token_urlsafe(32), 0
+        if session.modified:
+            session.version += 1
+
+        payload = self.serializer.dumps(dict(session))
+        expires_at = now + self.ttl
+        try:
+            self.backend.set(session.sid, payload, expires_at)
+        except Exception:
+            logger.exception("Error guardando la sesión")
+            return
+        self.local.set(session.sid, (session.version, payload, expires_at))
+
+        response.set_cookie(name, f"{session.sid}.{session.version}",
+                            expires=self.get_expiration_time(app, session), httponly=httponly,
+                            domain=domain, path=path, secure=secure, samesite=samesite)
+        response.vary.add('Cookie')
+
+    def _delete(self, sid):
+        self.local.pop(sid)
+        try:
+            self.backend.delete(sid)
+        except Exception:
+            logger.exception("Error eliminando la sesión")
+
+    def close(self):
+        self._stopped.set()
+
+
+def _create_backend():
+    """Redis si está configurado; si no, un archivo SQLite compartido entre workers"""
+    backend = SESSION_BACKEND.lower()
+    if backend in ('', 'redis'):
+        client = get_redis_client()
+        if client is not None:
+            return RedisSessionBackend(client)
+    if backend == 'memory':
+        return InMemorySessionBackend()
+    return SQLiteSessionBackend(SESSION_PATH)
+
+
+def init_app(app):
+    """Sesiones en el servidor salvo con SESSION_BACKEND=cookie (la cookie firmada de Flask)"""
+    if SESSION_BACKEND.lower() == 'cookie':
+        return
+    app.session_interface = ServerSideSessionInterface(_create_backend())
@@ -0,0 +1,87 @@
+#!/usr/bin/env python3
+"""
+Single-flight: agrupa llamadas concurrentes idénticas en una sola llamada
+"""
+
+import threading
+from functools import wraps
+
+# Grupos registrados, para exponer sus contadores
+_groups = {}
+
+
+class _Call:
+    """Llamada en curso cuyo resultado comparten todos los que esperan"""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """Ejecuta como mucho una llamada por clave a la vez; el resto espera su resultado"""
+
+    def __init__(self, name):
+        self.name = name
+        self._calls = {}
+        self._lock = threading.Lock()
+        self.calls = 0
+        self.executions = 0
+        self.coalesced = 0
+        _groups[name] = self
+
+    def do(self, key, fn, *args, **kwargs):
+        """Ejecuta fn(*args, **kwargs) o se une a la llamada en curso con la misma clave"""
+        with self._lock:
+            self.calls += 1
+            call = self._calls.get(key)
+            if call is not None:
+                self.coalesced += 1
+                leader = False
+            else:
+                call = _Call()
+                self._calls[key] = call
+                self.executions += 1
+                leader = True
+
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = fn(*args, **kwargs)
+            return call.result
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+
+    def stats(self):
+        """Contadores de llamadas, ejecuciones reales y llamadas agrupadas"""
+        return {'calls': self.calls, 'executions': self.executions, 'coalesced': self.coalesced}
+
+
+def coalesce(name=None):
+    """Decorador que agrupa llamadas concurrentes con los mismos argumentos"""
+    def decorator(fn):
+        flight = SingleFlight(name or fn.__qualname__)
+
+        @wraps(fn)
+        def wrapper(*args, **kwargs):
+            key = (args, tuple(sorted(kwargs.items())))
+            return flight.do(key, fn, *args, **kwargs)
+
+        wrapper.flight = flight
+        return wrapper
+    return decorator
+
+
+def singleflight_stats():
+    """Contadores de todos los grupos registrados"""
+    return {name: group.stats() for name, group in _groups.items()}
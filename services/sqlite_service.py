@@ -0,0 +1,439 @@
+#!/usr/bin/env python3
+"""
+Backend de almacenamiento embebido en SQLite (modo WAL) para despliegues de un solo nodo
+y para medir rendimiento en local sin red
+"""
+
+import logging
+import os
+import queue
+import sqlite3
+import time
+import uuid
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from types import SimpleNamespace
+from dotenv import load_dotenv
+from itsdangerous import URLSafeTimedSerializer, BadSignature
+from werkzeug.security import generate_password_hash, check_password_hash
+from models import Phrase, User
+from services.storage import StorageBackend, COLLECTION_PAGE_SIZE, encode_cursor, decode_cursor
+from services.metrics import instrument_methods
+from services.tracing import trace_methods
+from services.cache import content_hash
+from services.data_version import data_versions
+
+# Cargar variables de entorno desde .env
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+SQLITE_PATH = os.environ.get("SQLITE_PATH", os.path.join("instance", "sqlite_backend.db"))
+SQLITE_POOL_SIZE = int(os.environ.get("SQLITE_POOL_SIZE", "8"))
+SESSION_SECRET = os.environ.get("SESSION_SECRET", "dev-secret-key-change-in-production")
+
+ACCESS_TOKEN_TTL = 3600
+REFRESH_TOKEN_TTL = 30 * 24 * 3600
+RECENT_PHRASES_LIMIT = int(os.environ.get("RECENT_PHRASES_LIMIT", "200"))
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS auth_users (
+    id TEXT PRIMARY KEY,
+    email TEXT UNIQUE NOT NULL,
+    password_hash TEXT NOT NULL,
+    user_name TEXT,
+    created_at TEXT NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS users (
+    id TEXT PRIMARY KEY REFERENCES auth_users(id) ON DELETE CASCADE,
+    email TEXT UNIQUE NOT NULL,
+    user_name TEXT,
+    created_at TEXT,
+    updated_at TEXT
+);
+
+CREATE TABLE IF NOT EXISTS phrases (
+    id TEXT PRIMARY KEY,
+    user_id TEXT NOT NULL REFERENCES users(id) ON DELETE CASCADE,
+    original_emotion TEXT NOT NULL,
+    style VARCHAR(50) NOT NULL,
+    phrase VARCHAR(200) NOT NULL,
+    language VARCHAR(2) DEFAULT 'es',
+    is_favorite INTEGER NOT NULL DEFAULT 0,
+    created_at TEXT NOT NULL,
+    updated_at TEXT
+);
+
+-- Índices cubriendo los filtros de la colección (siempre por usuario y fecha)
+CREATE UNIQUE INDEX IF NOT EXISTS uniq_phrase_per_user ON phrases(user_id, phrase);
+CREATE INDEX IF NOT EXISTS idx_phrases_user_created ON phrases(user_id, created_at DESC);
+CREATE INDEX IF NOT EXISTS idx_phrases_user_favorite ON phrases(user_id, is_favorite, created_at DESC);
+CREATE INDEX IF NOT EXISTS idx_phrases_user_language ON phrases(user_id, language, created_at DESC);
+
+-- Refresh tokens ya canjeados (de un solo uso, como en Supabase) hasta que caducan
+CREATE TABLE IF NOT EXISTS used_refresh_tokens (
+    jti TEXT PRIMARY KEY,
+    expires_at REAL NOT NULL
+);
+"""
+
+# Sentencias fijas: sqlite3 las mantiene preparadas en la caché de cada conexión
+SQL_AUTH_USER_BY_EMAIL = "SELECT id, email, password_hash, user_name FROM auth_users WHERE email = ?"
+SQL_AUTH_USER_BY_ID = "SELECT id, email, user_name FROM auth_users WHERE id = ?"
+SQL_INSERT_AUTH_USER = "INSERT INTO auth_users (id, email, password_hash, user_name, created_at) VALUES (?, ?, ?, ?, ?)"
+SQL_USER_BY_ID = "SELECT * FROM users WHERE id = ?"
+SQL_INSERT_USER = "INSERT INTO users (id, email, user_name, created_at, updated_at) VALUES (?, ?, ?, ?, ?)"
+SQL_INSERT_PHRASE = """
+    INSERT INTO phrases (id, user_id, original_emotion, style, phrase, language, is_favorite, created_at, updated_at)
+    VALUES (?, ?, ?, ?, ?, ?, 0, ?, ?)
+"""
+SQL_RECENT_PHRASES = "SELECT phrase FROM phrases WHERE user_id = ? ORDER BY created_at DESC LIMIT ?"
+SQL_PHRASE_BY_ID = "SELECT * FROM phrases WHERE id = ?"
+SQL_TOGGLE_FAVORITE = """
+    UPDATE phrases SET is_favorite = NOT is_favorite, updated_at = ? WHERE id = ? RETURNING is_favorite, user_id
+"""
+SQL_DELETE_PHRASE = "DELETE FROM phrases WHERE id = ? RETURNING user_id"
+SQL_COUNT_PHRASES = "SELECT COUNT(*) FROM phrases WHERE user_id = ?"
+SQL_USE_REFRESH_TOKEN = "INSERT INTO used_refresh_tokens (jti, expires_at) VALUES (?, ?)"
+SQL_PURGE_REFRESH_TOKENS = "DELETE FROM used_refresh_tokens WHERE expires_at <= ?"
+
+
+def _now():
+    return datetime.now(timezone.utc).isoformat()
+
+
+class ConnectionPool:
+    """Pool de conexiones SQLite reutilizables entre peticiones"""
+
+    def __init__(self, path, size=SQLITE_POOL_SIZE):
+        self.path = path
+        self._pool = queue.LifoQueue(maxsize=size)
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path, check_same_thread=False, timeout=30, cached_statements=256)
+        conn.row_factory = sqlite3.Row
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute("PRAGMA foreign_keys=ON")
+        conn.execute("PRAGMA temp_store=MEMORY")
+        return conn
+
+    @contextmanager
+    def connection(self):
+        """Presta una conexión del pool (o abre una nueva si está vacío)"""
+        try:
+            conn = self._pool.get_nowait()
+        except queue.Empty:
+            conn = self._connect()
+        try:
+            yield conn
+        finally:
+            try:
+                self._pool.put_nowait(conn)
+            except queue.Full:
+                conn.close()
+
+
+@trace_methods('db')
+@instrument_methods
+class SQLiteService(StorageBackend):
+    """Implementación de StorageBackend sobre SQLite, con autenticación local"""
+
+    name = "sqlite"
+
+    def __init__(self, path=SQLITE_PATH):
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        self.pool = ConnectionPool(path)
+        self._tokens = URLSafeTimedSerializer(SESSION_SECRET, salt="sqlite-auth")
+        with self.pool.connection() as conn:
+            conn.executescript(SCHEMA)
+
+    def _phrase_row(self, row):
+        """Convierte una fila de phrases en un modelo Phrase"""
+        data = dict(row)
+        data['is_favorite'] = bool(data['is_favorite'])
+        return Phrase.from_row(data)
+
+    def _query_phrases(self, sql, params):
+        with self.pool.connection() as conn:
+            return [self._phrase_row(row) for row in conn.execute(sql, params)]
+
+    # Autenticación
+
+    def _issue_tokens(self, user_id):
+        access_token = self._tokens.dumps({'sub': user_id, 'typ': 'access'})
+        refresh_token = self._tokens.dumps({'sub': user_id, 'typ': 'refresh', 'jti': uuid.uuid4().hex})
+        return access_token, refresh_token
+
+    def _auth_user(self, row):
+        return SimpleNamespace(id=row['id'], email=row['email'], user_metadata={'user_name': row['user_name']})
+
+    def sign_in(self, email, password):
+        """Inicia sesión con email y contraseña; retorna (user, access_token, refresh_token)"""
+        with self.pool.connection() as conn:
+            row = conn.execute(SQL_AUTH_USER_BY_EMAIL, (email,)).fetchone()
+        if row is None or not check_password_hash(row['password_hash'], password):
+            raise ValueError("Invalid login credentials")
+        return (self._auth_user(row), *self._issue_tokens(row['id']))
+
+    def sign_up(self, email, password, user_name):
+        """Registra un usuario local; retorna el usuario creado"""
+        user_id = str(uuid.uuid4())
+        try:
+            with self.pool.connection() as conn, conn:
+                conn.execute(SQL_INSERT_AUTH_USER,
+                             (user_id, email, generate_password_hash(password), user_name, _now()))
+        except sqlite3.IntegrityError:
+            raise ValueError("User already registered")
+        return SimpleNamespace(id=user_id, email=email, user_metadata={'user_name': user_name})
+
+    def sign_out(self):
+        """Los tokens locales no tienen estado en el servidor"""
+
+    def restore_session(self, access_token, refresh_token):
+        """Los tokens locales se validan en cada petición; no hay sesión que restaurar"""
+
+    def _load_token(self, token, typ, max_age):
+        try:
+            claims = self._tokens.loads(token, max_age=max_age)
+        except BadSignature:
+            return None
+        return claims if claims.get('typ') == typ else None
+
+    def refresh_tokens(self, refresh_token):
+        """Emite un par de tokens nuevo a partir de un refresh token válido y lo invalida"""
+        try:
+            claims, issued_at = self._tokens.loads(refresh_token, max_age=REFRESH_TOKEN_TTL, return_timestamp=True)
+        except BadSignature:
+            claims = None
+        if not claims or claims.get('typ') != 'refresh' or not claims.get('jti'):
+            raise ValueError("Invalid Refresh Token")
+        now = time.time()
+        try:
+            with self.pool.connection() as conn, conn:
+                conn.execute(SQL_PURGE_REFRESH_TOKENS, (now,))
+                conn.execute(SQL_USE_REFRESH_TOKEN, (claims['jti'], issued_at.timestamp() + REFRESH_TOKEN_TTL))
+        except sqlite3.IntegrityError:
+            raise ValueError("Invalid Refresh Token: Already Used")
+        return self._issue_tokens(claims['sub'])
+
+    def token_expires_at(self, access_token):
+        """Fecha de emisión firmada en el token más ACCESS_TOKEN_TTL"""
+        try:
+            _, issued_at = self._tokens.loads(access_token, return_timestamp=True)
+        except BadSignature:
+            return None
+        return issued_at.timestamp() + ACCESS_TOKEN_TTL
+
+    def verify_access_token(self, access_token):
+        """Firma y antigüedad del token propio; no consulta la tabla de usuarios"""
+        claims = self._load_token(access_token, 'access', ACCESS_TOKEN_TTL) if access_token else None
+        return claims['sub'] if claims else None
+
+    def get_auth_user(self, access_token=None):
+        """Valida el access token localmente y retorna el usuario (respuesta con .user)"""
+        if not access_token:
+            return None
+        claims = self._load_token(access_token, 'access', ACCESS_TOKEN_TTL)
+        if claims is None:
+            return None
+        with self.pool.connection() as conn:
+            row = conn.execute(SQL_AUTH_USER_BY_ID, (claims['sub'],)).fetchone()
+        return SimpleNamespace(user=self._auth_user(row) if row else None)
+
+    # Usuarios
+
+    def get_user_info(self, user_id):
+        """Obtiene información del usuario desde la tabla users"""
+        with self.pool.connection() as conn:
+            row = conn.execute(SQL_USER_BY_ID, (user_id,)).fetchone()
+        return User.from_row(row) if row else None
+
+    def create_user(self, user_id, email, user_name):
+        """Crea un nuevo usuario en la tabla users"""
+        now = _now()
+        try:
+            with self.pool.connection() as conn, conn:
+                conn.execute(SQL_INSERT_USER, (user_id, email, user_name, now, now))
+        except sqlite3.IntegrityError as e:
+            logger.warning("Error creando usuario: %s", e, extra={'user_id': user_id})
+            return None
+        data_versions.bump(user_id)
+        return User(id=user_id, email=email, user_name=user_name, created_at=now, updated_at=now)
+
+    def update_user_info(self, user_id, update_data):
+        """Actualiza información del usuario"""
+        update_data = {k: v for k, v in update_data.items() if k in ('email', 'user_name')}
+        update_data['updated_at'] = _now()
+        assignments = ', '.join(f"{column} = ?" for column in update_data)
+        with self.pool.connection() as conn, conn:
+            conn.execute(f"UPDATE users SET {assignments} WHERE id = ?", (*update_data.values(), user_id))
+        data_versions.bump(user_id)
+        return self.get_user_info(user_id)
+
+    # Frases
+
+    def create_phrase(self, user_id, original_emotion, style, phrase, language='es'):
+        """Crea una nueva frase"""
+        phrase_id = str(uuid.uuid4())
+        now = _now()
+        try:
+            with self.pool.connection() as conn, conn:
+                conn.execute(SQL_INSERT_PHRASE,
+                             (phrase_id, user_id, original_emotion, style, phrase, language, now, now))
+        except sqlite3.IntegrityError as e:
+            logger.info("Error creando frase: %s", e, extra={'user_id': user_id})
+            return None, str(e)
+        data_versions.bump(user_id)
+        return Phrase(
+            id=phrase_id,
+            user_id=user_id,
+            original_emotion=original_emotion,
+            style=style,
+            generated_phrase=phrase,
+            language=language,
+            is_favorite=False,
+            created_at=now,
+            updated_at=now
+        ), None
+
+    def get_phrase_hashes(self, user_id, refresh=False):
+        """Hashes de las frases recientes del usuario (consulta local, sin caché)"""
+        with self.pool.connection() as conn:
+            rows = conn.execute(SQL_RECENT_PHRASES, (user_id, RECENT_PHRASES_LIMIT)).fetchall()
+        return frozenset(content_hash(row['phrase']) for row in rows)
+
+    def _filtered_phrases(self, user_id, condition='', params=()):
+        where = []
+        if user_id:
+            where.append("user_id = ?")
+            params = (user_id, *params)
+        if condition:
+            where.append(condition)
+        sql = "SELECT * FROM phrases"
+        if where:
+            sql += " WHERE " + " AND ".join(where)
+        return self._query_phrases(sql + " ORDER BY created_at DESC", params)
+
+    def get_all_phrases(self, user_id=None):
+        """Obtiene todas las frases ordenadas por fecha de creación"""
+        return self._filtered_phrases(user_id)
+
+    def get_favorite_phrases(self, user_id=None):
+        """Obtiene solo las frases favoritas"""
+        return self._filtered_phrases(user_id, "is_favorite = 1")
+
+    def get_phrases_by_language(self, language, user_id=None):
+        """Obtiene frases filtradas por idioma"""
+        return self._filtered_phrases(user_id, "language = ?", (language,))
+
+    def list_phrases(self, user_id, limit=COLLECTION_PAGE_SIZE, cursor=None, favorites=False, language=None):
+        """Página de frases por keyset (created_at, id): usa los índices por usuario y fecha"""
+        where, params = ["user_id = ?"], [user_id]
+        if favorites:
+            where.append("is_favorite = 1")
+        if language:
+            where.append("language = ?")
+            params.append(language)
+        if cursor:
+            created_at, phrase_id = decode_cursor(cursor)
+            where.append("(created_at < ? OR (created_at = ? AND id < ?))")
+            params += [created_at, created_at, phrase_id]
+        rows = self._query_phrases(
+            f"SELECT * FROM phrases WHERE {' AND '.join(where)} ORDER BY created_at DESC, id DESC LIMIT ?",
+            (*params, limit + 1))
+        if len(rows) > limit:
+            return rows[:limit], encode_cursor(rows[limit - 1])
+        return rows, None
+
+    def get_phrase_by_id(self, phrase_id):
+        """Obtiene una frase específica por ID"""
+        rows = self._query_phrases(SQL_PHRASE_BY_ID, (phrase_id,))
+        return rows[0] if rows else None
+
+    def get_phrases_by_ids(self, user_id, phrase_ids):
+        """Frases del usuario con esos ids, en una consulta"""
+        if not phrase_ids:
+            return []
+        placeholders = ','.join('?' * len(phrase_ids))
+        return self._query_phrases(
+            f"SELECT * FROM phrases WHERE user_id = ? AND id IN ({placeholders}) ORDER BY created_at DESC, id DESC",
+            (user_id, *phrase_ids))
+
+    def set_favorites(self, user_id, phrase_ids, is_favorite):
+        """Marca o desmarca varias frases del usuario en un solo UPDATE"""
+        if not phrase_ids:
+            return []
+        placeholders = ','.join('?' * len(phrase_ids))
+        with self.pool.connection() as conn, conn:
+            rows = conn.execute(
+                f"UPDATE phrases SET is_favorite = ?, updated_at = ? WHERE user_id = ? AND id IN ({placeholders}) "
+                "RETURNING id", (int(bool(is_favorite)), _now(), user_id, *phrase_ids)).fetchall()
+        if rows:
+            data_versions.bump(user_id)
+        return [row[0] for row in rows]
+
+    def delete_phrases(self, user_id, phrase_ids):
+        """Elimina varias frases del usuario en un solo DELETE"""
+        if not phrase_ids:
+            return []
+        placeholders = ','.join('?' * len(phrase_ids))
+        with self.pool.connection() as conn, conn:
+            rows = conn.execute(f"DELETE FROM phrases WHERE user_id = ? AND id IN ({placeholders}) RETURNING id",
+                                (user_id, *phrase_ids)).fetchall()
+        if rows:
+            data_versions.bump(user_id)
+        return [row[0] for row in rows]
+
+    def toggle_favorite(self, phrase_id):
+        """Cambia el estado de favorito de una frase en una sola sentencia"""
+        with self.pool.connection() as conn, conn:
+            row = conn.execute(SQL_TOGGLE_FAVORITE, (_now(), phrase_id)).fetchone()
+        if row is None:
+            return None
+        data_versions.bump(row[1])
+        return bool(row[0])
+
+    def delete_phrase(self, phrase_id):
+        """Elimina una frase"""
+        with self.pool.connection() as conn, conn:
+            row = conn.execute(SQL_DELETE_PHRASE, (phrase_id,)).fetchone()
+        if row is not None:
+            data_versions.bump(row[0])
+        return True
+
+    def get_stats(self, user_id=None):
+        """Obtiene estadísticas agregadas directamente en SQL"""
+        where, params = ("WHERE user_id = ?", (user_id,)) if user_id else ("", ())
+        with self.pool.connection() as conn:
+            total, favorites, short, medium, long = conn.execute(f"""
+                SELECT COUNT(*),
+                       COALESCE(SUM(is_favorite), 0),
+                       COALESCE(SUM(length(original_emotion) < 50), 0),
+                       COALESCE(SUM(length(original_emotion) >= 50 AND length(original_emotion) < 150), 0),
+                       COALESCE(SUM(length(original_emotion) >= 150), 0)
+                FROM phrases {where}
+            """, params).fetchone()
+            if not total:
+                return self.empty_stats()
+            language_stats = dict(conn.execute(
+                f"SELECT COALESCE(language, 'es'), COUNT(*) FROM phrases {where} GROUP BY 1", params).fetchall())
+            style_stats = dict(conn.execute(
+                f"SELECT style, COUNT(*) FROM phrases {where} GROUP BY style", params).fetchall())
+        return {
+            'total_phrases': total,
+            'favorite_phrases': favorites,
+            'language_stats': language_stats,
+            'style_stats': style_stats,
+            'emotion_length_stats': {'short': short, 'medium': medium, 'long': long}
+        }
+
+    def get_phrase_count(self, user_id):
+        """Cuenta el número de frases creadas por un usuario"""
+        with self.pool.connection() as conn:
+            return conn.execute(SQL_COUNT_PHRASES, (user_id,)).fetchone()[0]
+
+
+# Instancia global del servicio
+sqlite_service = SQLiteService()
@@ -0,0 +1,243 @@
+#!/usr/bin/env python3
+"""
+Interfaz común de almacenamiento y selección del backend por configuración
+"""
+
+import base64
+import binascii
+import json
+import os
+from abc import ABC, abstractmethod
+from dotenv import load_dotenv
+
+# Cargar variables de entorno desde .env
+load_dotenv()
+
+# Tamaño de página de la colección (API JSON y primera página renderizada)
+COLLECTION_PAGE_SIZE = int(os.environ.get("COLLECTION_PAGE_SIZE", "30"))
+COLLECTION_MAX_PAGE_SIZE = 100
+# Páginas que la colección envía en streaming antes de seguir con /api/phrases (0 = sin streaming)
+COLLECTION_STREAM_PAGES = int(os.environ.get("COLLECTION_STREAM_PAGES", "0"))
+# Máximo de ids por operación en lote (/api/phrases/batch)
+PHRASE_BATCH_MAX_SIZE = 100
+
+def get_storage_backend_name():
+    """Backend configurado: STORAGE_BACKEND, o Supabase si hay credenciales (o SUPABASE_FAKE) y SQLite si no"""
+    has_supabase = os.environ.get("SUPABASE_URL") and os.environ.get("SUPABASE_KEY")
+    fake_supabase = os.environ.get("SUPABASE_FAKE", "false").lower() == "true"
+    default = "supabase" if has_supabase or fake_supabase else "sqlite"
+    return os.environ.get("STORAGE_BACKEND", default).lower()
+
+
+def encode_cursor(phrase):
+    """Cursor opaco con la posición de una frase en el orden (created_at, id) descendente"""
+    raw = json.dumps([str(phrase.created_at), phrase.id], separators=(',', ':'))
+    return base64.urlsafe_b64encode(raw.encode('utf-8')).decode('ascii').rstrip('=')
+
+
+def decode_cursor(cursor):
+    """(created_at, id) de un cursor; lanza ValueError si no es válido"""
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        created_at, phrase_id = json.loads(raw)
+    except (binascii.Error, UnicodeDecodeError, ValueError, TypeError) as e:
+        raise ValueError(f"Cursor no válido: {cursor!r}") from e
+    if not isinstance(created_at, str) or not isinstance(phrase_id, str):
+        raise ValueError(f"Cursor no válido: {cursor!r}")
+    return created_at, phrase_id
+
+
+def is_before_cursor(phrase, position):
+    """Indica si la frase va después de la posición (created_at, id) en el orden descendente"""
+    created_at, phrase_id = position
+    phrase_created = str(phrase.created_at or '')
+    return phrase_created < created_at or (phrase_created == created_at and phrase.id < phrase_id)
+
+
+class PhrasePageStream:
+    """
+    Recorre las páginas de frases del usuario con list_phrases, una consulta por
+    página y sin acumularlas, hasta `max_pages`. Al terminar, next_cursor es el
+    cursor para continuar (o None) y count el número de frases recorridas.
+    """
+
+    def __init__(self, service, user_id, max_pages, limit=COLLECTION_PAGE_SIZE, favorites=False, language=None):
+        self.service = service
+        self.user_id = user_id
+        self.max_pages = max_pages
+        self.limit = limit
+        self.favorites = favorites
+        self.language = language
+        self.next_cursor = None
+        self.count = 0
+
+    def __iter__(self):
+        cursor = None
+        for _ in range(self.max_pages):
+            phrases, cursor = self.service.list_phrases(self.user_id, limit=self.limit, cursor=cursor,
+                                                        favorites=self.favorites, language=self.language)
+            self.next_cursor = cursor
+            self.count += len(phrases)
+            if phrases:
+                yield phrases
+            if not cursor:
+                break
+
+
+class StorageBackend(ABC):
+    """Operaciones de autenticación, usuarios y frases que usa la aplicación"""
+
+    name = None
+
+    @staticmethod
+    def is_duplicate_error(error):
+        """Indica si un error corresponde a la restricción uniq_phrase_per_user"""
+        error_str = str(error).lower()
+        return "duplicate" in error_str or "unique constraint" in error_str
+
+    @staticmethod
+    def empty_stats():
+        """Estadísticas de un usuario sin frases"""
+        return {
+            'total_phrases': 0,
+            'favorite_phrases': 0,
+            'language_stats': {},
+            'style_stats': {},
+            'emotion_length_stats': {
+                'short': 0,  # < 50 caracteres
+                'medium': 0,  # 50-150 caracteres
+                'long': 0     # > 150 caracteres
+            }
+        }
+
+    def test_connection(self):
+        """Prueba la conexión con el almacenamiento"""
+        return True
+
+    # Autenticación
+
+    @abstractmethod
+    def sign_in(self, email, password):
+        """Inicia sesión; retorna (user, access_token, refresh_token) o lanza una excepción"""
+
+    @abstractmethod
+    def sign_up(self, email, password, user_name):
+        """Registra un usuario en Auth; retorna el usuario creado o None"""
+
+    @abstractmethod
+    def sign_out(self):
+        """Cierra la sesión actual en Auth"""
+
+    @abstractmethod
+    def restore_session(self, access_token, refresh_token):
+        """Restaura una sesión a partir de los tokens guardados"""
+
+    @abstractmethod
+    def get_auth_user(self, access_token=None):
+        """Obtiene el usuario autenticado (respuesta con atributo .user)"""
+
+    @abstractmethod
+    def refresh_tokens(self, refresh_token):
+        """Canjea un refresh token por (access_token, refresh_token) nuevos; lanza excepción si no es válido"""
+
+    @abstractmethod
+    def token_expires_at(self, access_token):
+        """Fecha de caducidad (epoch) de un access token leída sin red, o None si no se puede leer"""
+
+    @abstractmethod
+    def verify_access_token(self, access_token):
+        """Id del usuario si el access token es válido comprobándolo sin red, o None"""
+
+    # Usuarios
+
+    @abstractmethod
+    def get_user_info(self, user_id):
+        """Obtiene información del usuario"""
+
+    @abstractmethod
+    def create_user(self, user_id, email, user_name):
+        """Crea el perfil de un usuario"""
+
+    @abstractmethod
+    def update_user_info(self, user_id, update_data):
+        """Actualiza información del usuario"""
+
+    # Frases
+
+    @abstractmethod
+    def create_phrase(self, user_id, original_emotion, style, phrase, language='es'):
+        """Crea una frase; retorna (frase, error)"""
+
+    @abstractmethod
+    def get_phrase_hashes(self, user_id, refresh=False):
+        """Hashes de las frases recientes del usuario"""
+
+    @abstractmethod
+    def get_all_phrases(self, user_id=None):
+        """Frases ordenadas por fecha de creación descendente"""
+
+    @abstractmethod
+    def get_favorite_phrases(self, user_id=None):
+        """Solo las frases favoritas"""
+
+    @abstractmethod
+    def get_phrases_by_language(self, language, user_id=None):
+        """Frases filtradas por idioma"""
+
+    @abstractmethod
+    def list_phrases(self, user_id, limit=COLLECTION_PAGE_SIZE, cursor=None, favorites=False, language=None):
+        """
+        Una página de frases del usuario en orden (created_at, id) descendente;
+        retorna (frases, cursor de la página siguiente o None). Lanza ValueError
+        si el cursor no es válido
+        """
+
+    @abstractmethod
+    def get_phrase_by_id(self, phrase_id):
+        """Una frase por ID, o None"""
+
+    @abstractmethod
+    def get_phrases_by_ids(self, user_id, phrase_ids):
+        """Las frases del usuario con esos ids (una sola consulta; las ajenas no aparecen)"""
+
+    @abstractmethod
+    def set_favorites(self, user_id, phrase_ids, is_favorite):
+        """Marca o desmarca como favoritas las frases del usuario en una sentencia; retorna los ids afectados"""
+
+    @abstractmethod
+    def delete_phrases(self, user_id, phrase_ids):
+        """Elimina las frases del usuario en una sentencia; retorna los ids eliminados"""
+
+    @abstractmethod
+    def toggle_favorite(self, phrase_id):
+        """Cambia el estado de favorito; retorna el nuevo valor o None"""
+
+    @abstractmethod
+    def delete_phrase(self, phrase_id):
+        """Elimina una frase; retorna True si se eliminó"""
+
+    @abstractmethod
+    def get_stats(self, user_id=None):
+        """Estadísticas de las frases del usuario"""
+
+    @abstractmethod
+    def get_phrase_count(self, user_id):
+        """Número de frases del usuario"""
+
+
+storage_service = None
+
+def get_storage_service():
+    """Crea (una sola vez) y retorna el backend de almacenamiento configurado"""
+    global storage_service
+    if storage_service is None:
+        backend = get_storage_backend_name()
+        if backend == "supabase":
+            from services.supabase_service import supabase_service
+            storage_service = supabase_service
+        elif backend == "sqlite":
+            from services.sqlite_service import sqlite_service
+            storage_service = sqlite_service
+        else:
+            raise ValueError(f"STORAGE_BACKEND no soportado: {backend}")
+    return storage_service
@@ -3,39 +3,179 @@
 Servicio para manejar operaciones de base de datos con Supabase
 """
 
+import logging
 import os
+import time
+import uuid
 from datetime import datetime
 from dotenv import load_dotenv
-from config.supabase_config import get_supabase_client
+from config.supabase_config import get_supabase_client, test_supabase_connection
+from models import Phrase, User
+from services.storage import StorageBackend, COLLECTION_PAGE_SIZE, encode_cursor, decode_cursor, is_before_cursor
+from services.metrics import instrument_methods
+from services.tracing import trace_methods
+from services.cache import TTLCache, content_hash
+from services.singleflight import coalesce
+from services.write_behind import WriteBehindQueue
+from services.data_version import data_versions
+from services.tokens import SUPABASE_JWT_SECRET, jwt_claims, jwt_expires_at, verify_jwt
 
 # Cargar variables de entorno desde .env
 load_dotenv()
 
-class SupabaseService:
+logger = logging.getLogger(__name__)
+
+# Frases recientes por usuario que se consultan para evitar duplicados
+RECENT_PHRASES_LIMIT = int(os.environ.get("RECENT_PHRASES_LIMIT", "200"))
+PHRASE_HASH_TTL = int(os.environ.get("PHRASE_HASH_TTL", "600"))
+
+# Modo write-behind: las escrituras de frases se encolan localmente y se vuelcan por lotes
+WRITE_BEHIND_ENABLED = os.environ.get("SUPABASE_WRITE_BEHIND", "false").lower() == "true"
+WRITE_BEHIND_PATH = os.environ.get("WRITE_BEHIND_PATH", os.path.join("instance", "write_behind.db"))
+WRITE_BEHIND_INTERVAL = float(os.environ.get("WRITE_BEHIND_INTERVAL", "1.0"))
+WRITE_BEHIND_BATCH_SIZE = int(os.environ.get("WRITE_BEHIND_BATCH_SIZE", "100"))
+WRITE_BEHIND_MAX_ATTEMPTS = int(os.environ.get("WRITE_BEHIND_MAX_ATTEMPTS", "10"))
+
+DUPLICATE_PHRASE_ERROR = 'duplicate key value violates unique constraint "uniq_phrase_per_user"'
+
+@trace_methods('db')
+@instrument_methods
+class SupabaseService(StorageBackend):
     """Servicio para manejar operaciones de base de datos con Supabase"""
     
+    name = "supabase"
+    
     def __init__(self):
         self.supabase = get_supabase_client()
+        # user_id -> conjunto de hashes de sus frases recientes (uniq_phrase_per_user)
+        self._phrase_hashes = TTLCache(ttl=PHRASE_HASH_TTL, max_entries=4096, name='phrase_hashes')
+        
+        self.write_queue = None
+        if WRITE_BEHIND_ENABLED:
+            os.makedirs(os.path.dirname(WRITE_BEHIND_PATH) or '.', exist_ok=True)
+            self.write_queue = WriteBehindQueue(
+                WRITE_BEHIND_PATH,
+                self._flush_writes,
+                interval=WRITE_BEHIND_INTERVAL,
+                batch_size=WRITE_BEHIND_BATCH_SIZE,
+                max_attempts=WRITE_BEHIND_MAX_ATTEMPTS
+            )
+    
+    def test_connection(self):
+        """Prueba la conexión con Supabase y las tablas necesarias"""
+        return test_supabase_connection()
+    
+    def sign_in(self, email, password):
+        """Inicia sesión con email y contraseña; retorna (user, access_token, refresh_token)"""
+        response = self.supabase.auth.sign_in_with_password({
+            'email': email,
+            'password': password
+        })
+        
+        return self._auth_session(response)
+    
+    @staticmethod
+    def _auth_session(response):
+        """(user, access_token, refresh_token) de una respuesta de Auth con sesión"""
+        # Manejar la nueva estructura de respuesta de Supabase
+        user = None
+        session_data = None
+        if hasattr(response, 'data') and response.data:
+            user = getattr(response.data, 'user', None)
+            session_data = getattr(response.data, 'session', None)
+        elif hasattr(response, 'user') or hasattr(response, 'session'):
+            user = getattr(response, 'user', None)
+            session_data = getattr(response, 'session', None)
+        else:
+            logger.warning("Estructura de respuesta inesperada de Auth: %r", response)
+        
+        access_token = refresh_token = None
+        if session_data:
+            access_token = getattr(session_data, 'access_token', None)
+            refresh_token = getattr(session_data, 'refresh_token', None)
+            if access_token is None and isinstance(session_data, dict):
+                access_token = session_data.get('access_token')
+                refresh_token = session_data.get('refresh_token')
+        return user, access_token, refresh_token
+    
+    def sign_up(self, email, password, user_name):
+        """Registra un usuario en Supabase Auth; retorna el usuario o None"""
+        response = self.supabase.auth.sign_up({
+            'email': email,
+            'password': password,
+            'options': {
+                'data': {
+                    'user_name': user_name
+                }
+            }
+        })
+        
+        # Manejar la nueva estructura de respuesta de Supabase
+        if hasattr(response, 'data') and response.data and hasattr(response.data, 'user'):
+            return response.data.user
+        elif hasattr(response, 'user'):
+            return response.user
+        logger.warning("Estructura de respuesta inesperada en sign_up: %r", response)
+        return None
+    
+    def sign_out(self):
+        """Cierra la sesión en Supabase Auth"""
+        self.supabase.auth.sign_out()
+    
+    def restore_session(self, access_token, refresh_token):
+        """Restaura la sesión del cliente de Supabase con los tokens guardados"""
+        if hasattr(self.supabase.auth, 'set_session'):
+            self.supabase.auth.set_session(access_token, refresh_token)
+        elif hasattr(self.supabase.auth, 'set_auth'):
+            self.supabase.auth.set_auth(access_token)
+    
+    def refresh_tokens(self, refresh_token):
+        """Canjea el refresh token en Supabase Auth (los refresh tokens son de un solo uso)"""
+        _, access_token, new_refresh_token = self._auth_session(self.supabase.auth.refresh_session(refresh_token))
+        if not access_token:
+            raise ValueError("Supabase Auth no devolvió una sesión")
+        return access_token, new_refresh_token
+    
+    def token_expires_at(self, access_token):
+        """Claim exp del JWT de Supabase (sin verificar la firma: solo decide cuándo renovar)"""
+        return jwt_expires_at(access_token)
     
+    def verify_access_token(self, access_token):
+        """
+        Verifica el JWT con SUPABASE_JWT_SECRET. Sin el secreto solo se puede leer su
+        caducidad: sirve para decidir qué página mostrar, no como autenticación
+        (login_required sigue validando el token con Supabase Auth)
+        """
+        if SUPABASE_JWT_SECRET:
+            claims = verify_jwt(access_token, SUPABASE_JWT_SECRET)
+        else:
+            claims = jwt_claims(access_token)
+            expires_at = self.token_expires_at(access_token)
+            if expires_at is None or expires_at <= time.time():
+                claims = None
+        return claims.get('sub') if isinstance(claims, dict) else None
+    
+    @coalesce()
+    def get_auth_user(self, access_token=None):
+        """Obtiene el usuario de Supabase Auth para un access token (o la sesión actual)"""
+        if access_token:
+            return self.supabase.auth.get_user(access_token)
+        return self.supabase.auth.get_user()
+    
+    @coalesce()
     def get_user_info(self, user_id):
         """Obtiene información del usuario desde la tabla users"""
         try:
-            print(f"🔍 Buscando usuario con ID: {user_id}")
             response = self.supabase.table('users').select('*').eq('id', user_id).execute()
-            print(f"🔍 Respuesta de Supabase: {response}")
-            print(f"🔍 Datos recibidos: {response.data}")
             
             if response.data:
-                print(f"✅ Usuario encontrado: {response.data[0]}")
-                return response.data[0]
+                logger.debug("Usuario encontrado", extra={'user_id': user_id})
+                return User.from_row(response.data[0])
             else:
-                print("⚠️ Usuario no encontrado en la base de datos")
+                logger.info("Usuario no encontrado en la base de datos", extra={'user_id': user_id})
                 return None
-        except Exception as e:
-            print(f"❌ Error obteniendo información del usuario: {e}")
-            print(f"Tipo de error: {type(e)}")
-            import traceback
-            traceback.print_exc()
+        except Exception:
+            logger.exception("Error obteniendo información del usuario", extra={'user_id': user_id})
             return None
     
     def create_user(self, user_id, email, user_name):
@@ -49,23 +189,18 @@ class SupabaseService:
                 'updated_at': datetime.utcnow().isoformat()
             }
             
-            print(f"🔍 Intentando crear usuario: {data}")
             response = self.supabase.table('users').insert(data).execute()
-            print(f"🔍 Respuesta de Supabase al crear usuario: {response}")
-            print(f"🔍 Datos de respuesta: {response.data}")
             
             if response.data:
-                print(f"✅ Usuario creado exitosamente: {response.data[0]}")
-                return response.data[0]
+                logger.info("Usuario creado", extra={'user_id': user_id})
+                data_versions.bump(user_id)
+                return User.from_row(response.data[0])
             else:
-                print("⚠️ No se recibieron datos al crear usuario")
+                logger.warning("No se recibieron datos al crear usuario", extra={'user_id': user_id})
                 return None
             
-        except Exception as e:
-            print(f"❌ Error creando usuario: {e}")
-            print(f"Tipo de error: {type(e)}")
-            import traceback
-            traceback.print_exc()
+        except Exception:
+            logger.exception("Error creando usuario", extra={'user_id': user_id})
             return None
     
     def update_user_info(self, user_id, update_data):
@@ -76,25 +211,71 @@ class SupabaseService:
             response = self.supabase.table('users').update(update_data).eq('id', user_id).execute()
             
             if response.data:
-                return response.data[0]
+                data_versions.bump(user_id)
+                return User.from_row(response.data[0])
             return None
             
         except Exception as e:
-            print(f"Error actualizando usuario: {e}")
+            logger.error("Error actualizando usuario: %s", e, extra={'user_id': user_id})
             return None
     
     def _map_phrase_data(self, data):
-        """Mapea los datos de la DB a lo que espera la app (phrase -> generated_phrase)"""
+        """Convierte filas de la DB (una o una lista) en modelos Phrase (phrase -> generated_phrase)"""
         if isinstance(data, list):
-            for item in data:
-                if 'phrase' in item:
-                    item['generated_phrase'] = item['phrase']
-            return data
-        elif isinstance(data, dict):
-            if 'phrase' in data:
-                data['generated_phrase'] = data['phrase']
-            return data
+            return Phrase.from_rows(data)
+        elif data is not None:
+            return Phrase.from_row(data)
         return data
+    
+    def _with_pending_writes(self, rows, user_id=None, include=None):
+        """Aplica las escrituras pendientes (write-behind) a un resultado de lectura"""
+        if self.write_queue is None:
+            return rows
+        
+        overrides = self.write_queue.favorite_overrides()
+        if overrides:
+            rows = [phrase.replace(is_favorite=overrides[phrase.id]) if phrase.id in overrides else phrase
+                    for phrase in rows]
+        
+        pending = self.write_queue.pending_for_user(user_id) if user_id else []
+        if pending:
+            known = {phrase.id for phrase in rows}
+            settled = [row['id'] for row in pending if row['id'] in known]
+            if settled:
+                # La DB ya las tiene: dejan de ser pendientes
+                self.write_queue.settle(settled)
+            rows = rows + self._map_phrase_data([row for row in pending if row['id'] not in known])
+            rows.sort(key=lambda phrase: phrase.created_at or '', reverse=True)
+        
+        if include is not None:
+            rows = [phrase for phrase in rows if include(phrase)]
+        return rows
+    
+    def _flush_writes(self, inserts, favorites, user_ids=()):
+        """Vuelca un lote de la cola write-behind: un insert masivo y un update por valor"""
+        if inserts:
+            try:
+                self.supabase.table('phrases').insert(inserts).execute()
+            except Exception as e:
+                if not self.is_duplicate_error(e):
+                    raise
+                # Un duplicado rechaza todo el lote: insertar una a una y descartar duplicados
+                for row in inserts:
+                    try:
+                        self.supabase.table('phrases').insert(row).execute()
+                    except Exception as row_error:
+                        if not self.is_duplicate_error(row_error):
+                            raise
+                        logger.warning("Frase duplicada descartada de la cola: %s", row['id'])
+        
+        for value in (True, False):
+            ids = [phrase_id for phrase_id, is_favorite in favorites.items() if is_favorite == value]
+            if ids:
+                self.supabase.table('phrases').update({'is_favorite': value}).in_('id', ids).execute()
+        
+        # Ya están en la DB: las páginas cacheadas por otros workers (sin este overlay) caducan
+        for user_id in user_ids:
+            data_versions.bump(user_id)
 
     def create_phrase(self, user_id, original_emotion, style, phrase, language='es'):
         """Crea una nueva frase en Supabase"""
@@ -109,16 +290,57 @@ class SupabaseService:
                 'is_favorite': False
             }
             
+            if self.write_queue is not None:
+                # Write-behind: validar la unicidad localmente, encolar y responder ya
+                if content_hash(phrase) in self.get_phrase_hashes(user_id):
+                    return None, DUPLICATE_PHRASE_ERROR
+                data['id'] = str(uuid.uuid4())
+                self.write_queue.enqueue_insert(data)
+                self._remember_phrase(user_id, phrase)
+                data_versions.bump(user_id)
+                return self._map_phrase_data(data), None
+            
             response = self.supabase.table('phrases').insert(data).execute()
             
             if response.data:
+                self._remember_phrase(user_id, phrase)
+                data_versions.bump(user_id)
                 return self._map_phrase_data(response.data[0]), None
             return None, "No data returned from database"
             
         except Exception as e:
-            print(f"Error creando frase: {e}")
+            logger.error("Error creando frase: %s", e, extra={'user_id': user_id})
+            if self.is_duplicate_error(e):
+                # La frase ya existe: recordarla para no volver a generarla
+                self._remember_phrase(user_id, phrase)
             return None, str(e)
     
+    def get_phrase_hashes(self, user_id, refresh=False):
+        """Obtiene (con caché) los hashes de las frases recientes del usuario"""
+        hashes = None if refresh else self._phrase_hashes.get(user_id)
+        if hashes is not None:
+            return hashes
+        try:
+            response = self.supabase.table('phrases').select('phrase').eq('user_id', user_id) \
+                .order('created_at', desc=True).limit(RECENT_PHRASES_LIMIT).execute()
+            rows = response.data
+            if self.write_queue is not None:
+                rows = rows + self.write_queue.pending_for_user(user_id)
+            hashes = frozenset(content_hash(row['phrase']) for row in rows if row.get('phrase'))
+            self._phrase_hashes.set(user_id, hashes)
+            return hashes
+        except Exception as e:
+            logger.error("Error obteniendo frases recientes: %s", e, extra={'user_id': user_id})
+            return frozenset()
+    
+    def _remember_phrase(self, user_id, phrase):
+        """Añade una frase al conjunto en caché del usuario, si está cargado"""
+        hashes = self._phrase_hashes.get(user_id)
+        if hashes is not None:
+            # Los conjuntos son inmutables para poder compartirlos entre hilos
+            self._phrase_hashes.set(user_id, hashes | {content_hash(phrase)})
+    
+    @coalesce()
     def get_all_phrases(self, user_id=None):
         """Obtiene todas las frases ordenadas por fecha de creación"""
         try:
@@ -128,11 +350,12 @@ class SupabaseService:
                 query = query.eq('user_id', user_id)
             
             response = query.execute()
-            return self._map_phrase_data(response.data)
+            return self._with_pending_writes(self._map_phrase_data(response.data), user_id)
         except Exception as e:
-            print(f"Error obteniendo frases: {e}")
+            logger.error("Error obteniendo frases: %s", e, extra={'user_id': user_id})
             return []
     
+    @coalesce()
     def get_favorite_phrases(self, user_id=None):
         """Obtiene solo las frases favoritas"""
         try:
@@ -142,11 +365,23 @@ class SupabaseService:
                 query = query.eq('user_id', user_id)
             
             response = query.execute()
-            return self._map_phrase_data(response.data)
+            rows = self._map_phrase_data(response.data)
+            
+            if self.write_queue is not None and user_id:
+                # Frases marcadas como favoritas que aún no se han volcado a la DB
+                known = {phrase.id for phrase in rows}
+                ids = [phrase_id for phrase_id, is_favorite in self.write_queue.favorite_overrides().items()
+                       if is_favorite and phrase_id not in known]
+                if ids:
+                    extra = self.supabase.table('phrases').select('*').eq('user_id', user_id).in_('id', ids).execute()
+                    rows = rows + self._map_phrase_data(extra.data)
+                rows = self._with_pending_writes(rows, user_id, include=lambda phrase: phrase.is_favorite)
+            return rows
         except Exception as e:
-            print(f"Error obteniendo frases favoritas: {e}")
+            logger.error("Error obteniendo frases favoritas: %s", e, extra={'user_id': user_id})
             return []
     
+    @coalesce()
     def get_phrases_by_language(self, language, user_id=None):
         """Obtiene frases filtradas por idioma"""
         try:
@@ -156,27 +391,159 @@ class SupabaseService:
                 query = query.eq('user_id', user_id)
             
             response = query.execute()
-            return self._map_phrase_data(response.data)
+            return self._with_pending_writes(self._map_phrase_data(response.data), user_id,
+                                             include=lambda phrase: phrase.language == language)
         except Exception as e:
-            print(f"Error obteniendo frases por idioma: {e}")
+            logger.error("Error obteniendo frases por idioma: %s", e, extra={'user_id': user_id})
             return []
 
+    @coalesce()
+    def list_phrases(self, user_id, limit=COLLECTION_PAGE_SIZE, cursor=None, favorites=False, language=None):
+        """Página de frases por keyset (created_at, id) en lugar de OFFSET"""
+        position = decode_cursor(cursor) if cursor else None
+        try:
+            query = self.supabase.table('phrases').select('*').eq('user_id', user_id)
+            if favorites:
+                query = query.eq('is_favorite', True)
+            if language:
+                query = query.eq('language', language)
+            if position:
+                created_at, phrase_id = (f'"{value}"' for value in position)
+                query = query.or_(f"created_at.lt.{created_at},and(created_at.eq.{created_at},id.lt.{phrase_id})")
+            response = query.order('created_at', desc=True).order('id', desc=True).limit(limit + 1).execute()
+            rows = self._map_phrase_data(response.data)
+            has_more = len(rows) > limit
+            
+            if self.write_queue is not None:
+                def include(phrase):
+                    return ((not favorites or phrase.is_favorite)
+                            and (not language or phrase.language == language)
+                            and (position is None or is_before_cursor(phrase, position)))
+                
+                if favorites:
+                    # Frases marcadas como favoritas que aún no se han volcado a la DB
+                    known = {phrase.id for phrase in rows}
+                    ids = [phrase_id for phrase_id, is_favorite in self.write_queue.favorite_overrides().items()
+                           if is_favorite and phrase_id not in known]
+                    if ids:
+                        extra = self.supabase.table('phrases').select('*').eq('user_id', user_id).in_('id', ids).execute()
+                        rows = rows + self._map_phrase_data(extra.data)
+                rows = self._with_pending_writes(rows, user_id, include=include)
+                rows.sort(key=lambda phrase: (str(phrase.created_at or ''), phrase.id), reverse=True)
+                has_more = has_more or len(rows) > limit
+            
+            page = rows[:limit]
+            return page, encode_cursor(page[-1]) if has_more and page else None
+        except Exception as e:
+            logger.error("Error listando frases: %s", e, extra={'user_id': user_id})
+            return [], None
+
+    @coalesce()
     def get_phrase_by_id(self, phrase_id):
         """Obtiene una frase específica por ID"""
         try:
+            if self.write_queue is not None:
+                pending = self.write_queue.get_pending(phrase_id)
+                if pending:
+                    return self._map_phrase_data(pending)
+            
             response = self.supabase.table('phrases').select('*').eq('id', phrase_id).execute()
             if response.data:
-                return self._map_phrase_data(response.data[0])
+                return self._with_pending_writes(self._map_phrase_data(response.data[:1]))[0]
             return None
         except Exception as e:
-            print(f"Error obteniendo frase por ID: {e}")
+            logger.error("Error obteniendo frase por ID: %s", e, extra={'phrase_id': phrase_id})
             return None
 
+    def get_phrases_by_ids(self, user_id, phrase_ids):
+        """Frases del usuario con esos ids en una consulta (filtrada por dueño)"""
+        if not phrase_ids:
+            return []
+        try:
+            response = self.supabase.table('phrases').select('*').eq('user_id', user_id) \
+                .in_('id', list(phrase_ids)).order('created_at', desc=True).execute()
+            rows = self._map_phrase_data(response.data)
+            if self.write_queue is not None:
+                wanted = set(phrase_ids)
+                rows = self._with_pending_writes(rows, user_id, include=lambda phrase: phrase.id in wanted)
+            return rows
+        except Exception as e:
+            logger.error("Error obteniendo frases por ids: %s", e, extra={'user_id': user_id})
+            return []
+
+    def set_favorites(self, user_id, phrase_ids, is_favorite):
+        """Marca o desmarca varias frases del usuario con un solo UPDATE ... WHERE user_id AND id IN"""
+        if not phrase_ids:
+            return []
+        try:
+            if self.write_queue is not None:
+                # Write-behind: comprobar la propiedad (incluidas las pendientes) y encolar
+                owned = [phrase.id for phrase in self.get_phrases_by_ids(user_id, phrase_ids)]
+                for phrase_id in owned:
+                    self.write_queue.enqueue_favorite(phrase_id, is_favorite, user_id=user_id)
+            else:
+                response = self.supabase.table('phrases').update({
+                    'is_favorite': is_favorite,
+                    'updated_at': datetime.utcnow().isoformat()
+                }).eq('user_id', user_id).in_('id', list(phrase_ids)).execute()
+                owned = [row['id'] for row in response.data]
+            if owned:
+                data_versions.bump(user_id)
+            return owned
+        except Exception as e:
+            logger.error("Error actualizando favoritos: %s", e, extra={'user_id': user_id})
+            return []
+
+    def delete_phrases(self, user_id, phrase_ids):
+        """Elimina varias frases del usuario con un solo DELETE ... WHERE user_id AND id IN"""
+        if not phrase_ids:
+            return []
+        try:
+            pending = []
+            if self.write_queue is not None:
+                # Descartar de la cola las pendientes del usuario para que el volcado no las resucite
+                wanted = set(phrase_ids)
+                pending = [row['id'] for row in self.write_queue.pending_for_user(user_id) if row['id'] in wanted]
+                for phrase_id in pending:
+                    self.write_queue.discard(phrase_id)
+            response = self.supabase.table('phrases').delete().eq('user_id', user_id) \
+                .in_('id', list(phrase_ids)).execute()
+            deleted = [row['id'] for row in response.data]
+            if self.write_queue is not None:
+                # Y los cambios de favorito pendientes de las que ya estaban en la DB
+                for phrase_id in deleted:
+                    self.write_queue.discard(phrase_id)
+            deleted += [phrase_id for phrase_id in pending if phrase_id not in deleted]
+            if deleted:
+                data_versions.bump(user_id)
+            return deleted
+        except Exception as e:
+            logger.error("Error eliminando frases: %s", e, extra={'user_id': user_id})
+            return []
+
     def toggle_favorite(self, phrase_id):
         """Cambia el estado de favorito de una frase"""
         try:
-            # Primero obtener la frase actual
-            response = self.supabase.table('phrases').select('is_favorite').eq('id', phrase_id).execute()
+            if self.write_queue is not None:
+                # Write-behind: el valor actual puede estar aún en la cola
+                pending = self.write_queue.get_pending(phrase_id)
+                if pending:
+                    current_favorite, owner = pending['is_favorite'], pending['user_id']
+                else:
+                    response = self.supabase.table('phrases').select('is_favorite, user_id').eq('id', phrase_id).execute()
+                    if not response.data:
+                        return None
+                    owner = response.data[0]['user_id']
+                    current_favorite = self.write_queue.favorite_override(phrase_id)
+                    if current_favorite is None:
+                        current_favorite = response.data[0]['is_favorite']
+                new_favorite = not current_favorite
+                self.write_queue.enqueue_favorite(phrase_id, new_favorite, user_id=owner)
+                data_versions.bump(owner)
+                return new_favorite
+            
+            # Primero obtener la frase actual (y su dueño, para la versión de datos)
+            response = self.supabase.table('phrases').select('is_favorite, user_id').eq('id', phrase_id).execute()
             
             if response.data:
                 current_favorite = response.data[0]['is_favorite']
@@ -184,23 +551,35 @@ class SupabaseService:
                 
                 # Actualizar el estado
                 update_response = self.supabase.table('phrases').update({'is_favorite': new_favorite}).eq('id', phrase_id).execute()
+                data_versions.bump(response.data[0]['user_id'])
                 
                 return new_favorite
             return None
             
         except Exception as e:
-            print(f"Error cambiando favorito: {e}")
+            logger.error("Error cambiando favorito: %s", e, extra={'phrase_id': phrase_id})
             return None
     
     def delete_phrase(self, phrase_id):
         """Elimina una frase"""
         try:
+            owners = set()
+            if self.write_queue is not None:
+                # Evitar que el volcado posterior resucite la frase
+                pending = self.write_queue.get_pending(phrase_id)
+                if pending:
+                    owners.add(pending['user_id'])
+                self.write_queue.discard(phrase_id)
             response = self.supabase.table('phrases').delete().eq('id', phrase_id).execute()
+            owners.update(row.get('user_id') for row in response.data)
+            for owner in owners:
+                data_versions.bump(owner)
             return True
         except Exception as e:
-            print(f"Error eliminando frase: {e}")
+            logger.error("Error eliminando frase: %s", e, extra={'phrase_id': phrase_id})
             return False
     
+    @coalesce()
     def get_stats(self, user_id=None):
         """Obtiene estadísticas de la base de datos"""
         try:
@@ -208,38 +587,28 @@ class SupabaseService:
             phrases = self.get_all_phrases(user_id)
             
             if not phrases:
-                return {
-                    'total_phrases': 0,
-                    'favorite_phrases': 0,
-                    'language_stats': {},
-                    'style_stats': {},
-                    'emotion_length_stats': {
-                        'short': 0,  # < 50 caracteres
-                        'medium': 0,  # 50-150 caracteres
-                        'long': 0     # > 150 caracteres
-                    }
-                }
+                return self.empty_stats()
             
             # Calcular estadísticas
             total_phrases = len(phrases)
-            favorite_phrases = len([p for p in phrases if p.get('is_favorite', False)])
+            favorite_phrases = len([p for p in phrases if p.is_favorite])
             
             # Estadísticas por idioma
             language_stats = {}
             for phrase in phrases:
-                lang = phrase.get('language', 'es')
+                lang = phrase.language or 'es'
                 language_stats[lang] = language_stats.get(lang, 0) + 1
             
             # Estadísticas por estilo
             style_stats = {}
             for phrase in phrases:
-                style = phrase.get('style', 'unknown')
+                style = phrase.style or 'unknown'
                 style_stats[style] = style_stats.get(style, 0) + 1
             
             # Estadísticas por longitud de emoción
             emotion_length_stats = {'short': 0, 'medium': 0, 'long': 0}
             for phrase in phrases:
-                emotion_length = len(phrase.get('original_emotion', ''))
+                emotion_length = len(phrase.original_emotion or '')
                 if emotion_length < 50:
                     emotion_length_stats['short'] += 1
                 elif emotion_length < 150:
@@ -256,24 +625,28 @@ class SupabaseService:
             }
             
         except Exception as e:
-            print(f"Error obteniendo estadísticas: {e}")
-            return {
-                'total_phrases': 0,
-                'favorite_phrases': 0,
-                'language_stats': {},
-                'style_stats': {},
-                'emotion_length_stats': {'short': 0, 'medium': 0, 'long': 0}
-            }
+            logger.error("Error obteniendo estadísticas: %s", e, extra={'user_id': user_id})
+            return self.empty_stats()
 
+    @coalesce()
     def get_phrase_count(self, user_id):
         """Cuenta el número de frases creadas por un usuario"""
         try:
             # count='exact', head=True solo devuelve el conteo sin los datos
             response = self.supabase.table('phrases').select('*', count='exact', head=True).eq('user_id', user_id).execute()
-            print(f"🔍 Conteo de frases para {user_id}: {response.count}")
-            return response.count if response.count is not None else 0
+            count = response.count if response.count is not None else 0
+            if self.write_queue is not None:
+                pending = [row['id'] for row in self.write_queue.pending_for_user(user_id)]
+                if pending:
+                    # Las que la DB ya cuenta no se suman otra vez
+                    stored = self.supabase.table('phrases').select('id').in_('id', pending).execute()
+                    settled = [row['id'] for row in stored.data]
+                    if settled:
+                        self.write_queue.settle(settled)
+                    count += len(pending) - len(settled)
+            return count
         except Exception as e:
-            print(f"Error contando frases: {e}")
+            logger.error("Error contando frases: %s", e, extra={'user_id': user_id})
             return 0
 
 # Instancia global del servicio
@@ -0,0 +1,346 @@
+#!/usr/bin/env python3
+"""
+Renovación anticipada de los tokens de Auth guardados en la sesión.
+
+La caducidad se lee del propio access token (claim exp), sin red. Si quedan más
+de TOKEN_REFRESH_MARGIN segundos no se hace nada; dentro de ese margen el token
+todavía sirve, así que se renueva en segundo plano (o en la propia petición con
+TOKEN_REFRESH_ASYNC=false) y la siguiente petición recoge el par nuevo, aunque
+llegue horas después; si ya caducó, se renueva antes de seguir.
+
+En Supabase los refresh tokens son de un solo uso: canjear dos veces el mismo
+cierra la sesión. Por eso cada canje se reserva y su resultado se publica en un
+almacén compartido por los workers (SQLite por defecto, Redis si está
+configurado) antes de que nadie más pueda usar el token viejo: el worker que
+llegue después con ese token recoge el par nuevo en lugar de canjearlo otra vez.
+"""
+
+import base64
+import binascii
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from dotenv import load_dotenv
+
+from config.redis_config import get_redis_client
+from services.cache import TTLCache
+from services.sessions import SESSION_TTL
+from services.singleflight import SingleFlight
+
+try:
+    import jwt
+except ImportError:
+    jwt = None
+
+# Cargar variables de entorno desde .env
+load_dotenv()
+
+TOKEN_REFRESH_MARGIN = int(os.environ.get("TOKEN_REFRESH_MARGIN", "300"))
+TOKEN_REFRESH_ASYNC = os.environ.get("TOKEN_REFRESH_ASYNC", "true").lower() == "true"
+# Tiempo que se recuerda el par emitido para un refresh token ya canjeado: lo que dura
+# una sesión, porque una sesión inactiva vuelve con el refresh token que tenía guardado
+TOKEN_ROTATION_TTL = int(os.environ.get("TOKEN_ROTATION_TTL", str(SESSION_TTL)))
+TOKEN_ROTATION_BACKEND = os.environ.get("TOKEN_ROTATION_BACKEND", "")   # memory | sqlite | redis
+TOKEN_ROTATION_PATH = os.environ.get("TOKEN_ROTATION_PATH", "instance/token_rotations.db")
+# Máximo que se espera a que otro worker termine el canje del mismo refresh token
+TOKEN_REFRESH_WAIT_TIMEOUT = float(os.environ.get("TOKEN_REFRESH_WAIT_TIMEOUT", "10"))
+# Secreto JWT del proyecto (Settings > API): permite verificar los access tokens sin red
+SUPABASE_JWT_SECRET = os.environ.get("SUPABASE_JWT_SECRET", "")
+
+ACCESS_TOKEN_KEY = 'sb_access_token'
+REFRESH_TOKEN_KEY = 'sb_refresh_token'
+
+logger = logging.getLogger(__name__)
+
+
+def jwt_claims(token):
+    """Claims de un JWT sin verificar la firma, o None si no es un JWT"""
+    try:
+        payload = token.split('.')[1]
+        return json.loads(base64.urlsafe_b64decode(payload + '=' * (-len(payload) % 4)))
+    except (AttributeError, IndexError, binascii.Error, UnicodeDecodeError, ValueError):
+        return None
+
+
+def jwt_expires_at(token):
+    """Claim exp de un JWT (epoch) sin verificar la firma, o None"""
+    claims = jwt_claims(token)
+    exp = claims.get('exp') if isinstance(claims, dict) else None
+    return exp if isinstance(exp, (int, float)) else None
+
+
+def verify_jwt(token, secret):
+    """Claims de un JWT HS256 con firma y caducidad válidas, o None (requiere PyJWT)"""
+    if jwt is None or not secret or not token:
+        return None
+    try:
+        # La audiencia ('authenticated') no se comprueba: solo importan firma, exp y sub
+        return jwt.decode(token, secret, algorithms=['HS256'],
+                          options={'require': ['exp', 'sub'], 'verify_aud': False})
+    except jwt.PyJWTError:
+        return None
+
+
+def _token_key(refresh_token):
+    # Los refresh tokens no se guardan en claro como claves de caché
+    return hashlib.blake2b(refresh_token.encode('utf-8'), digest_size=16).hexdigest()
+
+
+# Almacenes de canjes: claim() reserva el canje de un refresh token o informa de
+# que otro ya lo hizo (con el par nuevo) o lo está haciendo; la reserva caduca
+# sola a los `pending_ttl` segundos si su dueño muere a medias
+
+CLAIMED, ROTATED, PENDING = 'claimed', 'rotated', 'pending'
+
+
+class InMemoryRotationStore:
+    """Canjes en memoria del proceso (solo para un único worker o pruebas)"""
+
+    def __init__(self):
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    def claim(self, key, pending_ttl):
+        now = time.time()
+        with self._lock:
+            pair, expires_at = self._entries.get(key, (None, 0))
+            if expires_at > now:
+                return (ROTATED, pair) if pair else (PENDING, None)
+            self._entries[key] = (None, now + pending_ttl)
+            return CLAIMED, None
+
+    def get(self, key):
+        with self._lock:
+            pair, expires_at = self._entries.get(key, (None, 0))
+        return pair if expires_at > time.time() else None
+
+    def complete(self, key, pair, ttl):
+        with self._lock:
+            self._entries[key] = (tuple(pair), time.time() + ttl)
+            if len(self._entries) > 1024:
+                now = time.time()
+                for k in [k for k, (_, expires_at) in self._entries.items() if expires_at <= now]:
+                    del self._entries[k]
+
+    def release(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+
+class SQLiteRotationStore:
+    """Canjes en un archivo SQLite compartido por los workers de una máquina"""
+
+    def __init__(self, path):
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None, timeout=5)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS token_rotations "
+                           "(key TEXT PRIMARY KEY, access_token TEXT, refresh_token TEXT, expires_at REAL NOT NULL)")
+        self._lock = threading.Lock()
+
+    def claim(self, key, pending_ttl):
+        now = time.time()
+        with self._lock:
+            # BEGIN IMMEDIATE: la lectura y la reserva son atómicas entre procesos
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                self._conn.execute("DELETE FROM token_rotations WHERE expires_at <= ?", (now,))
+                row = self._conn.execute("SELECT access_token, refresh_token FROM token_rotations WHERE key = ?",
+                                         (key,)).fetchone()
+                if row is None:
+                    self._conn.execute("INSERT INTO token_rotations VALUES (?, NULL, NULL, ?)",
+                                       (key, now + pending_ttl))
+                self._conn.execute("COMMIT")
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+        if row is None:
+            return CLAIMED, None
+        return (ROTATED, tuple(row)) if row[0] else (PENDING, None)
+
+    def get(self, key):
+        with self._lock:
+            row = self._conn.execute("SELECT access_token, refresh_token FROM token_rotations "
+                                     "WHERE key = ? AND expires_at > ?", (key, time.time())).fetchone()
+        return tuple(row) if row and row[0] else None
+
+    def complete(self, key, pair, ttl):
+        with self._lock:
+            self._conn.execute("INSERT OR REPLACE INTO token_rotations VALUES (?, ?, ?, ?)",
+                               (key, pair[0], pair[1], time.time() + ttl))
+
+    def release(self, key):
+        with self._lock:
+            self._conn.execute("DELETE FROM token_rotations WHERE key = ?", (key,))
+
+
+class RedisRotationStore:
+    """Canjes compartidos entre máquinas; Redis los expira solo"""
+
+    PENDING_VALUE = b'__pending__'
+
+    def __init__(self, client):
+        self.client = client
+
+    def _key(self, key):
+        return f"token_rotation:{key}"
+
+    def claim(self, key, pending_ttl):
+        if self.client.set(self._key(key), self.PENDING_VALUE, nx=True, ex=max(1, int(pending_ttl))):
+            return CLAIMED, None
+        pair = self.get(key)
+        return (ROTATED, pair) if pair else (PENDING, None)
+
+    def get(self, key):
+        value = self.client.get(self._key(key))
+        if value is None or value == self.PENDING_VALUE:
+            return None
+        return tuple(json.loads(value))
+
+    def complete(self, key, pair, ttl):
+        self.client.set(self._key(key), json.dumps(list(pair)), ex=max(1, int(ttl)))
+
+    def release(self, key):
+        self.client.delete(self._key(key))
+
+
+def _create_store():
+    """Redis si está configurado; si no, un archivo SQLite compartido entre workers"""
+    backend = TOKEN_ROTATION_BACKEND.lower()
+    if backend in ('', 'redis'):
+        client = get_redis_client()
+        if client is not None:
+            return RedisRotationStore(client)
+    if backend == 'memory':
+        return InMemoryRotationStore()
+    return SQLiteRotationStore(TOKEN_ROTATION_PATH)
+
+
+class TokenManager:
+    """Mantiene vigentes el access token y el refresh token de la sesión de Flask"""
+
+    POLL_INTERVAL = 0.05
+
+    def __init__(self, storage, margin=TOKEN_REFRESH_MARGIN, async_refresh=TOKEN_REFRESH_ASYNC,
+                 rotation_ttl=TOKEN_ROTATION_TTL, store=None, wait_timeout=TOKEN_REFRESH_WAIT_TIMEOUT):
+        self.storage = storage
+        self.margin = margin
+        self.async_refresh = async_refresh
+        self.rotation_ttl = rotation_ttl
+        self.wait_timeout = wait_timeout
+        # refresh token canjeado -> (access, refresh) nuevos, compartido entre workers
+        self.store = store if store is not None else _create_store()
+        # Copia local de los canjes ya vistos, para no consultar el almacén en cada petición
+        self._rotations = TTLCache(ttl=rotation_ttl, max_entries=10_000, name='token_rotations')
+        self._flight = SingleFlight('token_refresh')
+        self._executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="token-refresh")
+        self._scheduled = set()
+
+    def _rotated(self, key):
+        """Par ya emitido para el refresh token (de este worker o de otro), o None"""
+        rotated = self._rotations.get(key)
+        if rotated is None:
+            rotated = self.store.get(key)
+            if rotated is not None:
+                self._rotations.set(key, rotated)
+        return rotated
+
+    def _redeem(self, key, refresh_token):
+        """Canjea el refresh token una sola vez entre todos los workers"""
+        deadline = time.monotonic() + self.wait_timeout
+        while True:
+            state, rotated = self.store.claim(key, self.wait_timeout)
+            if state == ROTATED:
+                return rotated
+            if state == CLAIMED:
+                break
+            # Otro worker lo está canjeando: esperar su resultado
+            if time.monotonic() >= deadline:
+                raise TimeoutError("Otro worker no terminó de renovar el token")
+            time.sleep(self.POLL_INTERVAL)
+
+        try:
+            rotated = tuple(self.storage.refresh_tokens(refresh_token))
+        except BaseException:
+            # El token no se llegó a canjear (o no era válido): otro puede intentarlo
+            self.store.release(key)
+            raise
+        self.store.complete(key, rotated, self.rotation_ttl)
+        return rotated
+
+    def _refresh(self, refresh_token):
+        """Par nuevo para el refresh token: el ya emitido, el del canje en curso o uno nuevo"""
+        key = _token_key(refresh_token)
+        rotated = self._rotations.get(key)
+        if rotated is not None:
+            return rotated
+
+        def refresh():
+            rotated = self._rotations.get(key)
+            if rotated is None:
+                rotated = self._redeem(key, refresh_token)
+                self._rotations.set(key, rotated)
+            return rotated
+        return self._flight.do(key, refresh)
+
+    def _refresh_in_background(self, refresh_token):
+        key = _token_key(refresh_token)
+        if key in self._scheduled:
+            return
+
+        def run():
+            try:
+                self._refresh(refresh_token)
+            except Exception as e:
+                logger.warning("Error renovando el token en segundo plano: %s", e)
+            finally:
+                self._scheduled.discard(key)
+
+        self._scheduled.add(key)
+        self._executor.submit(run)
+
+    def fresh_access_token(self, session):
+        """
+        Access token vigente de la sesión, renovándolo si hace falta y guardando el
+        par nuevo en la sesión; None si no hay tokens o la renovación falla
+        """
+        access_token = session.get(ACCESS_TOKEN_KEY)
+        refresh_token = session.get(REFRESH_TOKEN_KEY)
+        if not access_token or not refresh_token:
+            return access_token
+
+        pair = (access_token, refresh_token)
+        while True:
+            expires_at = self.storage.token_expires_at(pair[0])
+            remaining = expires_at - time.time() if expires_at is not None else 0
+            # Fuera del margen nadie lo ha renovado todavía: ni siquiera hace falta mirar el almacén
+            if remaining > self.margin:
+                break
+
+            # Otra petición, el hilo de fondo u otro worker ya lo renovó. Tras una inactividad
+            # larga ese par también puede haber caducado (y haberse renovado a su vez): se sigue
+            # la cadena hasta el último par emitido
+            rotated = self._rotated(_token_key(pair[1]))
+            if rotated is not None:
+                pair = rotated
+                continue
+            if remaining > 0 and self.async_refresh:
+                self._refresh_in_background(pair[1])
+                break
+            try:
+                pair = self._refresh(pair[1])
+            except Exception as e:
+                logger.warning("Error renovando el token: %s", e)
+                return None
+            break
+
+        if pair != (access_token, refresh_token):
+            session[ACCESS_TOKEN_KEY], session[REFRESH_TOKEN_KEY] = pair
+        return pair[0]
@@ -0,0 +1,163 @@
+#!/usr/bin/env python3
+"""
+Trazas por petición de las llamadas a Supabase/almacenamiento y OpenAI.
+
+Cada petición acumula un árbol de spans que se resume en la cabecera Server-Timing
+y, si supera TRACE_SLOW_REQUEST_MS, se registra completo en el log. Con
+TRACING_ENABLED=false no se instala ningún hook ni envoltorio.
+"""
+
+import logging
+import os
+import re
+import time
+from contextlib import contextmanager, nullcontext
+from contextvars import ContextVar
+from functools import wraps
+from dotenv import load_dotenv
+
+# Cargar variables de entorno desde .env
+load_dotenv()
+
+TRACING_ENABLED = os.environ.get("TRACING_ENABLED", "false").lower() == "true"
+# Umbral para registrar el árbol de spans de una petición lenta (0 = nunca)
+TRACE_SLOW_REQUEST_MS = float(os.environ.get("TRACE_SLOW_REQUEST_MS", "0"))
+
+logger = logging.getLogger(__name__)
+
+_current_span = ContextVar('current_span', default=None)
+_NULL_SPAN = nullcontext()
+_TOKEN_INVALID = re.compile(r"[^A-Za-z0-9!#$%&'*+.^_`|~-]")
+
+
+class Span:
+    """Intervalo con nombre y sus hijos"""
+
+    __slots__ = ('name', 'start', 'end', 'children')
+
+    def __init__(self, name):
+        self.name = name
+        self.start = time.perf_counter()
+        self.end = None
+        self.children = []
+
+    @property
+    def duration_ms(self):
+        end = self.end if self.end is not None else time.perf_counter()
+        return (end - self.start) * 1000
+
+    def walk(self, depth=0):
+        yield depth, self
+        for child in self.children:
+            yield from child.walk(depth + 1)
+
+
+@contextmanager
+def _span(name, parent):
+    span = Span(name)
+    parent.children.append(span)
+    token = _current_span.set(span)
+    try:
+        yield span
+    finally:
+        span.end = time.perf_counter()
+        _current_span.reset(token)
+
+
+def span(name):
+    """Context manager que abre un span hijo del actual (no hace nada fuera de una traza)"""
+    parent = _current_span.get() if TRACING_ENABLED else None
+    if parent is None:
+        return _NULL_SPAN
+    return _span(name, parent)
+
+
+def traced(name):
+    """Decorador que envuelve la función en un span; sin trazas la deja tal cual"""
+    def decorator(fn):
+        if not TRACING_ENABLED:
+            return fn
+
+        @wraps(fn)
+        def wrapper(*args, **kwargs):
+            parent = _current_span.get()
+            if parent is None:
+                return fn(*args, **kwargs)
+            with _span(name, parent):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def trace_methods(prefix):
+    """Decorador de clase: un span '<prefix>.<método>' por cada método público"""
+    def decorator(cls):
+        if not TRACING_ENABLED:
+            return cls
+        for attr, fn in list(vars(cls).items()):
+            if attr.startswith('_') or not callable(fn) or isinstance(fn, (staticmethod, classmethod, type)):
+                continue
+            setattr(cls, attr, traced(f"{prefix}.{attr}")(fn))
+        return cls
+    return decorator
+
+
+def start_trace(name):
+    """Abre el span raíz de la petición actual"""
+    root = Span(name)
+    return root, _current_span.set(root)
+
+
+def finish_trace(root, token):
+    root.end = time.perf_counter()
+    _current_span.reset(token)
+
+
+def server_timing(root):
+    """
+    Valor de Server-Timing: un total y una entrada por nombre de span con la
+    duración sumada y el número de llamadas
+    """
+    totals = {}
+    for depth, node in root.walk():
+        if depth == 0:
+            continue
+        duration, count = totals.get(node.name, (0.0, 0))
+        totals[node.name] = (duration + node.duration_ms, count + 1)
+
+    entries = [f"total;dur={root.duration_ms:.1f}"]
+    for name, (duration, count) in totals.items():
+        entry = f"{_TOKEN_INVALID.sub('_', name)};dur={duration:.1f}"
+        if count > 1:
+            entry += f';desc="x{count}"'
+        entries.append(entry)
+    return ", ".join(entries)
+
+
+def format_tree(root):
+    return "\n".join(f"{'  ' * depth}{node.name} {node.duration_ms:.1f}ms" for depth, node in root.walk())
+
+
+def init_app(app):
+    """Abre una traza por petición y añade Server-Timing a la respuesta"""
+    if not TRACING_ENABLED:
+        return
+
+    from flask import g, request
+
+    @app.before_request
+    def _start_request_trace():
+        g._trace = start_trace(f"{request.method} {request.path}")
+
+    @app.after_request
+    def _finish_request_trace(response):
+        trace = g.pop('_trace', None)
+        if trace is None:
+            return response
+        root, token = trace
+        finish_trace(root, token)
+        response.headers.add('Server-Timing', server_timing(root))
+        if TRACE_SLOW_REQUEST_MS and root.duration_ms >= TRACE_SLOW_REQUEST_MS:
+            logger.warning("Petición lenta (%.0fms >= %.0fms):\n%s",
+                           root.duration_ms, TRACE_SLOW_REQUEST_MS, format_tree(root))
+        return response
@@ -0,0 +1,374 @@
+#!/usr/bin/env python3
+"""
+Cola write-behind duradera (SQLite) para escrituras de frases.
+
+El overlay de lecturas vive en memoria, así que la cola admite un único proceso:
+toma un bloqueo exclusivo sobre `<path>.lock` y, si otro worker lo retiene más de
+LOCK_TIMEOUT segundos (margen para el relevo de un reload), se niega a arrancar.
+Cada fila guarda el proceso que la encoló (`owner`, host:pid); las de un proceso
+que ya no existe (o de versiones sin `owner`) las adopta el siguiente que arranca.
+
+Si un lote falla, se reenvía frase a frase: las que siguen fallando suman un
+intento y esperan cada vez más antes del siguiente, sin bloquear las escrituras
+posteriores. Tras MAX_ATTEMPTS pasan a la tabla dead_writes con un log de error.
+"""
+
+import atexit
+import json
+import logging
+import os
+import socket
+import sqlite3
+import threading
+import time
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+# Cada cuánto se buscan filas de procesos que terminaron sin volcarlas
+CLAIM_INTERVAL = 60.0
+# Fallos de una misma frase antes de apartarla a dead_writes, con espera exponencial
+# entre intentos (interval, 2·interval, ... hasta MAX_BACKOFF): unos 20 minutos en total
+MAX_ATTEMPTS = 10
+MAX_BACKOFF = 300.0
+# Espera máxima por el bloqueo de la cola antes de rechazar un segundo proceso
+LOCK_TIMEOUT = 30.0
+
+
+def _owner_alive(owner):
+    """Indica si el proceso dueño de unas filas sigue vivo (los de otra máquina se suponen vivos)"""
+    if not owner:
+        return False
+    host, _, pid = owner.rpartition(':')
+    if host != socket.gethostname():
+        return True
+    try:
+        os.kill(int(pid), 0)
+    except (ProcessLookupError, ValueError):
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+class WriteBehindQueue:
+    """
+    Guarda las escrituras en una cola local y las envía por lotes en segundo plano.
+    Mantiene un overlay en memoria con las escrituras pendientes para que las
+    lecturas siguientes vean los cambios (read-your-writes) antes del volcado.
+    """
+
+    def __init__(self, path, flush_fn, interval=1.0, batch_size=100, max_attempts=MAX_ATTEMPTS,
+                 lock_timeout=LOCK_TIMEOUT):
+        """flush_fn(inserts, favorites, user_ids) envía un lote; user_ids son los usuarios afectados"""
+        self._lock_file = self._acquire_process_lock(path, lock_timeout)
+        self._pid = os.getpid()
+        self.path = path
+        self.flush_fn = flush_fn
+        self.interval = interval
+        self.batch_size = batch_size
+        self.max_attempts = max_attempts
+        self.owner = f"{socket.gethostname()}:{os.getpid()}"
+
+        self._lock = threading.Lock()          # protege la conexión y el overlay
+        self._flush_lock = threading.Lock()    # serializa los volcados
+        self._wakeup = threading.Event()
+        self._stopped = False
+
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None, timeout=5)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS pending_writes (
+                seq INTEGER PRIMARY KEY AUTOINCREMENT,
+                kind TEXT NOT NULL,
+                user_id TEXT,
+                phrase_id TEXT NOT NULL,
+                payload TEXT NOT NULL,
+                owner TEXT
+            )
+        """)
+        # Columnas añadidas después: las colas anteriores a `owner` quedan sin dueño y se adoptan
+        columns = {row[1] for row in self._conn.execute("PRAGMA table_info(pending_writes)")}
+        for column, definition in (('owner', "TEXT"),
+                                   ('attempts', "INTEGER NOT NULL DEFAULT 0"),
+                                   ('next_attempt_at', "REAL NOT NULL DEFAULT 0")):
+            if column not in columns:
+                self._conn.execute(f"ALTER TABLE pending_writes ADD COLUMN {column} {definition}")
+        # Escrituras que fallaron MAX_ATTEMPTS veces: se apartan para no bloquear la cola
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS dead_writes (
+                seq INTEGER PRIMARY KEY,
+                kind TEXT NOT NULL,
+                user_id TEXT,
+                phrase_id TEXT NOT NULL,
+                payload TEXT NOT NULL,
+                error TEXT,
+                failed_at REAL NOT NULL
+            )
+        """)
+
+        # Overlay: inserciones pendientes por id y favoritos pendientes por id
+        self.pending_inserts = {}
+        self.pending_favorites = {}
+
+        # Reproducir lo que quedó en la cola de procesos anteriores
+        self._claimed_at = 0.0
+        self.claim_orphans()
+        if self.pending_inserts or self.pending_favorites:
+            logger.info("Reproduciendo %d inserciones y %d favoritos pendientes",
+                        len(self.pending_inserts), len(self.pending_favorites))
+
+        self._thread = threading.Thread(target=self._run, name="write-behind-flusher", daemon=True)
+        self._thread.start()
+        atexit.register(self.close)
+
+    @staticmethod
+    def _acquire_process_lock(path, timeout):
+        """Bloqueo exclusivo de la cola: un segundo proceso no vería el overlay del primero"""
+        if fcntl is None:
+            return None
+        lock_file = open(path + '.lock', 'a')
+        deadline = time.monotonic() + timeout
+        while True:
+            try:
+                fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                return lock_file
+            except BlockingIOError:
+                if time.monotonic() >= deadline:
+                    lock_file.close()
+                    raise RuntimeError(
+                        f"La cola write-behind {path} ya está en uso por otro proceso: "
+                        "SUPABASE_WRITE_BEHIND requiere un único worker (gunicorn -w 1)")
+                time.sleep(0.5)
+
+    def _check_process(self):
+        # Con --preload el bloqueo se hereda en el fork: los hijos no deben usar la cola
+        if os.getpid() != self._pid:
+            raise RuntimeError("La cola write-behind no se comparte entre procesos: "
+                               "SUPABASE_WRITE_BEHIND requiere un único worker (gunicorn -w 1)")
+
+    def claim_orphans(self):
+        """Adopta las filas de procesos que ya no existen y las añade al overlay"""
+        self._claimed_at = time.monotonic()
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                owners = [owner for (owner,) in self._conn.execute(
+                    "SELECT DISTINCT owner FROM pending_writes WHERE owner IS NULL OR owner != ?", (self.owner,))]
+                orphans = [owner for owner in owners if not _owner_alive(owner)]
+                claimed = []
+                for owner in orphans:
+                    claimed += self._conn.execute(
+                        "SELECT seq, kind, phrase_id, payload FROM pending_writes WHERE owner IS ?", (owner,)).fetchall()
+                    self._conn.execute("UPDATE pending_writes SET owner = ? WHERE owner IS ?", (self.owner, owner))
+                self._conn.execute("COMMIT")
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+            for _, kind, phrase_id, payload in sorted(claimed):
+                self._apply_to_overlay(kind, phrase_id, json.loads(payload))
+        if claimed:
+            logger.info("Adoptadas %d escrituras pendientes de procesos terminados", len(claimed))
+        return len(claimed)
+
+    def _apply_to_overlay(self, kind, phrase_id, payload):
+        if kind == 'insert':
+            self.pending_inserts[phrase_id] = payload
+        elif kind == 'favorite':
+            if phrase_id in self.pending_inserts:
+                self.pending_inserts[phrase_id]['is_favorite'] = payload['is_favorite']
+            else:
+                self.pending_favorites[phrase_id] = payload['is_favorite']
+
+    def enqueue_insert(self, row):
+        """Encola la inserción de una fila de phrases (con id ya asignado)"""
+        self._enqueue('insert', row['user_id'], row['id'], dict(row))
+
+    def enqueue_favorite(self, phrase_id, is_favorite, user_id=None):
+        """Encola un cambio de favorito"""
+        self._enqueue('favorite', user_id, phrase_id, {'is_favorite': is_favorite})
+
+    def _enqueue(self, kind, user_id, phrase_id, payload):
+        self._check_process()
+        with self._lock:
+            self._conn.execute(
+                "INSERT INTO pending_writes (kind, user_id, phrase_id, payload, owner) VALUES (?, ?, ?, ?, ?)",
+                (kind, user_id, phrase_id, json.dumps(payload), self.owner))
+            self._apply_to_overlay(kind, phrase_id, payload)
+            pending = len(self.pending_inserts) + len(self.pending_favorites)
+        if pending >= self.batch_size:
+            self._wakeup.set()
+
+    def discard(self, phrase_id):
+        """Descarta las escrituras pendientes de una frase (p. ej. antes de borrarla)"""
+        self._check_process()
+        with self._flush_lock, self._lock:
+            # De cualquier dueño: también las filas aún sin adoptar de un proceso anterior
+            self._conn.execute("DELETE FROM pending_writes WHERE phrase_id = ?", (phrase_id,))
+            self.pending_inserts.pop(phrase_id, None)
+            self.pending_favorites.pop(phrase_id, None)
+
+    def settle(self, phrase_ids):
+        """
+        Quita del overlay las inserciones que la DB ya contiene: reenviarlas solo
+        daría un duplicado. Un favorito posterior que siga en la cola pasa a
+        aplicarse como cambio de favorito.
+        """
+        with self._flush_lock, self._lock:
+            for phrase_id in phrase_ids:
+                row = self.pending_inserts.pop(phrase_id, None)
+                if row is None:
+                    continue
+                self._conn.execute("DELETE FROM pending_writes WHERE phrase_id = ? AND kind = 'insert' AND owner = ?",
+                                   (phrase_id, self.owner))
+                if self._conn.execute("SELECT 1 FROM pending_writes WHERE phrase_id = ? AND owner = ? LIMIT 1",
+                                      (phrase_id, self.owner)).fetchone():
+                    self.pending_favorites[phrase_id] = row.get('is_favorite', False)
+
+    def pending_for_user(self, user_id):
+        """Copias de las inserciones pendientes de un usuario"""
+        with self._lock:
+            return [dict(row) for row in self.pending_inserts.values() if row['user_id'] == user_id]
+
+    def get_pending(self, phrase_id):
+        """Copia de una inserción pendiente, o None"""
+        with self._lock:
+            row = self.pending_inserts.get(phrase_id)
+            return dict(row) if row else None
+
+    def favorite_override(self, phrase_id):
+        """Valor de favorito pendiente para una frase ya guardada, o None"""
+        with self._lock:
+            return self.pending_favorites.get(phrase_id)
+
+    def favorite_overrides(self):
+        """Copia de todos los favoritos pendientes"""
+        with self._lock:
+            return dict(self.pending_favorites)
+
+    def flush(self):
+        """Envía un lote de escrituras pendientes; retorna cuántas se confirmaron"""
+        with self._flush_lock:
+            with self._lock:
+                # Las frases que esperan un reintento no bloquean a las demás (ni se adelantan
+                # sus escrituras posteriores: un favorito no puede llegar antes que su inserción)
+                rows = self._conn.execute(
+                    "SELECT seq, kind, user_id, phrase_id, payload FROM pending_writes WHERE owner = ? "
+                    "AND phrase_id NOT IN (SELECT phrase_id FROM pending_writes WHERE owner = ? AND next_attempt_at > ?) "
+                    "ORDER BY seq LIMIT ?", (self.owner, self.owner, time.time(), self.batch_size)).fetchall()
+            if not rows:
+                return 0
+
+            # Compactar: la última versión de cada inserción y el último valor de cada favorito
+            inserts = {}
+            favorites = {}
+            users = {}
+            for seq, kind, user_id, phrase_id, payload in rows:
+                payload = json.loads(payload)
+                if user_id:
+                    users[phrase_id] = user_id
+                if kind == 'insert':
+                    inserts[phrase_id] = payload
+                elif phrase_id in inserts:
+                    inserts[phrase_id]['is_favorite'] = payload['is_favorite']
+                else:
+                    favorites[phrase_id] = payload['is_favorite']
+
+            try:
+                self.flush_fn(list(inserts.values()), favorites, set(users.values()))
+                failed = {}
+            except Exception as e:
+                logger.warning("Error volcando la cola write-behind: %s", e)
+                phrase_ids = set(inserts) | set(favorites)
+                if len(phrase_ids) > 1:
+                    failed = self._flush_one_by_one(inserts, favorites, users)
+                else:
+                    failed = dict.fromkeys(phrase_ids, str(e))
+
+            done = [row[0] for row in rows if row[3] not in failed]
+            with self._lock:
+                self._conn.execute("BEGIN IMMEDIATE")
+                try:
+                    if failed:
+                        self._record_failures(rows, failed)
+                    self._conn.execute(f"DELETE FROM pending_writes WHERE seq IN ({','.join('?' * len(done))})",
+                                       done)
+                    self._conn.execute("COMMIT")
+                except BaseException:
+                    self._conn.execute("ROLLBACK")
+                    raise
+                remaining = {phrase_id for (phrase_id,) in self._conn.execute(
+                    "SELECT DISTINCT phrase_id FROM pending_writes WHERE owner = ?", (self.owner,))}
+                for phrase_id in list(inserts) + list(favorites):
+                    if phrase_id not in remaining:
+                        self.pending_inserts.pop(phrase_id, None)
+                        self.pending_favorites.pop(phrase_id, None)
+            return len(done)
+
+    def _flush_one_by_one(self, inserts, favorites, users):
+        """Reenvía el lote frase a frase para aislar las que fallan; retorna {phrase_id: error}"""
+        failed = {}
+        for phrase_id in list(inserts) + [phrase_id for phrase_id in favorites if phrase_id not in inserts]:
+            try:
+                self.flush_fn([inserts[phrase_id]] if phrase_id in inserts else [],
+                              {phrase_id: favorites[phrase_id]} if phrase_id in favorites else {},
+                              {users[phrase_id]} if phrase_id in users else set())
+            except Exception as e:
+                failed[phrase_id] = str(e)
+        return failed
+
+    def _record_failures(self, rows, failed):
+        """
+        Suma un intento a las frases que fallaron, aplaza su siguiente intento y
+        aparta en dead_writes las que agotaron los intentos
+        """
+        now = time.time()
+        for phrase_id in failed:
+            seqs = [row[0] for row in rows if row[3] == phrase_id]
+            placeholders = ','.join('?' * len(seqs))
+            attempts = self._conn.execute(
+                f"SELECT MAX(attempts) FROM pending_writes WHERE seq IN ({placeholders})", seqs).fetchone()[0] + 1
+            retry_at = now + min(self.interval * 2 ** (attempts - 1), MAX_BACKOFF)
+            self._conn.execute(f"UPDATE pending_writes SET attempts = ?, next_attempt_at = ? "
+                               f"WHERE phrase_id = ? AND owner = ?", (attempts, retry_at, phrase_id, self.owner))
+        seqs = [row[0] for row in rows if row[3] in failed]
+        placeholders = ','.join('?' * len(seqs))
+        dead = self._conn.execute(
+            f"SELECT seq, kind, user_id, phrase_id, payload FROM pending_writes "
+            f"WHERE seq IN ({placeholders}) AND attempts >= ?", (*seqs, self.max_attempts)).fetchall()
+        for seq, kind, user_id, phrase_id, payload in dead:
+            logger.error("Escritura write-behind apartada a dead_writes tras %d intentos (%s %s): %s",
+                         self.max_attempts, kind, phrase_id, failed[phrase_id])
+            self._conn.execute("INSERT OR REPLACE INTO dead_writes VALUES (?, ?, ?, ?, ?, ?, ?)",
+                               (seq, kind, user_id, phrase_id, payload, failed[phrase_id], now))
+            self._conn.execute("DELETE FROM pending_writes WHERE seq = ?", (seq,))
+
+    def _run(self):
+        while not self._stopped:
+            self._wakeup.wait(self.interval)
+            self._wakeup.clear()
+            if time.monotonic() - self._claimed_at >= CLAIM_INTERVAL:
+                try:
+                    self.claim_orphans()
+                except sqlite3.Error as e:
+                    logger.warning("Error adoptando escrituras pendientes: %s", e)
+            # Vaciar mientras haya lotes completos
+            while self.flush() >= self.batch_size:
+                pass
+
+    def close(self):
+        """Detiene el volcado en segundo plano y vuelca lo pendiente"""
+        if self._stopped or os.getpid() != self._pid:
+            return
+        self._stopped = True
+        self._wakeup.set()
+        while self.flush():
+            pass
+        if self._lock_file is not None:
+            self._lock_file.close()
+            self._lock_file = None
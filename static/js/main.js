@@ -334,6 +334,34 @@ document.addEventListener('DOMContentLoaded', function () {
     // Delete confirmation is now handled by the global deletePhrase function
 });
 
+// Idempotency keys: one key per logical submission, reused by double clicks and retries
+function generateIdempotencyKey() {
+    if (window.crypto && window.crypto.randomUUID) {
+        return window.crypto.randomUUID();
+    }
+    return Date.now().toString(36) + '-' + Math.random().toString(36).slice(2);
+}
+
+document.querySelectorAll('form[data-idempotent]').forEach(form => {
+    const keyInput = form.querySelector('input[name="idempotency_key"]');
+    if (!keyInput) {
+        return;
+    }
+
+    form.addEventListener('submit', function () {
+        // Only the first submit creates the key; later submits of the same
+        // content send it again so the server answers with the stored result
+        if (!keyInput.value) {
+            keyInput.value = generateIdempotencyKey();
+        }
+    });
+
+    // Editing the form starts a new logical submission
+    form.addEventListener('input', function () {
+        keyInput.value = '';
+    });
+});
+
 // Copy to clipboard functionality
 // Copy to clipboard functionality
 function copyToClipboard(text) {
@@ -397,37 +425,116 @@ function sharePhrase(text) {
     }
 }
 
-// Toggle favorite status
-function toggleFavorite(phraseId) {
-    const favoriteBtn = document.getElementById(`favoriteBtn${phraseId}`) || document.getElementById('favoriteBtn');
+// Favorites: toggles update the UI at once (optimistic) and are synced in a single
+// debounced batch to /api/phrases/batch, one request per operation
+const FAVORITE_SYNC_DELAY = 400; // ms without clicks before syncing
+
+function getFavoriteButton(phraseId) {
+    return document.getElementById(`favoriteBtn${phraseId}`) || document.getElementById('favoriteBtn');
+}
+
+function setFavoriteButton(phraseId, isFavorite) {
+    const favoriteBtn = getFavoriteButton(phraseId);
+    if (favoriteBtn) {
+        favoriteBtn.classList.toggle('btn-outline-danger', isFavorite);
+        favoriteBtn.classList.toggle('btn-outline-secondary', !isFavorite);
+        favoriteBtn.innerHTML = `<i class="${isFavorite ? 'fas' : 'far'} fa-heart"></i>`;
+    }
+    if (phraseCollection) {
+        phraseCollection.update(phraseId, { is_favorite: isFavorite });
+    }
+}
+
+class FavoriteSync {
+    constructor() {
+        this.pending = new Map();   // id -> wanted is_favorite, not sent yet
+        this.confirmed = new Map(); // id -> last is_favorite known to the server
+        this.inFlight = new Map();  // id -> is_favorite sent and not answered yet
+        this.timer = null;
+    }
 
-    fetch(`/favorite/${phraseId}`, {
-        method: 'POST',
-        headers: {
-            'Content-Type': 'application/json',
+    toggle(phraseId) {
+        const favoriteBtn = getFavoriteButton(phraseId);
+        const current = this.pending.has(phraseId)
+            ? this.pending.get(phraseId)
+            : !!favoriteBtn && favoriteBtn.classList.contains('btn-outline-danger');
+        if (!this.confirmed.has(phraseId)) {
+            this.confirmed.set(phraseId, current);
         }
-    })
-        .then(response => response.json())
-        .then(data => {
-            if (data.success) {
-                if (favoriteBtn) {
-                    if (data.is_favorite) {
-                        favoriteBtn.classList.remove('btn-outline-secondary');
-                        favoriteBtn.classList.add('btn-outline-danger');
-                        favoriteBtn.innerHTML = '<i class="fas fa-heart"></i>';
-                    } else {
-                        favoriteBtn.classList.remove('btn-outline-danger');
-                        favoriteBtn.classList.add('btn-outline-secondary');
-                        favoriteBtn.innerHTML = '<i class="far fa-heart"></i>';
-                    }
-                }
-                showToast(data.is_favorite ? 'Frase añadida a favoritos' : 'Frase removida de favoritos', 'success');
+        this.pending.set(phraseId, !current);
+        setFavoriteButton(phraseId, !current);
+
+        clearTimeout(this.timer);
+        this.timer = setTimeout(() => this.flush(), FAVORITE_SYNC_DELAY);
+    }
+
+    // final: the page is going away, so toggles waiting on a request in flight are sent too
+    flush(final = false) {
+        clearTimeout(this.timer);
+        const batches = { favorite: [], unfavorite: [] };
+        this.pending.forEach((wanted, phraseId) => {
+            // Queued behind the request in flight: sent once its answer updates confirmed
+            if (this.inFlight.has(phraseId) && !final) {
+                return;
             }
-        })
-        .catch(error => {
-            console.error('Error:', error);
-            showToast('Error al actualizar favoritos', 'error');
+            const known = this.inFlight.has(phraseId) ? this.inFlight.get(phraseId) : this.confirmed.get(phraseId);
+            // Toggled an even number of times: nothing to send
+            if (known !== wanted) {
+                batches[wanted ? 'favorite' : 'unfavorite'].push(phraseId);
+            }
+            this.pending.delete(phraseId);
+        });
+
+        return Promise.all(Object.entries(batches)
+            .filter(([, ids]) => ids.length > 0)
+            .map(([op, ids]) => this._send(op, ids)));
+    }
+
+    async _send(op, ids) {
+        const wanted = op === 'favorite';
+        ids.forEach(phraseId => this.inFlight.set(phraseId, wanted));
+        let failed = ids;
+        try {
+            const response = await fetch('/api/phrases/batch', {
+                method: 'POST',
+                headers: { 'Content-Type': 'application/json' },
+                body: JSON.stringify({ op, ids }),
+                keepalive: true // the sync survives navigating away
+            });
+            if (!response.ok) {
+                throw new Error(`HTTP ${response.status}`);
+            }
+            const data = await response.json();
+            data.ids.forEach(phraseId => this.confirmed.set(phraseId, wanted));
+            failed = data.missing;
+        } catch (error) {
+            console.error('Error sincronizando favoritos:', error);
+        }
+        ids.filter(phraseId => this.inFlight.get(phraseId) === wanted)
+            .forEach(phraseId => this.inFlight.delete(phraseId));
+
+        // Roll back what the server did not apply, unless the user toggled it again meanwhile
+        failed.filter(phraseId => !this.pending.has(phraseId)).forEach(phraseId => {
+            setFavoriteButton(phraseId, this.confirmed.get(phraseId));
         });
+        if (failed.length > 0) {
+            showToast('Error al actualizar favoritos', 'error');
+        }
+
+        // Toggles made while this request was in flight
+        if (ids.some(phraseId => this.pending.has(phraseId))) {
+            clearTimeout(this.timer);
+            this.timer = setTimeout(() => this.flush(), FAVORITE_SYNC_DELAY);
+        }
+    }
+}
+
+const favoriteSync = new FavoriteSync();
+window.addEventListener('pagehide', () => favoriteSync.flush(true));
+
+// Toggle favorite status
+function toggleFavorite(phraseId) {
+    favoriteSync.toggle(phraseId);
 }
 
 // Delete phrase with confirmation modal
@@ -465,6 +572,193 @@ function deletePhrase(phraseId) {
 }
 
 
+// Collection: infinite scroll over /api/phrases with block virtualization.
+// Each page is a grid block; blocks far from the viewport are emptied and keep
+// only their measured height, so the DOM stays small however long the list is.
+const COLLECTION_PREFETCH_MARGIN = 800;   // px before the end to request the next page
+const COLLECTION_VIRTUALIZE_MARGIN = 2000; // px beyond the viewport to keep blocks rendered
+
+const STYLE_BADGES = {
+    poetica_minimalista: '<i class="fas fa-leaf me-1"></i>Minimalista',
+    indirecta_redes: '<i class="fas fa-share-alt me-1"></i>Redes',
+    diario_intimo: '<i class="fas fa-book-open me-1"></i>Íntimo',
+    reflexiva: '<i class="fas fa-brain me-1"></i>Reflexiva'
+};
+
+function escapeHtml(value) {
+    return String(value ?? '').replace(/[&<>"']/g, char => ({
+        '&': '&amp;', '<': '&lt;', '>': '&gt;', '"': '&quot;', "'": '&#39;'
+    })[char]);
+}
+
+// Same markup as the server-rendered cards in collection.html
+function renderPhraseCard(phrase) {
+    const id = escapeHtml(phrase.id);
+    const text = escapeHtml(phrase.generated_phrase);
+    const favoriteClass = phrase.is_favorite ? 'danger' : 'secondary';
+    const heartClass = phrase.is_favorite ? 'fas' : 'far';
+    return `
+        <div class="col-lg-6 col-xl-4 mb-4">
+            <div class="phrase-collection-card" data-phrase-id="${id}" data-text="${text}">
+                <div class="phrase-content">
+                    <div class="phrase-text">"${text}"</div>
+                    <div class="phrase-meta">
+                        <small class="text-muted">
+                            <i class="fas fa-clock me-1"></i>${escapeHtml(String(phrase.created_at ?? '').slice(0, 10))}
+                        </small>
+                        <span class="badge bg-light text-dark border ms-2">${STYLE_BADGES[phrase.style] || ''}</span>
+                        <span class="badge bg-light text-dark border ms-2">${phrase.language === 'en' ? 'EN' : 'ES'}</span>
+                    </div>
+                    <div class="phrase-actions">
+                        <button class="btn btn-sm btn-outline-dark" data-action="copy"><i class="fas fa-copy"></i></button>
+                        <button class="btn btn-sm btn-outline-dark" data-action="share"><i class="fas fa-share"></i></button>
+                        <button class="btn btn-sm btn-outline-${favoriteClass}" data-action="favorite" id="favoriteBtn${id}">
+                            <i class="${heartClass} fa-heart"></i>
+                        </button>
+                        <button class="btn btn-sm btn-outline-danger" data-action="delete" id="deleteBtn${id}">
+                            <i class="fas fa-trash"></i>
+                        </button>
+                    </div>
+                </div>
+            </div>
+        </div>`;
+}
+
+class PhraseCollection {
+    constructor(container) {
+        this.container = container;
+        this.api = container.dataset.api;
+        this.favorites = container.dataset.favorites === '1';
+        this.language = container.dataset.language || '';
+        // The cursor sits at the end so a streamed page can emit it after the last card
+        this.sentinel = container.querySelector('.collection-sentinel');
+        this.nextCursor = this.sentinel.dataset.nextCursor || null;
+        this.phrases = new Map(); // id -> phrase data of the blocks rendered here
+        this.blocks = new Map();  // block element -> { ids, html, virtual }
+        this.loading = false;
+
+        this.blockObserver = new IntersectionObserver(
+            entries => entries.forEach(entry => this._setBlockVisible(entry.target, entry.isIntersecting)),
+            { rootMargin: `${COLLECTION_VIRTUALIZE_MARGIN}px 0px` }
+        );
+        this.sentinelObserver = new IntersectionObserver(
+            entries => { if (entries.some(entry => entry.isIntersecting)) this.loadMore(); },
+            { rootMargin: `${COLLECTION_PREFETCH_MARGIN}px 0px` }
+        );
+
+        // The first block comes from the server: keep its HTML when it is virtualized
+        container.querySelectorAll('.phrase-block').forEach(block => this._track(block, null));
+        container.addEventListener('click', event => this._onAction(event));
+        if (this.nextCursor) {
+            this.sentinelObserver.observe(this.sentinel);
+        }
+    }
+
+    _track(element, ids) {
+        this.blocks.set(element, { ids, html: null, virtual: false });
+        this.blockObserver.observe(element);
+    }
+
+    _setBlockVisible(element, visible) {
+        const block = this.blocks.get(element);
+        if (!block || block.virtual === !visible) {
+            return;
+        }
+        if (visible) {
+            element.innerHTML = block.ids
+                ? block.ids.map(id => renderPhraseCard(this.phrases.get(id))).join('')
+                : block.html;
+            block.html = null;
+            element.style.height = '';
+        } else {
+            element.style.height = `${element.offsetHeight}px`;
+            if (!block.ids) {
+                block.html = element.innerHTML;
+            }
+            element.innerHTML = '';
+        }
+        block.virtual = !visible;
+    }
+
+    _onAction(event) {
+        const button = event.target.closest('[data-action]');
+        const card = button && button.closest('[data-phrase-id]');
+        if (!card) {
+            return;
+        }
+        const phraseId = card.dataset.phraseId;
+        switch (button.dataset.action) {
+            case 'copy': copyToClipboard(card.dataset.text); break;
+            case 'share': sharePhrase(card.dataset.text); break;
+            case 'favorite': toggleFavorite(phraseId); break;
+            case 'delete': deletePhrase(phraseId); break;
+        }
+    }
+
+    update(phraseId, changes) {
+        const phrase = this.phrases.get(phraseId);
+        if (phrase) {
+            Object.assign(phrase, changes);
+        }
+    }
+
+    async loadMore() {
+        if (this.loading || !this.nextCursor) {
+            return;
+        }
+        this.loading = true;
+        const params = new URLSearchParams({ cursor: this.nextCursor });
+        if (this.favorites) params.set('favorites', '1');
+        if (this.language) params.set('language', this.language);
+
+        let retry = false;
+        try {
+            const response = await fetch(`${this.api}?${params}`, { headers: { 'Accept': 'application/json' } });
+            if (response.redirected || response.status === 401) {
+                window.location.href = '/landing';
+                return;
+            }
+            if (!response.ok) {
+                throw new Error(`HTTP ${response.status}`);
+            }
+            const data = await response.json();
+            this._appendBlock(data.phrases);
+            this.nextCursor = data.next_cursor;
+        } catch (error) {
+            console.error('Error cargando frases:', error);
+            showToast('Error al cargar más frases', 'error');
+            retry = true;
+        } finally {
+            this.loading = false;
+        }
+
+        // Re-observe the sentinel: if it is still on screen the observer fires again
+        this.sentinelObserver.unobserve(this.sentinel);
+        if (!this.nextCursor) {
+            this.sentinel.classList.add('d-none');
+        } else if (retry) {
+            setTimeout(() => this.sentinelObserver.observe(this.sentinel), 3000);
+        } else {
+            this.sentinelObserver.observe(this.sentinel);
+        }
+    }
+
+    _appendBlock(phrases) {
+        if (!phrases || phrases.length === 0) {
+            return;
+        }
+        phrases.forEach(phrase => this.phrases.set(phrase.id, phrase));
+        const element = document.createElement('div');
+        element.className = 'row phrase-block';
+        element.innerHTML = phrases.map(renderPhraseCard).join('');
+        this.container.insertBefore(element, this.sentinel);
+        this._track(element, phrases.map(phrase => phrase.id));
+    }
+}
+
+const collectionContainer = document.getElementById('phraseCollection');
+const phraseCollection = collectionContainer ? new PhraseCollection(collectionContainer) : null;
+
 // Show toast notification
 function showToast(message, type = 'info') {
     const toast = document.createElement('div');